@@ -0,0 +1,134 @@
+# app/bench/booking_contention.py
+# Benchmark tranh chấp: nhiều luồng cùng đặt vé 1 sự kiện có giới hạn sức chứa.
+# Chạy: python -m app.bench.booking_contention --threads 64 --capacity 2000 --qty 1
+# Dùng DATABASE_URL trong .env (nên là DB thử nghiệm). Tự tạo & tự dọn dữ liệu tạm.
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from ..db import DATABASE_URL
+from ..models import Ve
+from ..services import inventory
+
+
+def _setup(Session, capacity: int):
+    db = Session()
+    try:
+        uid = db.execute(text("SELECT id FROM users ORDER BY id LIMIT 1")).scalar()
+        if uid is None:
+            raise RuntimeError("Cần ít nhất 1 user trong DB để tạo vé thử")
+        db.execute(text("""
+            INSERT INTO su_kien (ten, thoi_gian, gia_ve, trang_thai, created_at, updated_at)
+            VALUES (:t, NOW(), 0, 'OPEN', NOW(), NOW())
+        """), {"t": f"[bench] contention {datetime.utcnow():%Y%m%d%H%M%S}"})
+        ev_id = db.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+        inventory.set_capacity(db, capacity, su_kien_id=ev_id)
+        db.commit()
+        return int(uid), int(ev_id)
+    finally:
+        db.close()
+
+
+def _teardown(Session, ev_id: int):
+    db = Session()
+    try:
+        db.execute(text("DELETE FROM ve WHERE su_kien_id = :id"), {"id": ev_id})
+        db.execute(text("DELETE FROM ton_kho_ve WHERE su_kien_id = :id"), {"id": ev_id})
+        db.execute(text("DELETE FROM su_kien WHERE id = :id"), {"id": ev_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _worker(Session, uid: int, ev_id: int, qty: int, stats: dict, lock: threading.Lock):
+    ok = sold_out = errors = 0
+    latencies = []
+    while True:
+        db = Session()
+        t0 = time.perf_counter()
+        try:
+            # Giống /ve/book: insert vé, trừ tồn kho, commit
+            ve = Ve(user_id=uid, su_kien_id=ev_id, so_luong=qty, tong_tien=0, trang_thai="BOOKED")
+            db.add(ve)
+            db.flush()
+            if not inventory.reserve(db, qty, su_kien_id=ev_id):
+                db.rollback()
+                sold_out += 1
+                break
+            db.commit()
+            ok += 1
+            latencies.append(time.perf_counter() - t0)
+        except Exception:
+            db.rollback()
+            errors += 1
+            if errors > 50:
+                break
+        finally:
+            db.close()
+    with lock:
+        stats["ok"] += ok
+        stats["sold_out"] += sold_out
+        stats["errors"] += errors
+        stats["lat"].extend(latencies)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=64)
+    ap.add_argument("--capacity", type=int, default=2000)
+    ap.add_argument("--qty", type=int, default=1)
+    args = ap.parse_args()
+
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=args.threads,
+        max_overflow=0,
+        pool_pre_ping=True,
+    )
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    uid, ev_id = _setup(Session, args.capacity)
+    stats = {"ok": 0, "sold_out": 0, "errors": 0, "lat": []}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_worker, args=(Session, uid, ev_id, args.qty, stats, lock))
+        for _ in range(args.threads)
+    ]
+    try:
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+        db = Session()
+        try:
+            sold = int(db.execute(
+                text("SELECT COALESCE(SUM(so_luong), 0) FROM ve WHERE su_kien_id = :id"), {"id": ev_id}
+            ).scalar() or 0)
+            stock = inventory.get_stock(db, su_kien_id=ev_id)
+        finally:
+            db.close()
+
+        lat = sorted(stats["lat"])
+        p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+        print(f"threads={args.threads} capacity={args.capacity} qty={args.qty}")
+        print(f"bookings ok={stats['ok']} sold_out={stats['sold_out']} errors={stats['errors']}")
+        print(f"elapsed={elapsed:.2f}s throughput={stats['ok'] / elapsed:.1f} bookings/s")
+        print(f"latency p50={p(0.50):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+        print(f"sold={sold} con_lai={stock['con_lai'] if stock else None}")
+
+        assert sold <= args.capacity, "OVERSELL: số vé bán vượt sức chứa"
+        assert stock and sold + stock["con_lai"] == args.capacity, "Tồn kho lệch với số vé đã bán"
+        print("OK: không bán vượt sức chứa")
+    finally:
+        _teardown(Session, ev_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# app/bench/challenge_reward_job_bench.py
+# Bench: job thưởng thử thách set-based trên nhiều user (mặc định 100k).
+# Tạo user tạm + 1 thử thách tạm + tiến độ (một phần đạt mục tiêu), chạy run_once 2 lần
+# (lần 2 phải không thưởng thêm), in thông lượng rồi tự dọn dữ liệu tạm.
+# Chạy: python -m app.bench.challenge_reward_job_bench --users 100000 --reached 0.3 --chunk 20000
+# Dùng DATABASE_URL trong .env (nên là DB thử nghiệm: job thưởng cả thử thách thật đang hiệu lực).
+import argparse
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from ..db import DATABASE_URL
+from ..services import challenge_reward_job
+
+TARGET = 5
+REWARD = 10
+
+
+def _setup(Session, n_users: int, reached: float):
+    db = Session()
+    try:
+        stamp = f"{datetime.utcnow():%Y%m%d%H%M%S}"
+        prefix = f"bench_crj_{stamp}_"
+        for lo in range(0, n_users, 5000):
+            db.execute(text("""
+                INSERT INTO users (username, password_hash, role, created_at, updated_at)
+                VALUES (:u, 'x', 'CUSTOMER', NOW(), NOW())
+            """), [{"u": f"{prefix}{i}"} for i in range(lo, min(n_users, lo + 5000))])
+        uids = [int(r[0]) for r in db.execute(
+            text("SELECT id FROM users WHERE username LIKE :p ORDER BY id"), {"p": f"{prefix}%"}
+        ).all()]
+        db.execute(text("""
+            INSERT INTO thu_thach_tuan (ten_thu_thach, muc_tieu, diem_thuong, ngay_bat_dau, ngay_ket_thuc)
+            VALUES (:t, :mt, :d, NOW() - INTERVAL 1 DAY, NOW() + INTERVAL 6 DAY)
+        """), {"t": f"[bench] reward job {stamp}", "mt": TARGET, "d": REWARD})
+        ma = int(db.execute(text("SELECT LAST_INSERT_ID()")).scalar())
+        expected = 0
+        rows = []
+        for uid in uids:
+            hit = random.random() < reached
+            expected += hit
+            rows.append({"ma": ma, "uid": uid, "v": TARGET if hit else random.randint(0, TARGET - 1)})
+        for lo in range(0, len(rows), 5000):
+            db.execute(text("""
+                INSERT INTO tien_do_thu_thach (ma_thu_thach, ma_nguoi_dung, gia_tri_hien_tai)
+                VALUES (:ma, :uid, :v)
+            """), rows[lo:lo + 5000])
+        db.commit()
+        return prefix, ma, len(uids), expected
+    finally:
+        db.close()
+
+
+def _teardown(Session, prefix: str, ma: int):
+    db = Session()
+    try:
+        users = "SELECT id FROM users WHERE username LIKE :p"
+        p = {"p": f"{prefix}%", "ma": ma}
+        db.execute(text(f"DELETE FROM so_cai_diem WHERE ma_nguoi_dung IN ({users})"), p)
+        db.execute(text(f"DELETE FROM points_balance WHERE user_id IN ({users})"), p)
+        db.execute(text("DELETE FROM challenge_rewards WHERE ma_thu_thach = :ma"), p)
+        db.execute(text("DELETE FROM tien_do_thu_thach WHERE ma_thu_thach = :ma"), p)
+        db.execute(text("DELETE FROM thu_thach_tuan WHERE ma_thu_thach = :ma"), p)
+        db.execute(text("DELETE FROM users WHERE username LIKE :p"), p)
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--reached", type=float, default=0.3, help="tỉ lệ user đạt mục tiêu")
+    ap.add_argument("--chunk", type=int, default=challenge_reward_job.CHUNK)
+    args = ap.parse_args()
+
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    t0 = time.perf_counter()
+    prefix, ma, n_users, expected = _setup(Session, args.users, args.reached)
+    print(f"seeded users={n_users} reached={expected} in {time.perf_counter() - t0:.1f}s")
+    try:
+        db = Session()
+        try:
+            first = challenge_reward_job.run_once(db, chunk=args.chunk)
+            second = challenge_reward_job.run_once(db, chunk=args.chunk)
+            rewarded = int(db.execute(
+                text("SELECT COUNT(*) FROM challenge_rewards WHERE ma_thu_thach = :ma"), {"ma": ma}
+            ).scalar() or 0)
+            linked = int(db.execute(text("""
+                SELECT COUNT(*) FROM so_cai_diem s
+                JOIN challenge_rewards c ON c.id = s.challenge_reward_id
+                WHERE c.ma_thu_thach = :ma
+            """), {"ma": ma}).scalar() or 0)
+            balance = int(db.execute(text("""
+                SELECT COALESCE(SUM(b.diem), 0) FROM points_balance b
+                JOIN users u ON u.id = b.user_id
+                WHERE u.username LIKE :p
+            """), {"p": f"{prefix}%"}).scalar() or 0)
+        finally:
+            db.close()
+
+        print(
+            f"run#1 users={first['users']} chunks={first['chunks']} rewarded={first['rewarded']} "
+            f"elapsed={first['ms']:.0f}ms throughput={first['users_per_s']:.0f} users/s"
+        )
+        print(f"run#2 rewarded={second['rewarded']} elapsed={second['ms']:.0f}ms")
+        print(f"challenge_rewards={rewarded} ledger_linked={linked} balance_sum={balance}")
+
+        assert rewarded == expected, "Số lượt thưởng lệch với số user đạt mục tiêu"
+        assert linked == rewarded, "Thiếu dòng sổ cái cho lượt thưởng"
+        assert balance == expected * REWARD, "points_balance lệch với sổ cái"
+        print("OK: mỗi user đạt mục tiêu được thưởng đúng 1 lần")
+    finally:
+        _teardown(Session, prefix, ma)
+
+
+if __name__ == "__main__":
+    main()
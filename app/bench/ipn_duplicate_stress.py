@@ -0,0 +1,131 @@
+# app/bench/ipn_duplicate_stress.py
+# Stress: bắn CÙNG 1 IPN MoMo đồng thời nhiều lần vào API đang chạy,
+# kiểm tra vé chỉ được cộng điểm đúng 1 lần (exactly-once).
+#
+# Chạy (API đang chạy với cùng .env, có thể chạy nhiều worker uvicorn):
+#   python -m app.bench.ipn_duplicate_stress --api http://127.0.0.1:8000 --copies 50 --rounds 20
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from sqlalchemy import text
+
+from ..db import SessionLocal
+from ..services.momo_client import momo_sign_ipn
+
+
+def _setup_ticket(db, amount: int) -> tuple[int, int]:
+    uid = db.execute(
+        text("SELECT id FROM users WHERE role = 'CUSTOMER' ORDER BY id LIMIT 1")
+    ).scalar()
+    if uid is None:
+        raise RuntimeError("Cần ít nhất 1 user CUSTOMER trong DB")
+    ev_id = db.execute(text("SELECT id FROM su_kien ORDER BY id LIMIT 1")).scalar()
+    if ev_id is None:
+        raise RuntimeError("Cần ít nhất 1 sự kiện trong DB")
+    db.execute(text("""
+        INSERT INTO ve (user_id, su_kien_id, so_luong, tong_tien, trang_thai, created_at, updated_at)
+        VALUES (:uid, :ev, 1, :amt, 'BOOKED', NOW(), NOW())
+    """), {"uid": uid, "ev": ev_id, "amt": amount})
+    ve_id = db.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+    db.commit()
+    return int(uid), int(ve_id)
+
+
+def _counts(db, ve_id: int) -> tuple[int, int, str]:
+    credits = db.execute(
+        text("SELECT COUNT(*) FROM so_cai_diem WHERE ly_do LIKE :k"),
+        {"k": f"%(MoMo, vé #{ve_id})"},
+    ).scalar()
+    events = db.execute(
+        text("SELECT COUNT(*) FROM payment_events WHERE ve_id = :id"), {"id": ve_id}
+    ).scalar()
+    status = db.execute(text("SELECT trang_thai FROM ve WHERE id = :id"), {"id": ve_id}).scalar()
+    return int(credits or 0), int(events or 0), str(status)
+
+
+def _cleanup(db, ve_id: int):
+    db.execute(
+        text("DELETE FROM outbox WHERE loai = 'VE_PAID' AND payload LIKE :k"),
+        {"k": f'%"ve_id": {ve_id},%'},
+    )
+    db.execute(text("DELETE FROM so_cai_diem WHERE ly_do LIKE :k"), {"k": f"%(MoMo, vé #{ve_id})"})
+    db.execute(text("DELETE FROM payment_events WHERE ve_id = :id"), {"id": ve_id})
+    db.execute(text("DELETE FROM ve WHERE id = :id"), {"id": ve_id})
+    db.commit()
+
+
+async def _fire(api: str, body: dict, copies: int) -> list[int]:
+    async with httpx.AsyncClient(timeout=30) as client:
+        res = await asyncio.gather(
+            *(client.post(f"{api}/ve/pay-callback", json=body) for _ in range(copies)),
+            return_exceptions=True,
+        )
+    return [r.json().get("resultCode") if isinstance(r, httpx.Response) else -1 for r in res]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--api", default="http://127.0.0.1:8000")
+    ap.add_argument("--copies", type=int, default=50, help="số bản IPN trùng bắn đồng thời")
+    ap.add_argument("--rounds", type=int, default=10, help="số vé thử")
+    ap.add_argument("--amount", type=int, default=50000)
+    ap.add_argument("--wait", type=float, default=10.0, help="giây chờ outbox worker cộng điểm")
+    args = ap.parse_args()
+
+    secret = os.getenv("MOMO_SECRET_KEY", "")
+    failures = 0
+    t0 = time.perf_counter()
+    for _ in range(args.rounds):
+        db = SessionLocal()
+        try:
+            _, ve_id = _setup_ticket(db, args.amount)
+            body = {
+                "partnerCode": os.getenv("MOMO_PARTNER_CODE", ""),
+                "orderId": f"{ve_id}-{int(time.time())}",
+                "requestId": f"stress-{ve_id}",
+                "amount": str(args.amount),
+                "orderInfo": f"Thanh toan ve #{ve_id}",
+                "orderType": "momo_wallet",
+                "transId": str(random.randint(10**9, 10**10 - 1)),
+                "resultCode": 0,
+                "message": "Successful.",
+                "payType": "qr",
+                "responseTime": str(int(time.time() * 1000)),
+                "extraData": "",
+            }
+            body["signature"] = momo_sign_ipn(body, secret)
+
+            codes = asyncio.run(_fire(args.api, body, args.copies))
+            # Cộng điểm chạy qua outbox worker => chờ tối đa --wait giây
+            deadline = time.time() + args.wait
+            while True:
+                db.rollback()
+                credits, events, status = _counts(db, ve_id)
+                if credits or time.time() > deadline:
+                    break
+                time.sleep(0.2)
+            time.sleep(0.5)
+            db.rollback()
+            credits, events, status = _counts(db, ve_id)
+            ok = credits == 1 and events == 1 and status == "PAID"
+            failures += 0 if ok else 1
+            print(
+                f"ve #{ve_id}: responses={sorted(set(codes))} credits={credits} "
+                f"payment_events={events} trang_thai={status} {'OK' if ok else 'FAIL'}"
+            )
+            _cleanup(db, ve_id)
+        finally:
+            db.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"rounds={args.rounds} copies={args.copies} elapsed={elapsed:.2f}s failures={failures}")
+    assert failures == 0, "Có vé bị cộng điểm 0 hoặc >1 lần"
+    print("OK: mỗi IPN chỉ được xử lý đúng 1 lần")
+
+
+if __name__ == "__main__":
+    main()
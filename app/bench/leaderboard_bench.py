@@ -0,0 +1,62 @@
+# app/bench/leaderboard_bench.py
+# Bench BXH trong bộ nhớ (app/rank_index.py) ở quy mô lớn, không cần DB.
+# Dựng từ N user ngẫu nhiên (như lúc nạp từ points_balance), rồi đo:
+#   cập nhật điểm/lượt chơi (xóa khóa cũ + thêm khóa mới), top-N, hạng của 1 user.
+# Đối chiếu kết quả với sorted() sau cùng.
+# Chạy: python -m app.bench.leaderboard_bench --users 1000000 --updates 200000 --top 100
+import argparse
+import random
+import time
+
+from ..rank_index import RankIndex
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--updates", type=int, default=200_000)
+    ap.add_argument("--top", type=int, default=100)
+    ap.add_argument("--reads", type=int, default=10_000)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    scores = {u: (rnd.randint(0, 2000), rnd.randint(0, 50)) for u in range(1, args.users + 1)}
+    key = lambda u: (-scores[u][0], -scores[u][1], u)
+
+    t0 = time.perf_counter()
+    ri = RankIndex.from_sorted(sorted(key(u) for u in scores))
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(args.updates):
+        u = rnd.randint(1, args.users)
+        ri.remove(key(u))
+        d, p = scores[u]
+        scores[u] = (d + rnd.randint(1, 20), p + rnd.randint(0, 1))
+        ri.add(key(u))
+    upd = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(args.reads):
+        ri.head(args.top)
+    top = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(args.reads):
+        ri.rank(key(rnd.randint(1, args.users)))
+    rank = time.perf_counter() - t0
+
+    print(f"users={args.users} build={build * 1000:.0f}ms")
+    print(f"updates={args.updates} {args.updates / upd:,.0f} updates/s")
+    print(f"top{args.top}: {top / args.reads * 1e6:.1f}us/query  rank: {rank / args.reads * 1e6:.1f}us/query")
+
+    expect = sorted(key(u) for u in scores)
+    assert ri.head(args.top) == expect[: args.top], "top-N lệch"
+    u = rnd.randint(1, args.users)
+    assert ri.rank(key(u)) == expect.index(key(u)), "hạng lệch"
+    assert len(ri) == len(expect)
+    print("OK: khớp với sắp xếp đầy đủ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# app/bench/momo_load.py
+# Load test client MoMo async (pool + semaphore + breaker) với stub local.
+# 1) uvicorn app.bench.momo_stub:app --port 9009
+# 2) python -m app.bench.momo_load --requests 2000 --concurrency 200
+import argparse
+import asyncio
+import time
+import uuid
+
+from ..services.momo_client import CircuitBreaker, MomoClient, MomoUnavailable, momo_sign_create
+
+
+async def _one(client: MomoClient, i: int, lat: list, errors: list):
+    payload = {
+        "partnerCode": "STUB",
+        "accessKey": "stub",
+        "requestId": str(uuid.uuid4()),
+        "amount": "50000",
+        "orderId": f"bench{i}-{int(time.time())}",
+        "orderInfo": f"bench #{i}",
+        "redirectUrl": "http://localhost/ok",
+        "ipnUrl": "",
+        "extraData": "",
+        "requestType": "captureWallet",
+    }
+    payload["signature"] = momo_sign_create(payload, "stub-secret")
+    t0 = time.perf_counter()
+    try:
+        await client.create(payload)
+        lat.append(time.perf_counter() - t0)
+    except MomoUnavailable as e:
+        errors.append(str(e))
+
+
+async def main_async(args):
+    client = MomoClient(
+        endpoint=args.endpoint,
+        max_concurrency=args.pool,
+        deadline=args.deadline,
+        breaker=CircuitBreaker(threshold=args.breaker_threshold, cooldown=5),
+    )
+    lat: list = []
+    errors: list = []
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def run(i):
+        async with gate:
+            await _one(client, i, lat, errors)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - t0
+    await client.aclose()
+
+    lat.sort()
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+    print(f"requests={args.requests} concurrency={args.concurrency} pool={args.pool}")
+    print(f"ok={len(lat)} errors={len(errors)} elapsed={elapsed:.2f}s rps={len(lat) / elapsed:.1f}")
+    print(f"latency p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+    print(f"breaker={client.breaker.state}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--endpoint", default="http://127.0.0.1:9009/v2/gateway/api/create")
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--pool", type=int, default=20)
+    ap.add_argument("--deadline", type=float, default=8.0)
+    ap.add_argument("--breaker-threshold", type=int, default=5)
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
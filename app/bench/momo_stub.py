@@ -0,0 +1,88 @@
+# app/bench/momo_stub.py
+# Stub cổng MoMo chạy local để load test luồng pay-init -> IPN mà không cần sandbox thật.
+#
+# Chạy stub:
+#   uvicorn app.bench.momo_stub:app --port 9009
+# Trỏ API sang stub (.env):
+#   MOMO_CREATE_ENDPOINT=http://127.0.0.1:9009/v2/gateway/api/create
+#   MOMO_PARTNER_CODE / MOMO_ACCESS_KEY / MOMO_SECRET_KEY: giá trị bất kỳ, giống nhau ở 2 phía
+#
+# Tuỳ chỉnh hành vi:
+#   STUB_LATENCY_MS  (mặc định 50)   độ trễ mỗi lệnh create
+#   STUB_FAIL_RATE   (mặc định 0)    tỉ lệ trả HTTP 500 (0..1) để thử retry / circuit breaker
+#   STUB_IPN_DELAY   (mặc định 0.5)  số giây trước khi bắn IPN về ipnUrl
+#   STUB_IPN_DUP     (mặc định 1)    số lần bắn lại cùng 1 IPN (MoMo thật hay retry)
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from fastapi import BackgroundTasks, FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from ..services.momo_client import momo_sign_ipn
+
+app = FastAPI(title="MoMo stub")
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+FAIL_RATE = float(os.getenv("STUB_FAIL_RATE", "0"))
+IPN_DELAY = float(os.getenv("STUB_IPN_DELAY", "0.5"))
+IPN_DUP = int(os.getenv("STUB_IPN_DUP", "1"))
+SECRET_KEY = os.getenv("MOMO_SECRET_KEY", "stub-secret")
+
+_counter = {"create": 0, "failed": 0, "ipn_sent": 0, "ipn_error": 0}
+
+
+async def _send_ipn(payload: dict):
+    await asyncio.sleep(IPN_DELAY)
+    body = {
+        "partnerCode": payload.get("partnerCode", ""),
+        "orderId": payload.get("orderId", ""),
+        "requestId": payload.get("requestId", ""),
+        "amount": payload.get("amount", ""),
+        "orderInfo": payload.get("orderInfo", ""),
+        "orderType": "momo_wallet",
+        "transId": str(random.randint(10**9, 10**10 - 1)),
+        "resultCode": 0,
+        "message": "Successful.",
+        "payType": "qr",
+        "responseTime": str(int(time.time() * 1000)),
+        "extraData": payload.get("extraData", ""),
+    }
+    body["signature"] = momo_sign_ipn(body, SECRET_KEY)
+    async with httpx.AsyncClient(timeout=10) as client:
+        for _ in range(max(1, IPN_DUP)):
+            try:
+                await client.post(payload.get("ipnUrl", ""), json=body)
+                _counter["ipn_sent"] += 1
+            except httpx.HTTPError:
+                _counter["ipn_error"] += 1
+
+
+@app.post("/v2/gateway/api/create")
+async def create(request: Request, background: BackgroundTasks):
+    payload = await request.json()
+    _counter["create"] += 1
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if random.random() < FAIL_RATE:
+        _counter["failed"] += 1
+        return JSONResponse({"resultCode": 99, "message": "stub failure"}, status_code=500)
+
+    if payload.get("ipnUrl"):
+        background.add_task(_send_ipn, payload)
+    return {
+        "partnerCode": payload.get("partnerCode"),
+        "orderId": payload.get("orderId"),
+        "requestId": payload.get("requestId"),
+        "amount": payload.get("amount"),
+        "responseTime": int(time.time() * 1000),
+        "message": "Thành công.",
+        "resultCode": 0,
+        "payUrl": f"http://127.0.0.1:9009/pay/{payload.get('orderId')}",
+    }
+
+
+@app.get("/stats")
+def stats():
+    return _counter
@@ -0,0 +1,182 @@
+# app/bench/promo_quota_stress.py
+# Stress: nhiều luồng cùng đặt vé dùng 1 KM có giới hạn lượt (kiểu flash sale),
+# một phần vé bị hủy giữa chừng để kiểm tra hoàn lượt.
+# Chạy: python -m app.bench.promo_quota_stress --threads 64 --total 500 --per-user 2 --users 400
+# Dùng DATABASE_URL trong .env (nên là DB thử nghiệm). Tự tạo & tự dọn dữ liệu tạm.
+import argparse
+import random
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from ..db import DATABASE_URL
+from ..models import Ve
+from ..promo_utils import CompiledPromo
+from ..services import promo_quota, ticket_state
+
+
+def _setup(Session, total: int, per_user: int | None, slots: int, n_users: int):
+    db = Session()
+    try:
+        uids = [int(r[0]) for r in db.execute(
+            text("SELECT id FROM users ORDER BY id LIMIT :n"), {"n": n_users}
+        ).all()]
+        if not uids:
+            raise RuntimeError("Cần ít nhất 1 user trong DB để tạo vé thử")
+        stamp = f"{datetime.utcnow():%Y%m%d%H%M%S}"
+        db.execute(text("""
+            INSERT INTO su_kien (ten, thoi_gian, gia_ve, trang_thai, created_at, updated_at)
+            VALUES (:t, NOW(), 100000, 'OPEN', NOW(), NOW())
+        """), {"t": f"[bench] promo quota {stamp}"})
+        ev_id = int(db.execute(text("SELECT LAST_INSERT_ID()")).scalar())
+        db.execute(text("""
+            INSERT INTO khuyen_mai (ten, ty_le, dieu_kien, thoi_gian_bd, thoi_gian_kt, active, created_at, updated_at)
+            VALUES (:t, 50, NULL, NOW() - INTERVAL 1 DAY, NOW() + INTERVAL 1 DAY, 1, NOW(), NOW())
+        """), {"t": f"[bench] flash sale {stamp}"})
+        km_id = int(db.execute(text("SELECT LAST_INSERT_ID()")).scalar())
+        promo_quota.set_quota(db, km_id, total, per_user, so_slot=slots)
+        row = db.execute(text("""
+            SELECT km.id, km.ten, km.ty_le, km.dieu_kien, km.thoi_gian_bd, km.thoi_gian_kt,
+                   km.active, q.gioi_han_tong, q.gioi_han_moi_user, q.so_slot
+            FROM khuyen_mai km JOIN khuyen_mai_quota q ON q.khuyen_mai_id = km.id
+            WHERE km.id = :id
+        """), {"id": km_id}).mappings().first()
+        db.commit()
+        return uids, ev_id, CompiledPromo(row)
+    finally:
+        db.close()
+
+
+def _teardown(Session, ev_id: int, km_id: int):
+    db = Session()
+    try:
+        db.execute(text("DELETE FROM ve_khuyen_mai WHERE khuyen_mai_id = :km"), {"km": km_id})
+        db.execute(text("DELETE FROM khuyen_mai_su_dung WHERE khuyen_mai_id = :km"), {"km": km_id})
+        db.execute(text("DELETE FROM khuyen_mai_quota_slot WHERE khuyen_mai_id = :km"), {"km": km_id})
+        db.execute(text("DELETE FROM khuyen_mai_quota WHERE khuyen_mai_id = :km"), {"km": km_id})
+        db.execute(text("DELETE FROM khuyen_mai WHERE id = :km"), {"km": km_id})
+        db.execute(text("DELETE FROM ve_tim_kiem WHERE ve_id IN (SELECT id FROM ve WHERE su_kien_id = :id)"), {"id": ev_id})
+        db.execute(text("DELETE FROM ve WHERE su_kien_id = :id"), {"id": ev_id})
+        db.execute(text("DELETE FROM su_kien WHERE id = :id"), {"id": ev_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _worker(Session, uids, ev_id, promo, attempts, cancel_rate, stats, lock):
+    ok = rejected = cancelled = errors = 0
+    latencies = []
+    for _ in range(attempts):
+        uid = random.choice(uids)
+        db = Session()
+        t0 = time.perf_counter()
+        try:
+            # Giống /ve/book với promo_id: giữ lượt, insert vé, ghi liên kết, commit
+            if not promo_quota.claim(db, promo, uid):
+                db.rollback()
+                rejected += 1
+                continue
+            ve = Ve(user_id=uid, su_kien_id=ev_id, so_luong=1, tong_tien=50000, trang_thai="BOOKED")
+            db.add(ve)
+            db.flush()
+            promo_quota.record(db, [(ve.id, promo, uid)])
+            db.commit()
+            ok += 1
+            latencies.append(time.perf_counter() - t0)
+
+            if random.random() < cancel_rate:
+                ticket_state.transition(db, [ve.id], "CANCELLED")
+                db.commit()
+                cancelled += 1
+        except Exception:
+            db.rollback()
+            errors += 1
+        finally:
+            db.close()
+    with lock:
+        stats["ok"] += ok
+        stats["rejected"] += rejected
+        stats["cancelled"] += cancelled
+        stats["errors"] += errors
+        stats["lat"].extend(latencies)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=64)
+    ap.add_argument("--attempts", type=int, default=30, help="số lần đặt / luồng")
+    ap.add_argument("--total", type=int, default=500)
+    ap.add_argument("--per-user", type=int, default=2)
+    ap.add_argument("--users", type=int, default=400)
+    ap.add_argument("--slots", type=int, default=promo_quota.DEFAULT_SLOTS)
+    ap.add_argument("--cancel-rate", type=float, default=0.1)
+    args = ap.parse_args()
+
+    engine = create_engine(DATABASE_URL, pool_size=args.threads, max_overflow=0, pool_pre_ping=True)
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    uids, ev_id, promo = _setup(Session, args.total, args.per_user, args.slots, args.users)
+    stats = {"ok": 0, "rejected": 0, "cancelled": 0, "errors": 0, "lat": []}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(Session, uids, ev_id, promo, args.attempts, args.cancel_rate, stats, lock),
+        )
+        for _ in range(args.threads)
+    ]
+    try:
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+        db = Session()
+        try:
+            held = int(db.execute(
+                text("SELECT COUNT(*) FROM ve_khuyen_mai WHERE khuyen_mai_id = :km AND da_hoan = 0"),
+                {"km": promo.id},
+            ).scalar() or 0)
+            per_user = dict(db.execute(text("""
+                SELECT user_id, COUNT(*) FROM ve_khuyen_mai
+                WHERE khuyen_mai_id = :km AND da_hoan = 0 GROUP BY user_id
+            """), {"km": promo.id}).all())
+            counters = dict(db.execute(text("""
+                SELECT user_id, so_lan FROM khuyen_mai_su_dung WHERE khuyen_mai_id = :km
+            """), {"km": promo.id}).all())
+            active_tickets = int(db.execute(text("""
+                SELECT COUNT(*) FROM ve WHERE su_kien_id = :id AND trang_thai <> 'CANCELLED'
+            """), {"id": ev_id}).scalar() or 0)
+            quota = promo_quota.get_quota(db, promo.id)
+        finally:
+            db.close()
+
+        lat = sorted(stats["lat"])
+        p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+        print(f"threads={args.threads} total={args.total} per_user={args.per_user} slots={args.slots}")
+        print(
+            f"claims ok={stats['ok']} rejected={stats['rejected']} "
+            f"cancelled={stats['cancelled']} errors={stats['errors']}"
+        )
+        print(f"elapsed={elapsed:.2f}s throughput={stats['ok'] / elapsed:.1f} claims/s")
+        print(f"latency p50={p(0.50):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+        print(f"held={held} con_lai={quota['con_lai']} active_tickets={active_tickets}")
+
+        assert held <= args.total, "OVER-REDEMPTION: vượt tổng số lượt"
+        assert held + quota["con_lai"] == args.total, "Bộ đếm slot lệch với số lượt đang giữ"
+        assert held == active_tickets, "Vé đã hủy chưa được hoàn lượt"
+        assert all(n <= args.per_user for n in per_user.values()), "Khách dùng vượt giới hạn / khách"
+        assert all(counters.get(u, 0) == per_user.get(u, 0) for u in set(counters) | set(per_user)), \
+            "Bộ đếm / khách lệch"
+        print("OK: không vượt giới hạn lượt dùng khuyến mãi")
+    finally:
+        _teardown(Session, ev_id, promo.id)
+
+
+if __name__ == "__main__":
+    main()
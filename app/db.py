@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 from pathlib import Path
@@ -29,3 +31,26 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def locked_session(name: str, timeout: int = 0):
+    """
+    Session trên 1 kết nối riêng đang giữ khóa MySQL GET_LOCK(name) => cả cụm (mọi worker / máy)
+    chỉ 1 nơi chạy đoạn code bên trong. Không lấy được khóa sau `timeout` giây => yield None.
+    Khóa gắn với kết nối nên session phải dùng đúng kết nối này tới lúc RELEASE_LOCK.
+    """
+    with engine.connect() as conn:
+        got = conn.execute(text("SELECT GET_LOCK(:n, :t)"), {"n": name, "t": timeout}).scalar()
+        conn.commit()
+        if not got:
+            yield None
+            return
+        db = SessionLocal(bind=conn)
+        try:
+            yield db
+        finally:
+            db.close()
+            conn.rollback()
+            conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": name})
+            conn.commit()
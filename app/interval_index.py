@@ -0,0 +1,92 @@
+# app/interval_index.py
+"""
+Chỉ mục khoảng thời gian trong bộ nhớ (interval tree tĩnh, dựng lại khi dữ liệu đổi).
+
+Dùng cho các bảng có cửa sổ hiệu lực [bắt đầu, kết thúc] (đóng 2 đầu, giống BETWEEN):
+- khuyen_mai (thoi_gian_bd, thoi_gian_kt)
+- thu_thach_tuan (ngay_bat_dau, ngay_ket_thuc)
+
+- at(t): các giá trị đang hiệu lực tại t, O(log n + k), giữ thứ tự lúc nạp
+- next_boundary(t): thời điểm gần nhất sau t mà tập hiệu lực có thể đổi
+- changed_between(t0, t1): tập hiệu lực ở t1 có thể khác t0 không, O(log n)
+  => cache dựng trên chỉ mục hết hạn đúng lúc qua mốc, không cần đoán TTL.
+"""
+from bisect import bisect_left, bisect_right
+
+
+class _Node:
+    __slots__ = ("center", "left", "right", "by_start", "starts", "by_end", "ends")
+
+
+def _build(items):
+    if not items:
+        return None
+    pts = sorted(p for s, e, _, _ in items for p in (s, e))
+    center = pts[len(pts) // 2]
+
+    node = _Node()
+    node.center = center
+    mid = [it for it in items if it[0] <= center <= it[1]]
+    # Khoảng chứa center: sắp theo start tăng dần và theo end giảm dần
+    node.by_start = sorted(mid, key=lambda it: it[0])
+    node.starts = [it[0] for it in node.by_start]
+    node.by_end = sorted(mid, key=lambda it: it[1], reverse=True)
+    node.ends = [it[1] for it in reversed(node.by_end)]  # tăng dần, để bisect
+    node.left = _build([it for it in items if it[1] < center])
+    node.right = _build([it for it in items if it[0] > center])
+    return node
+
+
+class IntervalIndex:
+    def __init__(self, items=()):
+        """items: [(start, end, value), ...]; dòng thiếu start/end bị bỏ qua."""
+        rows = [
+            (s, e, i, v) if s <= e else (e, s, i, v)
+            for i, (s, e, v) in enumerate(items)
+            if s is not None and e is not None
+        ]
+        self._size = len(rows)
+        self._root = _build(rows)
+        self._starts = sorted(r[0] for r in rows)
+        self._ends = sorted(r[1] for r in rows)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def at(self, t) -> list:
+        hits = []
+        node = self._root
+        while node is not None:
+            if t < node.center:
+                # Mọi khoảng ở node đều kết thúc >= center > t => chỉ cần start <= t
+                hits.extend(node.by_start[: bisect_right(node.starts, t)])
+                node = node.left
+            elif t > node.center:
+                # Mọi khoảng ở node đều bắt đầu <= center < t => chỉ cần end >= t
+                n = len(node.ends) - bisect_left(node.ends, t)
+                hits.extend(node.by_end[:n])
+                node = node.right
+            else:
+                hits.extend(node.by_start)
+                break
+        hits.sort(key=lambda it: it[2])
+        return [it[3] for it in hits]
+
+    def next_boundary(self, t):
+        """Mốc gần nhất: start > t (bắt đầu hiệu lực) hoặc end >= t (hết hiệu lực ngay sau end)."""
+        i = bisect_right(self._starts, t)
+        j = bisect_left(self._ends, t)
+        cands = []
+        if i < len(self._starts):
+            cands.append(self._starts[i])
+        if j < len(self._ends):
+            cands.append(self._ends[j])
+        return min(cands) if cands else None
+
+    def changed_between(self, t0, t1) -> bool:
+        """Có khoảng nào bắt đầu trong (t0, t1] hoặc kết thúc trong [t0, t1) không."""
+        if t1 <= t0:
+            return False
+        if bisect_right(self._starts, t1) > bisect_right(self._starts, t0):
+            return True
+        return bisect_left(self._ends, t1) > bisect_left(self._ends, t0)
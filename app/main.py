@@ -52,6 +52,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # /ve/me: FE cần đọc ETag (gửi lại If-None-Match) và cursor trang sau
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # ==========================================================
@@ -80,6 +82,51 @@ app.include_router(support_chat.router)
 if HAS_STAFF_OPS:
     app.include_router(staff_ops.router)
 
+# ==========================================================
+#  Background workers & shutdown
+# ==========================================================
+@app.on_event("startup")
+def _start_workers():
+    import os
+    from .db import SessionLocal
+    from .schema_registry import schema
+    db = SessionLocal()
+    try:
+        schema.refresh(db)  # 1 lần đọc information_schema cho cả tiến trình
+    except Exception:
+        pass  # DB chưa sẵn sàng: schema.has() tự nạp ở lần dùng đầu
+    finally:
+        db.close()
+    if os.getenv("AUTO_MIGRATE", "1") != "0":
+        from .services import auto_migrate
+        auto_migrate.start_background()
+    if os.getenv("OUTBOX_WORKER", "1") != "0":
+        from .services.outbox import outbox_worker
+        outbox_worker.start()
+    if os.getenv("TICKET_SWEEPER", "1") != "0":
+        from .services.ticket_expiry import expiry_sweeper
+        expiry_sweeper.start()
+    if os.getenv("CHALLENGE_REWARD_JOB", "1") != "0":
+        from .services.challenge_reward_job import reward_job
+        reward_job.start()
+    if os.getenv("LEADERBOARD_COMPACT", "1") != "0":
+        from .services.leaderboard_buckets import compactor
+        compactor.start()
+
+
+@app.on_event("shutdown")
+async def _close_momo_client():
+    from .services.momo_client import momo_client
+    from .services.outbox import outbox_worker
+    from .services.ticket_expiry import expiry_sweeper
+    from .services.challenge_reward_job import reward_job
+    from .services.leaderboard_buckets import compactor
+    outbox_worker.stop()
+    expiry_sweeper.stop()
+    reward_job.stop()
+    compactor.stop()
+    await momo_client.aclose()
+
 # ==========================================================
 #  Health check & root
 # ==========================================================
@@ -1,7 +1,7 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Text, Float, Numeric,
-    Index, CheckConstraint, UniqueConstraint,
+    Column, Integer, String, Date, DateTime, ForeignKey, Text, Float, Numeric,
+    Index, CheckConstraint, UniqueConstraint, JSON, DDL, event,
 )
 from sqlalchemy.orm import relationship, declarative_mixin
 from .db import Base
@@ -149,6 +149,199 @@ class Ve(TimeStampMixin, Base):
             name="ck_ve_trangthai",
         ),
         CheckConstraint("so_luong > 0", name="ck_ve_soluong_pos"),
+        # Quét vé BOOKED/PENDING quá hạn theo lô (services/ticket_expiry.py)
+        Index("ix_ve_trangthai_created", "trang_thai", "created_at"),
+    )
+
+# ============================================================
+# Phiên bản dữ liệu cho ETag (services/versions.py)
+# ============================================================
+
+class PhienBan(Base):
+    """Khóa ("ve:<user_id>", "danh_muc") -> bộ đếm tăng mỗi lần dữ liệu tương ứng đổi."""
+    __tablename__ = "phien_ban"
+
+    khoa = Column(String(64), primary_key=True)
+    phien = Column(Integer, nullable=False, default=0)
+
+# ============================================================
+# Tồn kho vé (sức chứa còn lại theo sự kiện / trò chơi)
+# ============================================================
+
+class TonKhoVe(TimeStampMixin, Base):
+    """
+    Một dòng đếm cho mỗi sự kiện hoặc trò chơi.
+    Trừ/hoàn bằng một câu UPDATE có điều kiện (xem services/inventory.py),
+    không cần COUNT(*) trên bảng ve.
+    """
+    __tablename__ = "ton_kho_ve"
+
+    id = Column(Integer, primary_key=True)
+    su_kien_id = Column(Integer, ForeignKey("su_kien.id"), nullable=True, unique=True)
+    tro_choi_id = Column(Integer, ForeignKey("tro_choi.id"), nullable=True, unique=True)
+    suc_chua = Column(Integer, nullable=False, default=0)
+    con_lai = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint("con_lai >= 0", name="ck_tonkho_conlai_nonneg"),
+        CheckConstraint("con_lai <= suc_chua", name="ck_tonkho_conlai_max"),
+    )
+
+# ============================================================
+# Chỉ mục tìm kiếm vé (bỏ dấu, FULLTEXT ngram) - xem services/search_index.py
+# ============================================================
+
+class VeTimKiem(Base):
+    __tablename__ = "ve_tim_kiem"
+
+    ve_id = Column(Integer, ForeignKey("ve.id", ondelete="CASCADE"), primary_key=True)
+    trang_thai = Column(String(20), nullable=False)
+    noi_dung = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_vetimkiem_trangthai", "trang_thai", "ve_id"),
+        Index(
+            "ftx_vetimkiem_noidung",
+            "noi_dung",
+            mysql_prefix="FULLTEXT",
+            mysql_with_parser="ngram",
+        ),
+    )
+
+# ============================================================
+# Migration tự chạy lúc khởi động (services/auto_migrate.py)
+# ============================================================
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    ten = Column(String(100), primary_key=True)
+    xong_luc = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# ============================================================
+# Sự kiện thanh toán (IPN MoMo) - cổng idempotent
+# ============================================================
+
+class PaymentEvent(Base):
+    __tablename__ = "payment_events"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String(64), nullable=False)
+    trans_id = Column(String(64), nullable=False, default="")
+    ve_id = Column(Integer, ForeignKey("ve.id"), nullable=True, index=True)
+    result_code = Column(Integer, nullable=False, default=0)
+    amount = Column(Numeric(12, 0), nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("order_id", "trans_id", name="uq_payment_events_order_trans"),
+    )
+
+# ============================================================
+# Outbox: tác vụ phụ sau thanh toán (worker xử lý nền)
+# ============================================================
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True)
+    loai = Column(String(40), nullable=False)          # VE_PAID, ...
+    payload = Column(Text, nullable=False)              # JSON string
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_pending", "processed_at", "id"),
+    )
+
+# ============================================================
+# Số dư điểm (cộng dồn từ so_cai_diem) - xem services/points.py
+# ============================================================
+
+class PointsBalance(Base):
+    """
+    1 dòng / user, cập nhật cùng transaction với mỗi dòng so_cai_diem.
+    so_luot_choi: lượt chơi TRÒ CHƠI đã thanh toán (cộng khi outbox xử lý VE_PAID).
+    updated_at: BXH trong bộ nhớ đọc các dòng đổi từ lần đồng bộ trước (services/leaderboard.py).
+    """
+    __tablename__ = "points_balance"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    diem = Column(Integer, nullable=False, default=0)
+    so_luot_choi = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_points_balance_diem", "diem", "user_id"),
+        Index("ix_points_balance_updated", "updated_at"),
+    )
+
+# ============================================================
+# Điểm + lượt chơi gộp theo ngày / tháng cho BXH theo kỳ - xem services/leaderboard_buckets.py
+# ============================================================
+
+class LeaderboardBucket(Base):
+    """
+    ky = 'D': 1 dòng / (user, ngày); ky = 'M': 1 dòng / (user, tháng), ngay = ngày 1 của tháng.
+    Dòng 'D' cũ được gộp thành 'M' (compact); mỗi tháng chỉ ở 1 dạng.
+    """
+    __tablename__ = "leaderboard_buckets"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    ky = Column(String(1), primary_key=True)
+    ngay = Column(Date, primary_key=True)
+    diem = Column(Integer, nullable=False, default=0, server_default="0")
+    so_luot_choi = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        CheckConstraint("ky in ('D','M')", name="ck_lb_buckets_ky"),
+        # BXH theo khoảng ngày: quét range (ky, ngay) chỉ trên index
+        Index("ix_lb_buckets_range", "ky", "ngay", "user_id", "diem", "so_luot_choi"),
+    )
+
+# ============================================================
+# Thưởng thử thách tuần đã trao - xem services/challenge_rewards.py
+# ============================================================
+
+class ChallengeReward(Base):
+    """1 dòng / (user, thử thách, tuần): INSERT IGNORE trên khóa unique là cổng chống thưởng trùng."""
+    __tablename__ = "challenge_rewards"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    ma_thu_thach = Column(Integer, nullable=False)     # thu_thach_tuan.ma_thu_thach
+    tuan_bat_dau = Column(Date, nullable=False)        # DATE(ngay_bat_dau)
+    diem = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Lô của job thưởng định kỳ (NULL = thưởng inline) - xem services/challenge_reward_job.py
+    job_batch = Column(String(40), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "ma_thu_thach", "tuan_bat_dau", name="uq_challenge_rewards_user_tt_tuan"),
+        Index("ix_challenge_rewards_tt", "ma_thu_thach", "tuan_bat_dau"),
+        Index("ix_challenge_rewards_batch", "job_batch"),
+    )
+
+
+class ChallengeProgressKey(Base):
+    """
+    Khóa đã đếm cho chỉ số "đếm khác nhau" (vd DISTINCT_GAMES: khoa = tro_choi_id).
+    INSERT IGNORE theo khóa chính; chỉ dòng mới (cùng lo) mới cộng vào tien_do_thu_thach.
+    Xem services/challenge_progress.py
+    """
+    __tablename__ = "tien_do_thu_thach_khoa"
+
+    ma_thu_thach = Column(Integer, primary_key=True, autoincrement=False)  # thu_thach_tuan.ma_thu_thach
+    ma_nguoi_dung = Column(Integer, primary_key=True, autoincrement=False)
+    khoa = Column(Integer, primary_key=True, autoincrement=False)
+    lo = Column(String(40), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tien_do_khoa_lo", "lo"),
     )
 
 # ============================================================
@@ -200,13 +393,46 @@ class SuKien(TimeStampMixin, Base):
     )
 
 
+# Cột sinh từ dieu_kien (dạng chuẩn - promo_utils.canonical_condition) để lọc/index bằng SQL.
+# KHÔNG map vào KhuyenMai: DB cũ chưa có cột thì mọi query ORM trên bảng vẫn chạy.
+# Bảng mới: tạo bằng DDL ngay sau CREATE TABLE; DB cũ: auto_migrate (promo_conditions.migrate).
+KM_GENERATED = {
+    "dk_min_amount": "CAST(IFNULL(dieu_kien->>'$.min_amount', 0) AS DECIMAL(14,2))",
+    "dk_min_tier_rank": "CAST(IFNULL(dieu_kien->>'$.min_tier_rank', 0) AS UNSIGNED)",
+    # 0 = mọi sự kiện, 1 = chỉ các sự kiện trong event_ids
+    "dk_event_scope": "IF(IFNULL(JSON_LENGTH(dieu_kien, '$.event_ids'), 0) = 0, 0, 1)",
+}
+KM_GENERATED_TYPES = {
+    "dk_min_amount": "DECIMAL(14,2)",
+    "dk_min_tier_rank": "INT UNSIGNED",
+    "dk_event_scope": "TINYINT",
+}
+KM_INDEXES = {
+    "ix_km_dk_min_amount": "CREATE INDEX ix_km_dk_min_amount ON khuyen_mai (dk_min_amount)",
+    "ix_km_dk_tier": "CREATE INDEX ix_km_dk_tier ON khuyen_mai (dk_min_tier_rank)",
+    "ix_km_dk_event_scope": "CREATE INDEX ix_km_dk_event_scope ON khuyen_mai (dk_event_scope)",
+    # Multi-valued index cho  :ev MEMBER OF (dieu_kien->'$.event_ids')  (MySQL >= 8.0.17)
+    "ix_km_dk_event_ids": (
+        "CREATE INDEX ix_km_dk_event_ids ON khuyen_mai "
+        "((CAST(dieu_kien->'$.event_ids' AS UNSIGNED ARRAY)))"
+    ),
+}
+
+
+def km_generated_ddl(col: str) -> str:
+    return (
+        f"ALTER TABLE khuyen_mai ADD COLUMN {col} {KM_GENERATED_TYPES[col]} "
+        f"GENERATED ALWAYS AS ({KM_GENERATED[col]}) STORED"
+    )
+
+
 class KhuyenMai(TimeStampMixin, Base):
     __tablename__ = "khuyen_mai"
 
     id = Column(Integer, primary_key=True)
     ten = Column(String(150), nullable=False, index=True)
     ty_le = Column(Numeric(5, 2), nullable=False)  # %
-    dieu_kien = Column(Text)                       # JSON string
+    dieu_kien = Column(JSON)                       # dạng chuẩn, xem promo_utils.canonical_condition
     thoi_gian_bd = Column(DateTime, nullable=False)
     thoi_gian_kt = Column(DateTime, nullable=False)
     active = Column(Integer, default=1)
@@ -215,6 +441,68 @@ class KhuyenMai(TimeStampMixin, Base):
         CheckConstraint("active in (0,1)", name="ck_khuyenmai_active"),
     )
 
+
+for _col in KM_GENERATED:
+    event.listen(KhuyenMai.__table__, "after_create", DDL(km_generated_ddl(_col)))
+for _ddl in KM_INDEXES.values():
+    event.listen(KhuyenMai.__table__, "after_create", DDL(_ddl))
+
+# ============================================================
+# Giới hạn lượt dùng khuyến mãi - xem services/promo_quota.py
+# ============================================================
+
+class KhuyenMaiQuota(Base):
+    """Cấu hình giới hạn: tổng số lượt và số lượt / khách (NULL = không giới hạn)."""
+    __tablename__ = "khuyen_mai_quota"
+
+    khuyen_mai_id = Column(Integer, ForeignKey("khuyen_mai.id", ondelete="CASCADE"), primary_key=True)
+    gioi_han_tong = Column(Integer, nullable=True)
+    gioi_han_moi_user = Column(Integer, nullable=True)
+    so_slot = Column(Integer, nullable=False, default=8)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class KhuyenMaiQuotaSlot(Base):
+    """
+    Số lượt còn lại của 1 KM chia thành nhiều dòng (slot) để các lượt đặt đồng thời
+    khóa các dòng khác nhau thay vì cùng tranh 1 dòng đếm.
+    """
+    __tablename__ = "khuyen_mai_quota_slot"
+
+    khuyen_mai_id = Column(Integer, ForeignKey("khuyen_mai.id", ondelete="CASCADE"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    con_lai = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint("con_lai >= 0", name="ck_kmslot_conlai_nonneg"),
+    )
+
+
+class KhuyenMaiSuDung(Base):
+    """Số lượt 1 khách đã dùng 1 KM (chỉ ghi khi KM có giới hạn / khách)."""
+    __tablename__ = "khuyen_mai_su_dung"
+
+    khuyen_mai_id = Column(Integer, ForeignKey("khuyen_mai.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    so_lan = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint("so_lan >= 0", name="ck_kmsudung_solan_nonneg"),
+    )
+
+
+class VeKhuyenMai(Base):
+    """Vé nào đã giữ lượt của KM nào => hoàn đúng lượt khi hủy vé."""
+    __tablename__ = "ve_khuyen_mai"
+
+    ve_id = Column(Integer, ForeignKey("ve.id", ondelete="CASCADE"), primary_key=True)
+    khuyen_mai_id = Column(Integer, ForeignKey("khuyen_mai.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    tinh_theo_user = Column(Integer, nullable=False, default=0)  # 1 = đã cộng khuyen_mai_su_dung
+    # 1 = vé đã hủy, lượt đã hoàn (giữ dòng để IPN về muộn giữ lại đúng lượt đó)
+    da_hoan = Column(Integer, nullable=False, default=0, server_default="0")
+
+
 # ============================================================
 # Gợi ý / Click
 # ============================================================
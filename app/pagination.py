@@ -0,0 +1,102 @@
+# app/pagination.py
+"""
+Phân trang dùng chung cho các API danh sách (admin/staff).
+
+- Keyset (cursor): cursor mờ = base64url(JSON [sort_key, id]); trang sau lọc
+  `(sort_key, id) < (cursor)` thay vì OFFSET => độ trễ không tăng theo độ sâu trang.
+- Vẫn nhận `page` (OFFSET) khi không có cursor để FE cũ chạy bình thường;
+  mọi trang đều trả `next_cursor` để client chuyển sang keyset.
+- total: "estimate" (mặc định: TABLE_ROWS của InnoDB nếu không lọc, COUNT có giới hạn
+  ESTIMATE_CAP nếu có lọc), "none" (không đếm), "exact" (COUNT(*) như cũ, chỉ khi cần số chính xác).
+  FE admin (components/CursorPager.jsx) đi bằng cursor, chỉ xin estimate ở trang đầu.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Literal
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select, text
+
+TotalMode = Literal["exact", "estimate", "none"]
+
+ESTIMATE_CAP = 10000
+
+
+def encode_cursor(key, row_id: int) -> str:
+    if isinstance(key, datetime):
+        key = {"dt": key.isoformat()}
+    raw = json.dumps([key, int(row_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, row_id = json.loads(raw)
+        if isinstance(key, dict) and "dt" in key:
+            key = datetime.fromisoformat(key["dt"])
+        return key, int(row_id)
+    except Exception:
+        raise HTTPException(400, "cursor không hợp lệ")
+
+
+def paginate(
+    query,
+    id_col,
+    page_size: int,
+    cursor: str | None = None,
+    page: int = 1,
+    sort_col=None,
+):
+    """
+    Sắp xếp giảm dần theo (sort_col, id_col). sort_col mặc định = id_col.
+    Trả về (rows, next_cursor).
+    """
+    sort_col = id_col if sort_col is None else sort_col
+    page_size = max(1, int(page_size))
+
+    if cursor:
+        key, last_id = decode_cursor(cursor)
+        if sort_col is id_col:
+            query = query.filter(id_col < last_id)
+        else:
+            query = query.filter(
+                or_(sort_col < key, and_(sort_col == key, id_col < last_id))
+            )
+    query = query.order_by(sort_col.desc(), id_col.desc())
+    if not cursor and page > 1:
+        query = query.offset((page - 1) * page_size)
+
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
+
+
+def count_total(db, query, model, mode: TotalMode = "estimate", filtered: bool = True) -> int | None:
+    if mode == "none":
+        return None
+    if mode == "estimate":
+        if not filtered:
+            est = db.execute(
+                text(
+                    """
+                    SELECT TABLE_ROWS FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t
+                    """
+                ),
+                {"t": model.__tablename__},
+            ).scalar()
+            if est is not None:
+                return int(est)
+        # Có lọc: đếm nhưng dừng ở ESTIMATE_CAP dòng
+        pk = model.__table__.primary_key.columns.values()[0]
+        sub = query.with_entities(pk).order_by(None).limit(ESTIMATE_CAP).subquery()
+        return int(db.execute(select(func.count()).select_from(sub)).scalar() or 0)
+    return query.order_by(None).count()
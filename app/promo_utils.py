@@ -1,6 +1,22 @@
 import json
+import os
+from bisect import bisect_right
+import threading
+import time
+from datetime import datetime, timedelta
+
 from sqlalchemy import text
 
+from .interval_index import IntervalIndex
+
+# NumPy là tuỳ chọn: không có thì evaluate_batch chạy vòng lặp Python (cùng kết quả)
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
 # ====== Chuẩn hoá bậc thành viên ======
 def _norm_tier(s: str | None) -> str | None:
     if not s:
@@ -43,92 +59,458 @@ def _is_open_row(row) -> bool:
     return active is None or int(active) == 1
 
 
-def _allowed_by_event(cond: dict, event_id: int | None) -> bool:
-    if not cond or event_id is None:
-        return True
-    ev = cond.get("member_event") or cond.get("event_id") or cond.get("event") \
-         or cond.get("events") or cond.get("event_ids")
-    if ev is None or ev == "" or ev == []:
-        return True
+def _int_or_none(v) -> int | None:
     try:
-        if isinstance(ev, list):
-            ids = {int(e) for e in ev}
-            return event_id in ids
-        return int(ev) == int(event_id)
+        return None if v is None else int(v)
     except Exception:
-        return True
+        return None
 
 
-def _allowed_by_tier(cond: dict, user_tier: str | None) -> bool:
-    ut = _norm_tier(user_tier)
-    tiers = cond.get("member_tiers") or cond.get("tiers") or []
-    members_only = bool(
-        cond.get("member_only") or cond.get("members_only") or cond.get("only_members")
-    )
-    min_tier = cond.get("min_tier") or cond.get("tier_at_least") or cond.get("at_least")
+# ====== Điều kiện chuẩn (cột JSON khuyen_mai.dieu_kien) ======
+# Tên khoá cũ => khoá chuẩn. Khoá khác (ghi chú, "raw"...) giữ nguyên.
+_ALIASES = {
+    "min_amount": ("min_amount", "min", "hoa_don_toi_thieu"),
+    "min_tier": ("min_tier", "tier_at_least", "at_least"),
+    "member_tiers": ("member_tiers", "tiers"),
+    "member_only": ("member_only", "members_only", "only_members"),
+    "event_ids": ("member_event", "event_id", "event", "events", "event_ids"),
+}
+_ALIAS_KEYS = {k for names in _ALIASES.values() for k in names}
 
-    if min_tier:
-        return ut is not None and _tier_rank(ut) >= _tier_rank(min_tier)
 
-    if tiers:
-        norm = {_norm_tier(t) for t in tiers if t is not None}
-        return ut in norm
+def _first(cond: dict, key: str):
+    for k in _ALIASES[key]:
+        v = cond.get(k)
+        if v:
+            return v
+    return None
 
-    if members_only:
-        return ut is not None and ut != "THUONG"
 
-    return True
+def unknown_min_tier(raw) -> str | None:
+    """Giá trị min_tier (mọi alias) không thuộc bậc nào đã biết, None nếu hợp lệ / không khai báo."""
+    cond = _parse_json(raw)
+    if not isinstance(cond, dict):
+        return None
+    min_tier = _first(cond, "min_tier")
+    if min_tier and not _tier_rank(_norm_tier(min_tier)):
+        return str(min_tier)
+    return None
 
 
-def _allowed_by_amount(cond: dict, amount: float) -> bool:
+def canonical_condition(raw) -> dict:
+    """
+    dieu_kien (mọi alias cũ) -> dạng chuẩn lưu trong cột JSON:
+      {"min_amount": float, "min_tier_rank": 0..4, "member_tiers": [..],
+       "member_only": bool, "event_ids": [..]}
+    Thứ tự ưu tiên bậc giữ như cũ: min_tier > member_tiers > member_only
+    (mục thua bị bỏ => 3 điều kiện bậc chỉ còn là phép AND).
+    min_tier_rank 0 = không yêu cầu; event_ids rỗng = mọi sự kiện.
+    """
+    cond = _parse_json(raw)
+    if not isinstance(cond, dict):
+        cond = {}
+    out = {k: v for k, v in cond.items() if k not in _ALIAS_KEYS and k != "min_tier_rank"}
+
     try:
-        min_amt = float(cond.get("min_amount") or cond.get("min") or cond.get("hoa_don_toi_thieu") or 0)
+        out["min_amount"] = max(0.0, float(_first(cond, "min_amount") or 0))
     except Exception:
-        min_amt = 0
-    return float(amount) >= min_amt
-
-
-def _applicable(row, amount: float, user_tier: str | None, event_id: int | None) -> bool:
-    if not _is_open_row(row):
-        return False
-    cond = _parse_json(row.get("dieu_kien"))
-    return (
-        _allowed_by_amount(cond, amount)
-        and _allowed_by_tier(cond, user_tier)
-        and _allowed_by_event(cond, event_id)
+        out["min_amount"] = 0.0
+
+    min_tier = _first(cond, "min_tier")
+    rank = _int_or_none(cond.get("min_tier_rank")) or 0
+    if min_tier:
+        # "gold", "Vàng" => VANG; bậc lạ => 0 như trước (không đòi bậc, vẫn thắng 2 mục sau)
+        rank = _tier_rank(_norm_tier(min_tier))
+    tiers = _first(cond, "member_tiers") if not (rank or min_tier) else None
+    if tiers and not isinstance(tiers, list):
+        tiers = [tiers]
+    out["min_tier_rank"] = rank
+    out["member_tiers"] = sorted({_norm_tier(t) for t in tiers or []} - {None})
+    out["member_only"] = bool(
+        not (rank or min_tier) and not out["member_tiers"] and _first(cond, "member_only")
     )
 
+    ev = _first(cond, "event_ids")
+    try:
+        out["event_ids"] = sorted({int(e) for e in ev}) if isinstance(ev, list) \
+            else ([int(ev)] if ev else [])
+    except Exception:
+        out["event_ids"] = []
+    return out
 
-def list_applicable_promos(db, amount: float, user_tier: str | None = None, event_id: int | None = None):
-    rows = db.execute(
-        text("""
-            SELECT id, ten, ty_le, dieu_kien, thoi_gian_bd, thoi_gian_kt,
-                   IFNULL(active,1) AS active
-            FROM khuyen_mai
-            WHERE NOW() BETWEEN thoi_gian_bd AND thoi_gian_kt
-        """)
-    ).mappings().all()
-
-    out = []
-    for r in rows:
+
+# ====== Biên dịch điều kiện: parse JSON + giải alias 1 lần / dòng ======
+class CompiledPromo:
+    """
+    1 dòng khuyen_mai đã biên dịch (điều kiện qua canonical_condition, 1 lần / dòng).
+    matches(): đủ điều kiện số tiền / bậc / sự kiện, không json.loads / dò alias lại mỗi lần gọi.
+    """
+    __slots__ = (
+        "id", "ten", "rate", "active", "start", "end",
+        "min_amount", "min_tier_rank", "tiers", "members_only", "events",
+        "limit_total", "limit_per_user", "slots",
+    )
+
+    def __init__(self, row):
+        self.id = int(row["id"])
+        self.ten = row["ten"]
         try:
-            rate = float(r.get("ty_le") or 0)
+            self.rate = float(row.get("ty_le") or 0)
         except Exception:
-            rate = 0.0
-        if rate <= 0:
-            continue
-        if not _applicable(r, amount, user_tier, event_id):
-            continue
-        out.append({"id": r["id"], "ten": r["ten"], "rate": float(rate)})
-    out.sort(key=lambda x: x["rate"], reverse=True)
-    return out
+            self.rate = 0.0
+        self.active = _is_open_row(row)
+        self.start = row.get("thoi_gian_bd")
+        self.end = row.get("thoi_gian_kt")
+        # Giới hạn lượt dùng (khuyen_mai_quota), None = không giới hạn
+        self.limit_total = _int_or_none(row.get("gioi_han_tong"))
+        self.limit_per_user = _int_or_none(row.get("gioi_han_moi_user"))
+        self.slots = _int_or_none(row.get("so_slot")) or 1
+
+        cond = canonical_condition(row.get("dieu_kien"))
+        self.min_amount = cond["min_amount"]
+        self.min_tier_rank = cond["min_tier_rank"] or None
+        self.tiers = frozenset(cond["member_tiers"]) or None
+        self.members_only = cond["member_only"]
+        # Sự kiện: None = mọi sự kiện
+        self.events = frozenset(cond["event_ids"]) or None
+
+    @property
+    def has_quota(self) -> bool:
+        return self.limit_total is not None or self.limit_per_user is not None
+
+    def tier_ok(self, user_tier: str | None) -> bool:
+        ut = _norm_tier(user_tier)
+        if self.min_tier_rank is not None:
+            return ut is not None and _tier_rank(ut) >= self.min_tier_rank
+        if self.tiers is not None:
+            return ut in self.tiers
+        if self.members_only:
+            return ut is not None and ut != "THUONG"
+        return True
+
+    def event_ok(self, event_id: int | None) -> bool:
+        return event_id is None or self.events is None or int(event_id) in self.events
+
+    def matches(self, amount: float, user_tier: str | None, event_id: int | None) -> bool:
+        return (
+            self.active
+            and float(amount) >= self.min_amount
+            and self.tier_ok(user_tier)
+            and self.event_ok(event_id)
+        )
+
+
+# ====== Bảng KM tốt nhất: hàm bậc thang theo số tiền, mỗi (bậc, phạm vi sự kiện) ======
+_OTHER_EVENT = object()  # sự kiện không được KM nào nêu riêng
+
+
+def _signature(p: CompiledPromo) -> tuple:
+    return (p.id, p.rate, p.min_amount, p.min_tier_rank, p.tiers, p.members_only, p.events,
+            p.start, p.end, p.limit_total, p.limit_per_user, p.slots)
+
+
+class BestPromoTable:
+    """
+    Với (bậc, sự kiện) cố định, KM tốt nhất chỉ đổi tại các ngưỡng min_amount
+    => lưu mảng ngưỡng tăng dần + KM tốt nhất tương ứng, tra bằng bisect.
+    - Bảng dựng lười cho từng khoá (bậc đã chuẩn hoá, sự kiện | None | _OTHER_EVENT) rồi giữ lại.
+    - update(): khi tập KM đang áp dụng đổi, chỉ bỏ những bảng có KM thêm/bớt/sửa áp dụng được.
+    Không tự khoá: PromoCache gọi trong lock của nó.
+    """
+
+    def __init__(self):
+        self._promos: list[CompiledPromo] = []
+        self._sigs: dict[tuple, CompiledPromo] = {}
+        self._events: frozenset = frozenset()
+        self._tables: dict[tuple, tuple[list, list]] = {}
+        self.builds = 0
+
+    def _scope(self, event_id):
+        if event_id is None:
+            return None
+        event_id = int(event_id)
+        return event_id if event_id in self._events else _OTHER_EVENT
+
+    @staticmethod
+    def _eligible(p: CompiledPromo, tier, scope) -> bool:
+        if not p.tier_ok(tier):
+            return False
+        if scope is None or p.events is None:
+            return True
+        return scope is not _OTHER_EVENT and scope in p.events
+
+    def update(self, promos: list[CompiledPromo]) -> None:
+        sigs = {_signature(p): p for p in promos}
+        changed = [p for k, p in sigs.items() if k not in self._sigs] + \
+                  [p for k, p in self._sigs.items() if k not in sigs]
+        events = frozenset(e for p in promos for e in (p.events or ()))
+        if events != self._events:
+            # Phạm vi "sự kiện khác" đổi nghĩa => bỏ hết bảng theo sự kiện
+            self._tables = {k: v for k, v in self._tables.items() if k[1] is None}
+        if changed:
+            self._tables = {
+                k: v for k, v in self._tables.items()
+                if not any(self._eligible(p, k[0], k[1]) for p in changed)
+            }
+        self._promos, self._sigs, self._events = promos, sigs, events
+
+    def _build(self, tier, scope) -> tuple[list, list]:
+        # promos đã theo rate giảm dần: gặp trước = ưu tiên hơn khi bằng rate (giống evaluate_batch)
+        elig = [(p.min_amount, pos, p) for pos, p in enumerate(self._promos)
+                if self._eligible(p, tier, scope)]
+        elig.sort(key=lambda x: (x[0], x[1]))
+        thresholds, best = [], []
+        cur = None
+        for amt, pos, p in elig:
+            if cur is None or p.rate > cur[1].rate or (p.rate == cur[1].rate and pos < cur[0]):
+                cur = (pos, p)
+                if thresholds and thresholds[-1] == amt:
+                    best[-1] = p
+                else:
+                    thresholds.append(amt)
+                    best.append(p)
+        self.builds += 1
+        return thresholds, best
+
+    def best(self, amount: float, user_tier: str | None, event_id: int | None) -> CompiledPromo | None:
+        key = (_norm_tier(user_tier), self._scope(event_id))
+        table = self._tables.get(key)
+        if table is None:
+            table = self._tables[key] = self._build(*key)
+        thresholds, best = table
+        i = bisect_right(thresholds, float(amount)) - 1
+        return best[i] if i >= 0 else None
+
+
+class PromoCache:
+    """
+    Tập khuyến mãi đã biên dịch, giữ trong bộ nhớ process.
+    - Nạp 1 lần mọi KM chưa hết hạn (kể cả KM sắp bắt đầu) vào IntervalIndex
+      => qua mốc bắt đầu/kết thúc chỉ tra lại chỉ mục trong bộ nhớ, không query DB.
+    - invalidate(): gọi sau mỗi lần ghi khuyen_mai (router khuyen_mai, ops_set_promo_active).
+    - max_age: nạp lại định kỳ để các worker uvicorn khác thấy thay đổi (0 = tắt).
+    - Giờ so sánh theo NOW() của DB (lệch giờ app/DB đo lúc nạp).
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index: IntervalIndex | None = None
+        self._active: list[CompiledPromo] = []
+        self._as_of = None
+        self._best = BestPromoTable()
+        self._skew = timedelta(0)
+        self._loaded_at = 0.0
+        self.reloads = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._index = None
+
+    def now(self) -> datetime:
+        return datetime.now() + self._skew
+
+    def _reload(self, db) -> None:
+        db_now = db.execute(text("SELECT NOW()")).scalar()
+        rows = db.execute(
+            text("""
+                SELECT km.id, km.ten, km.ty_le, km.dieu_kien, km.thoi_gian_bd, km.thoi_gian_kt,
+                       IFNULL(km.active,1) AS active,
+                       q.gioi_han_tong, q.gioi_han_moi_user, q.so_slot
+                FROM khuyen_mai km
+                LEFT JOIN khuyen_mai_quota q ON q.khuyen_mai_id = km.id
+                WHERE km.thoi_gian_kt >= NOW()
+            """)
+        ).mappings().all()
+        self._skew = (db_now - datetime.now()) if db_now else timedelta(0)
+        # Sắp theo rate giảm dần trước => at() trả về đúng thứ tự ưu tiên
+        promos = sorted(
+            (p for p in map(CompiledPromo, rows) if p.active and p.rate > 0),
+            key=lambda p: p.rate,
+            reverse=True,
+        )
+        self._index = IntervalIndex((p.start, p.end, p) for p in promos)
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+        self._recompute(db_now or self.now())
+
+    def _recompute(self, now) -> None:
+        self._active = self._index.at(now)
+        self._as_of = now
+        self._best.update(self._active)
+
+    def active(self, db) -> list[CompiledPromo]:
+        """KM đang áp dụng, sắp theo rate giảm dần."""
+        with self._lock:
+            if self._index is None or (
+                self.max_age and time.monotonic() - self._loaded_at > self.max_age
+            ):
+                self._reload(db)
+            else:
+                now = self.now()
+                if self._index.changed_between(self._as_of, now):
+                    self._recompute(now)
+            return self._active
+
+    def best(self, db, amount: float, user_tier: str | None, event_id: int | None):
+        """KM tốt nhất cho 1 đơn: tra bảng bậc thang (bisect), không duyệt danh sách."""
+        self.active(db)
+        with self._lock:
+            return self._best.best(amount, user_tier, event_id)
+
+    def next_boundary(self):
+        """Mốc tiếp theo mà tập KM đang áp dụng đổi (giờ DB), None nếu chưa nạp / không còn mốc."""
+        with self._lock:
+            if self._index is None or self._as_of is None:
+                return None
+            return self._index.next_boundary(self._as_of)
+
+
+promo_cache = PromoCache(max_age=float(os.getenv("PROMO_CACHE_MAX_AGE", "60")))
+
+
+def load_active_promos(db) -> list[CompiledPromo]:
+    """Các KM đang trong thời gian áp dụng (từ cache; dùng lại được cho cả giỏ hàng)."""
+    return promo_cache.active(db)
+
+
+# ====== Đánh giá theo lô: N truy vấn (amount, tier, event_id) x P khuyến mãi ======
+class _PromoMatrix:
+    """
+    Mảng NumPy dựng 1 lần cho 1 tập KM đang áp dụng (cột = KM, đã sắp theo rate giảm dần):
+    active, ngưỡng min_amount, hạng tối thiểu, mặt nạ danh sách bậc, members_only, mặt nạ sự kiện.
+    """
+
+    def __init__(self, promos: list[CompiledPromo]):
+        self.promos = promos
+        n = len(promos)
+        self.active = np.array([bool(p.active) for p in promos], dtype=bool)
+        self.min_amount = np.array([p.min_amount for p in promos], dtype=np.float64)
+        # -1 = không có min_tier
+        self.min_rank = np.array(
+            [p.min_tier_rank if p.min_tier_rank is not None else -1 for p in promos], dtype=np.int64
+        )
+        self.has_list = np.array([p.tiers is not None for p in promos], dtype=bool)
+        self.members_only = np.array([p.members_only for p in promos], dtype=bool)
+        self.event_any = np.array([p.events is None for p in promos], dtype=bool)
+
+        self.tier_col = {}
+        for p in promos:
+            for t in p.tiers or ():
+                self.tier_col.setdefault(t, len(self.tier_col))
+        self.tier_mask = np.zeros((len(self.tier_col) + 1, n), dtype=bool)  # dòng cuối: bậc lạ
+        self.event_col = {}
+        for p in promos:
+            for e in p.events or ():
+                self.event_col.setdefault(e, len(self.event_col))
+        self.event_mask = np.zeros((len(self.event_col) + 1, n), dtype=bool)  # dòng cuối: sự kiện lạ
+        for j, p in enumerate(promos):
+            for t in p.tiers or ():
+                self.tier_mask[self.tier_col[t], j] = True
+            for e in p.events or ():
+                self.event_mask[self.event_col[e], j] = True
+
+    def evaluate(self, queries) -> "np.ndarray":
+        """Trả về ma trận bool (số truy vấn x số KM)."""
+        tier_values = list(dict.fromkeys(t for _, t, _ in queries))
+        code = {t: i for i, t in enumerate(tier_values)}
+        return self.evaluate_columns(
+            np.array([float(a) for a, _, _ in queries], dtype=np.float64),
+            np.array([code[t] for _, t, _ in queries], dtype=np.int64),
+            tier_values,
+            np.array([-1 if e is None else int(e) for _, _, e in queries], dtype=np.int64),
+        )
+
+    def evaluate_columns(self, amount, tier_codes, tier_values, event_ids) -> "np.ndarray":
+        """
+        Bản dạng cột (dùng cho lô lớn, vd backtest hàng triệu vé):
+        amount float[N]; tier_codes int[N] chỉ số vào tier_values (bậc thô, chuẩn hoá 1 lần / giá trị);
+        event_ids int[N], -1 = không gắn sự kiện.
+        """
+        tiers = [_norm_tier(t) for t in tier_values]
+        v_rank = np.array([_tier_rank(t) for t in tiers], dtype=np.int64)
+        v_known = np.array([t is not None for t in tiers], dtype=bool)
+        v_member = np.array([t is not None and t != "THUONG" for t in tiers], dtype=bool)
+        v_row = np.array([self.tier_col.get(t, len(self.tier_col)) for t in tiers], dtype=np.int64)
+        q_rank, q_known = v_rank[tier_codes], v_known[tier_codes]
+        q_member, q_tier_row = v_member[tier_codes], v_row[tier_codes]
+
+        q_no_event = event_ids < 0
+        q_event_row = np.full(len(event_ids), len(self.event_col), dtype=np.int64)
+        if self.event_col:
+            vocab = np.array(sorted(self.event_col), dtype=np.int64)
+            rows = np.array([self.event_col[e] for e in vocab], dtype=np.int64)
+            pos = np.clip(np.searchsorted(vocab, event_ids), 0, len(vocab) - 1)
+            hit = vocab[pos] == event_ids
+            q_event_row[hit] = rows[pos[hit]]
+
+        amount_ok = amount[:, None] >= self.min_amount[None, :]
+
+        # Thứ tự ưu tiên như CompiledPromo.tier_ok: min_tier > danh sách bậc > members_only
+        by_rank = q_known[:, None] & (q_rank[:, None] >= self.min_rank[None, :])
+        by_list = self.tier_mask[q_tier_row]
+        by_member = ~self.members_only[None, :] | q_member[:, None]
+        tier_ok = np.where(
+            self.min_rank[None, :] >= 0,
+            by_rank,
+            np.where(self.has_list[None, :], by_list, by_member),
+        )
+
+        event_ok = q_no_event[:, None] | self.event_any[None, :] | self.event_mask[q_event_row]
+        return self.active[None, :] & amount_ok & tier_ok & event_ok
+
+
+# _PromoMatrix của tập KM gần nhất, khoá theo identity danh sách: PromoCache.active() trả về
+# cùng 1 list cho tới khi tập KM đổi (nạp lại / qua mốc thời gian) => dựng lại đúng lúc đó
+_matrix_slot: list = [None]
+
+
+def _matrix_for(promos: list[CompiledPromo]) -> _PromoMatrix:
+    cached = _matrix_slot[0]
+    if cached is not None and cached.promos is promos:
+        return cached
+    m = _PromoMatrix(promos)
+    _matrix_slot[0] = m
+    return m
+
+
+def evaluate_batch(promos: list[CompiledPromo], queries) -> list[list[CompiledPromo]]:
+    """
+    Bộ đánh giá KM duy nhất (dùng chung /ve và /khuyen-mai).
+    queries: [(amount, user_tier, event_id), ...]
+    Trả về, cho mỗi truy vấn, danh sách KM áp dụng được theo rate giảm dần.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    if not promos:
+        return [[] for _ in queries]
+    if not HAS_NUMPY:
+        return [[p for p in promos if p.matches(a, t, e)] for a, t, e in queries]
+    ok = _matrix_for(promos).evaluate(queries)
+    return [[promos[j] for j in np.flatnonzero(row)] for row in ok]
+
+
+def best_batch(promos: list[CompiledPromo], queries) -> list[CompiledPromo | None]:
+    """KM có rate cao nhất cho mỗi truy vấn (None nếu không có)."""
+    return [lst[0] if lst else None for lst in evaluate_batch(promos, queries)]
+
+
+def applicable_from_rows(promos, amount: float, user_tier: str | None = None, event_id: int | None = None):
+    """promos: kết quả load_active_promos() (đã sắp theo rate giảm dần)."""
+    return [
+        {"id": p.id, "ten": p.ten, "rate": p.rate}
+        for p in evaluate_batch(promos, [(amount, user_tier, event_id)])[0]
+    ]
+
+
+def list_applicable_promos(db, amount: float, user_tier: str | None = None, event_id: int | None = None):
+    return applicable_from_rows(load_active_promos(db), amount, user_tier, event_id)
 
 
 def find_best_promo(db, amount: float, user_tier: str | None = None, event_id: int | None = None):
-    lst = list_applicable_promos(db, amount, user_tier, event_id)
-    if not lst:
+    """Trả về (KM có .id/.ten, rate) hoặc (None, 0.0)."""
+    best = promo_cache.best(db, amount, user_tier, event_id)
+    if best is None:
         return None, 0.0
-    top = lst[0]
-    class _Simple:
-        def __init__(self, id, ten): self.id, self.ten = id, ten
-    return _Simple(top["id"], top["ten"]), float(top["rate"])
+    return best, float(best.rate)
@@ -0,0 +1,134 @@
+# app/rank_index.py
+"""
+Danh sách có thứ tự + thống kê thứ hạng trong bộ nhớ (order-statistics), không cần thư viện ngoài.
+
+Cấu trúc: các khối đã sắp (mỗi khối <= LOAD phần tử) + max của từng khối + cây Fenwick
+trên độ dài khối (cùng ý tưởng với sortedcontainers.SortedList).
+- add / remove: bisect chọn khối O(log n), chèn/xóa trong khối O(LOAD) (memmove),
+  cập nhật Fenwick O(log n); khối đầy thì tách, khối rỗng thì bỏ (dựng lại Fenwick).
+- rank(x): số phần tử < x, O(log n)
+- head(k): k phần tử nhỏ nhất theo thứ tự, O(k)
+- from_sorted(): dựng từ dữ liệu đã sắp O(n) (bootstrap từ DB).
+
+Dùng cho BXH (services/leaderboard.py): khóa (-điểm, -lượt chơi, user_id).
+"""
+from bisect import bisect_left, bisect_right, insort
+
+LOAD = 512
+
+
+class RankIndex:
+    def __init__(self, load: int = LOAD):
+        self._load = load
+        self._blocks: list[list] = []
+        self._maxes: list = []
+        self._tree: list[int] = []
+        self._len = 0
+
+    @classmethod
+    def from_sorted(cls, items, load: int = LOAD) -> "RankIndex":
+        ri = cls(load)
+        items = list(items)
+        half = max(1, load // 2)
+        ri._blocks = [items[i:i + half] for i in range(0, len(items), half)]
+        ri._maxes = [b[-1] for b in ri._blocks]
+        ri._len = len(items)
+        ri._rebuild_tree()
+        return ri
+
+    def __len__(self) -> int:
+        return self._len
+
+    # ---------- Fenwick trên độ dài khối ----------
+    def _rebuild_tree(self) -> None:
+        tree = [len(b) for b in self._blocks]
+        for i in range(len(tree)):
+            j = i | (i + 1)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i: int, delta: int) -> None:
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i |= i + 1
+
+    def _prefix(self, i: int) -> int:
+        """Tổng độ dài các khối [0, i)."""
+        total, tree = 0, self._tree
+        i -= 1
+        while i >= 0:
+            total += tree[i]
+            i = (i & (i + 1)) - 1
+        return total
+
+    # ---------- Cập nhật ----------
+    def add(self, x) -> None:
+        if not self._blocks:
+            self._blocks.append([x])
+            self._maxes.append(x)
+            self._len = 1
+            self._rebuild_tree()
+            return
+        i = bisect_left(self._maxes, x)
+        if i == len(self._maxes):
+            i -= 1
+            self._blocks[i].append(x)
+            self._maxes[i] = x
+        else:
+            insort(self._blocks[i], x)
+        self._len += 1
+        block = self._blocks[i]
+        if len(block) > self._load:
+            half = len(block) // 2
+            self._blocks[i:i + 1] = [block[:half], block[half:]]
+            self._maxes[i:i + 1] = [block[half - 1], block[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, x) -> bool:
+        i = bisect_left(self._maxes, x)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, x)
+        if j == len(block) or block[j] != x:
+            return False
+        del block[j]
+        self._len -= 1
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+        else:
+            self._maxes[i] = block[-1]
+            self._tree_add(i, -1)
+        return True
+
+    # ---------- Truy vấn ----------
+    def rank(self, x) -> int:
+        """Số phần tử nhỏ hơn x (x có mặt => vị trí 0-based của x)."""
+        i = bisect_left(self._maxes, x)
+        if i == len(self._maxes):
+            return self._len
+        return self._prefix(i) + bisect_left(self._blocks[i], x)
+
+    def count_le(self, x) -> int:
+        i = bisect_right(self._maxes, x)
+        if i == len(self._maxes):
+            return self._len
+        return self._prefix(i) + bisect_right(self._blocks[i], x)
+
+    def head(self, k: int) -> list:
+        out = []
+        for block in self._blocks:
+            if len(out) >= k:
+                break
+            out.extend(block[: k - len(out)])
+        return out
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
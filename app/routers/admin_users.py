@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, text
+from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from typing import Optional
 
@@ -8,6 +8,8 @@ from ..db import get_db
 from ..models import User, KhachHang, NhanVien
 from .auth import require_roles
 from .. import models
+from ..pagination import TotalMode, count_total, paginate
+from ..services import points
 
 router = APIRouter(prefix="/admin/users", tags=["AdminUsers"])
 
@@ -84,7 +86,9 @@ def list_users(
     q: str | None = Query(None, description="Từ khoá username/email/sđt"),
     role: str | None = Query(None, regex="^(ADMIN|STAFF|CUSTOMER)$"),
     page: int = 1,
-    page_size: int = 20,
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: str | None = Query(None, description="next_cursor của trang trước"),
+    total: TotalMode = Query("estimate"),
     db: Session = Depends(get_db),
 ):
     """
@@ -125,33 +129,20 @@ def list_users(
             )
         )
 
-    total = query.count()
-    rows = (
-        query.order_by(User.id.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
+    n = count_total(db, query, User, total, filtered=bool(role or q))
+    rows, next_cursor = paginate(query, User.id, page_size, cursor=cursor, page=page)
 
     # Lấy tổng điểm thật cho TẤT CẢ user đang ở trang hiện tại (tránh N+1 query)
-    ids = [u.id for u in rows]
-    points_map = {i: 0 for i in ids}
-    if ids:
-        for r in db.execute(
-            text(
-                """
-                SELECT ma_nguoi_dung AS uid, COALESCE(SUM(diem_thay_doi),0) AS diem
-                FROM so_cai_diem
-                WHERE ma_nguoi_dung IN :ids
-                GROUP BY ma_nguoi_dung
-                """
-            ),
-            {"ids": tuple(ids)},
-        ).mappings():
-            points_map[int(r["uid"])] = int(r["diem"] or 0)
+    points_map = points.balances(db, [u.id for u in rows])
 
     items = [_serialize_user(db, u, points_map.get(u.id, 0)) for u in rows]
-    return {"total": total, "page": page, "page_size": page_size, "items": items}
+    return {
+        "total": n,
+        "page": page,
+        "page_size": page_size,
+        "items": items,
+        "next_cursor": next_cursor,
+    }
 
 
 # ========== Cập nhật quyền ==========
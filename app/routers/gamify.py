@@ -8,6 +8,9 @@ from typing import Optional
 from datetime import datetime
 
 from ..db import get_db
+from ..schema_registry import schema
+from ..services import challenge_progress, points
+from ..services.challenge_cache import challenge_cache
 from .auth import get_current_user, require_roles
 
 router = APIRouter(prefix="/gamify", tags=["Gamification"])
@@ -16,10 +19,7 @@ router = APIRouter(prefix="/gamify", tags=["Gamification"])
 # Helpers & Timezone
 # ---------------------------------------------------------------------
 _DT_FORMAT = "%Y-%m-%d %H:%M:%S"
-
-# Nếu MySQL chạy UTC nhưng bạn lưu thời gian theo VN (+07:00),
-# hãy đổi _NOW_EXPR = "CONVERT_TZ(NOW(), '+00:00', '+07:00')"
-_NOW_EXPR = "NOW()"
+# "Đang hiệu lực" tính theo giờ DB trong services/challenge_cache.py (_NOW_EXPR ở đó)
 
 
 def _try_parse_many(raw: str) -> Optional[datetime]:
@@ -76,101 +76,47 @@ def _extract_times(payload: dict):
     return s, e
 
 
-def _has_column(db: Session, table: str, column: str) -> bool:
-    try:
-        row = db.execute(
-            text(
-                """
-                SELECT 1
-                FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_NAME = :t
-                  AND COLUMN_NAME = :c
-                LIMIT 1
-                """
-            ),
-            {"t": table, "c": column},
-        ).first()
-        if row:
-            return True
-        row2 = db.execute(
-            text(
-                """
-                SELECT 1
-                FROM information_schema.COLUMNS
-                WHERE TABLE_NAME = :t
-                  AND COLUMN_NAME = :c
-                LIMIT 1
-                """
-            ),
-            {"t": table, "c": column},
-        ).first()
-        return bool(row2)
-    except Exception:
-        return False
-
-
 # =====================================================================
 # PUBLIC: điểm & thử thách tuần (kèm tiến độ hiện tại)
 # =====================================================================
 @router.get("/me/score")
 def my_score(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    row = db.execute(
-        text(
-            """
-            SELECT COALESCE(SUM(diem_thay_doi), 0) AS score
-            FROM so_cai_diem
-            WHERE ma_nguoi_dung = :uid
-            """
-        ),
-        {"uid": user.id},
-    ).mappings().first()
-    return {"score": int((row or {}).get("score", 0))}
+    # Số dư cộng dồn (points_balance), tra theo khóa chính
+    return {"score": points.balance(db, user.id)}
 
 
 @router.get("/me/challenges")
 def my_week_challenges(db: Session = Depends(get_db), user=Depends(get_current_user)):
     """
     Danh sách thử thách đang hoạt động + tiến độ hiện tại (da_dat) của user.
+    Định nghĩa thử thách lấy từ challenge_cache; DB chỉ tra tien_do_thu_thach theo khóa unique.
     """
-    has_active = _has_column(db, "thu_thach_tuan", "hoat_dong")
-    where_active = "AND IFNULL(tt.hoat_dong, 1) = 1" if has_active else ""
-
-    rows = db.execute(
-        text(
-            f"""
-            SELECT
-                tt.ma_thu_thach,
-                tt.ten_thu_thach,
-                tt.muc_tieu,
-                tt.diem_thuong,
-                DATE(tt.ngay_bat_dau) AS d_start,
-                DATE(tt.ngay_ket_thuc) AS d_end,
-                COALESCE(td.gia_tri_hien_tai, 0) AS da_dat
-            FROM thu_thach_tuan tt
-            LEFT JOIN tien_do_thu_thach td
-                   ON td.ma_thu_thach = tt.ma_thu_thach
-                  AND td.ma_nguoi_dung = :uid
-            WHERE {_NOW_EXPR} BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
-            {where_active}
-            ORDER BY tt.ngay_bat_dau ASC, tt.ma_thu_thach ASC
-            """
-        ),
-        {"uid": user.id},
-    ).mappings().all()
+    active = challenge_cache.active(db)
+    if not active:
+        return {"items": []}
+
+    progress = dict(db.execute(
+        text("""
+            SELECT ma_thu_thach, gia_tri_hien_tai
+            FROM tien_do_thu_thach
+            WHERE ma_thu_thach IN :ids AND ma_nguoi_dung = :uid
+        """),
+        {"ids": tuple(c["ma_thu_thach"] for c in active), "uid": user.id},
+    ).all())
 
     return {
         "items": [
             {
-                "ma_thu_thach": r["ma_thu_thach"],
-                "ten_thu_thach": r["ten_thu_thach"],
-                "muc_tieu": int(r["muc_tieu"] or 0),
-                "diem_thuong": int(r["diem_thuong"] or 0),
-                "tuan_bat_dau": str(r["d_start"]),
-                "tuan_ket_thuc": str(r["d_end"]),
-                "da_dat": int(r["da_dat"] or 0),
+                "ma_thu_thach": c["ma_thu_thach"],
+                "ten_thu_thach": c["ten_thu_thach"],
+                "muc_tieu": c["muc_tieu"],
+                "diem_thuong": c["diem_thuong"],
+                "loai_chi_so": c["loai_chi_so"] or challenge_progress.DEFAULT_METRIC,
+                "tuan_bat_dau": str(c["ngay_bat_dau"].date()),
+                "tuan_ket_thuc": str(c["ngay_ket_thuc"].date()),
+                "da_dat": int(progress.get(c["ma_thu_thach"]) or 0),
             }
-            for r in rows
+            for c in active
         ]
     }
 
@@ -198,6 +144,31 @@ class ChallengeUpdate(BaseModel):
     ngay_ket_thuc: Optional[str] = None
 
 
+@router.get("/metrics")
+def list_metrics():
+    """Các loại chỉ số thử thách (loai_chi_so) cho form quản trị và thẻ tiến độ."""
+    return {
+        "default": challenge_progress.DEFAULT_METRIC,
+        "items": [
+            {"code": k, "label": v, "unit": challenge_progress.METRIC_UNITS.get(k, "")}
+            for k, v in challenge_progress.METRICS.items()
+        ],
+    }
+
+
+def _metric_param(db, body: dict) -> Optional[str]:
+    try:
+        m = challenge_progress.normalize_metric(body.get("loai_chi_so"))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if m and m != challenge_progress.DEFAULT_METRIC and not challenge_progress.has_metric_column(db):
+        raise HTTPException(
+            status_code=409,
+            detail="DB chưa có cột loai_chi_so (chạy python -m app.services.challenge_progress --migrate)",
+        )
+    return m
+
+
 @router.get("/challenges")
 def list_challenges(
     db: Session = Depends(get_db),
@@ -205,18 +176,36 @@ def list_challenges(
     end: Optional[str] = Query(None, description="YYYY-MM-DD hoặc datetime"),
     all: int = Query(0, description="=1 để xem tất cả thay vì chỉ bản ghi còn hiệu lực"),
 ):
+    # Mặc định: chỉ hiển thị thử thách đang hiệu lực (từ challenge_cache, lọc ngày trong bộ nhớ)
+    if not all:
+        items = sorted(challenge_cache.active(db), key=lambda c: c["ma_thu_thach"])
+        items.sort(key=lambda c: c["ngay_bat_dau"], reverse=True)
+        if start:
+            s = datetime.strptime(_norm_start(start), _DT_FORMAT)
+            items = [c for c in items if c["ngay_ket_thuc"] >= s]
+        if end:
+            e = datetime.strptime(_norm_end(end), _DT_FORMAT)
+            items = [c for c in items if c["ngay_bat_dau"] <= e]
+        return {
+            "items": [
+                {
+                    "ma_thu_thach": c["ma_thu_thach"],
+                    "ten_thu_thach": c["ten_thu_thach"],
+                    "muc_tieu": c["muc_tieu"],
+                    "diem_thuong": c["diem_thuong"],
+                    "loai_chi_so": c["loai_chi_so"] or challenge_progress.DEFAULT_METRIC,
+                    "ngay_bat_dau": str(c["ngay_bat_dau"]),
+                    "ngay_ket_thuc": str(c["ngay_ket_thuc"]),
+                }
+                for c in items
+            ]
+        }
+
     where = []
     params = {}
-
-    # Mặc định: chỉ hiển thị thử thách đang hiệu lực
-    if not all:
-        where.append(f"{_NOW_EXPR} BETWEEN ngay_bat_dau AND ngay_ket_thuc")
-        if _has_column(db, "thu_thach_tuan", "hoat_dong"):
-            where.append("IFNULL(hoat_dong, 1) = 1")
-    else:
-        # Nếu all=1 vẫn tôn trọng bộ lọc ngày nếu có
-        if _has_column(db, "thu_thach_tuan", "hoat_dong"):
-            where.append("IFNULL(hoat_dong, 1) IN (0,1)")
+    # all=1 vẫn tôn trọng bộ lọc ngày nếu có
+    if schema.has(db, "thu_thach_tuan", "hoat_dong"):
+        where.append("IFNULL(hoat_dong, 1) IN (0,1)")
 
     # Bộ lọc theo ngày nếu truyền vào
     if start:
@@ -229,6 +218,7 @@ def list_challenges(
     sql = f"""
         SELECT
             ma_thu_thach, ten_thu_thach, muc_tieu, diem_thuong,
+            {challenge_progress.metric_expr(db, "thu_thach_tuan")} AS loai_chi_so,
             ngay_bat_dau, ngay_ket_thuc
         FROM thu_thach_tuan
         {'WHERE ' + ' AND '.join(where) if where else ''}
@@ -243,6 +233,7 @@ def list_challenges(
                 "ten_thu_thach": r["ten_thu_thach"],
                 "muc_tieu": int(r["muc_tieu"] or 0),
                 "diem_thuong": int(r["diem_thuong"] or 0),
+                "loai_chi_so": r["loai_chi_so"],
                 "ngay_bat_dau": str(r["ngay_bat_dau"]),
                 "ngay_ket_thuc": str(r["ngay_ket_thuc"]),
             }
@@ -271,12 +262,18 @@ def create_challenge(body: dict = Body(...), db: Session = Depends(get_db)):
     cols = ["ten_thu_thach", "muc_tieu", "diem_thuong", "ngay_bat_dau", "ngay_ket_thuc"]
     vals = [":t", ":mt", ":d", ":s", ":e"]
     params = {"t": ten, "mt": muc, "d": diem, "s": s, "e": e}
+    metric = _metric_param(db, body)
+    if metric and challenge_progress.has_metric_column(db):
+        cols.append("loai_chi_so")
+        vals.append(":lcs")
+        params["lcs"] = metric
 
     sql_ins = text(f"INSERT INTO thu_thach_tuan ({', '.join(cols)}) VALUES ({', '.join(vals)})")
     try:
         db.execute(sql_ins, params)
         new_id = db.execute(text("SELECT LAST_INSERT_ID()")).scalar()
         db.commit()
+        challenge_cache.invalidate()
         return {"ok": True, "ma_thu_thach": new_id}
     except IntegrityError:
         db.rollback()
@@ -296,6 +293,10 @@ def update_challenge(ma: str, body: dict = Body(...), db: Session = Depends(get_
     if "diem_thuong" in body:
         sets.append("diem_thuong = :d")
         params["d"] = _to_int(body.get("diem_thuong"), 0)
+    metric = _metric_param(db, body)
+    if metric and challenge_progress.has_metric_column(db):
+        sets.append("loai_chi_so = :lcs")
+        params["lcs"] = metric
 
     raw_s, raw_e = _extract_times(body)
     if raw_s is not None:
@@ -315,6 +316,7 @@ def update_challenge(ma: str, body: dict = Body(...), db: Session = Depends(get_
     if res.rowcount == 0:
         raise HTTPException(status_code=404, detail="Không tìm thấy thử thách")
     db.commit()
+    challenge_cache.invalidate()
     return {"ok": True, "ma_thu_thach": ma}
 
 
@@ -322,16 +324,18 @@ def update_challenge(ma: str, body: dict = Body(...), db: Session = Depends(get_
 def delete_challenge(ma: str, db: Session = Depends(get_db)):
     """
     XÓA CỨNG thử thách:
-    1) Xóa các tiến độ liên quan ở `tien_do_thu_thach`
+    1) Xóa các tiến độ liên quan ở `tien_do_thu_thach` (+ khóa đếm `tien_do_thu_thach_khoa`)
     2) Xóa bản ghi ở `thu_thach_tuan`
     """
     try:
+        db.execute(text("DELETE FROM tien_do_thu_thach_khoa WHERE ma_thu_thach = :m"), {"m": ma})
         db.execute(text("DELETE FROM tien_do_thu_thach WHERE ma_thu_thach = :m"), {"m": ma})
         res = db.execute(text("DELETE FROM thu_thach_tuan WHERE ma_thu_thach = :m"), {"m": ma})
         if res.rowcount == 0:
             db.rollback()
             raise HTTPException(status_code=404, detail="Không tìm thấy thử thách")
         db.commit()
+        challenge_cache.invalidate()
         return {"ok": True, "deleted": True}
     except SQLAlchemyError as e:
         db.rollback()
@@ -343,31 +347,23 @@ def delete_challenge(ma: str, db: Session = Depends(get_db)):
 # =====================================================================
 def increment_active_challenges(db: Session, user_id: int, inc: int = 1) -> int:
     """
-    Cộng tiến độ 'inc' cho TẤT CẢ thử thách đang hoạt động của user.
-    - Hoạt động = NOW() (hay _NOW_EXPR) nằm trong [ngay_bat_dau, ngay_ket_thuc]
-      và (hoat_dong IS NULL hoặc =1).
-    - Yêu cầu UNIQUE KEY (ma_thu_thach, ma_nguoi_dung) trên `tien_do_thu_thach`.
+    Cộng 'inc' lượt chơi (chỉ số PLAY_COUNT) cho các thử thách đang hoạt động của user, rồi commit.
+    Thử thách đang hoạt động lấy từ challenge_cache (không quét thu_thach_tuan).
     Trả về số thử thách được cộng (ước lượng theo rowcount).
     """
-    has_active = _has_column(db, "thu_thach_tuan", "hoat_dong")
-    where_active = "AND IFNULL(tt.hoat_dong,1)=1" if has_active else ""
-
-    res = db.execute(
-        text(
-            f"""
-            INSERT INTO tien_do_thu_thach (ma_thu_thach, ma_nguoi_dung, gia_tri_hien_tai)
-            SELECT tt.ma_thu_thach, :uid, :inc
-            FROM thu_thach_tuan tt
-            WHERE {_NOW_EXPR} BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
-            {where_active}
-            ON DUPLICATE KEY UPDATE
-              gia_tri_hien_tai = tien_do_thu_thach.gia_tri_hien_tai + VALUES(gia_tri_hien_tai)
-            """
-        ),
-        {"uid": user_id, "inc": inc},
-    )
+    n = increment_challenges_bulk(db, {user_id: inc})
     db.commit()
-    return res.rowcount or 0
+    return n
+
+
+def increment_challenges_bulk(db: Session, incs: dict[int, int]) -> int:
+    """
+    Bản nhiều user: incs = {user_id: inc} -> challenge_progress.record (1 upsert theo lô).
+    KHÔNG commit (caller kiểm soát transaction).
+    """
+    return challenge_progress.record(db, [
+        (int(u), challenge_progress.PLAY_COUNT, int(i), None) for u, i in incs.items() if i
+    ])
 
 
 @router.post("/hook/played", dependencies=[Depends(require_roles("ADMIN", "STAFF", "CUSTOMER"))])
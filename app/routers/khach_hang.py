@@ -13,6 +13,7 @@ from ..schemas import (
     PageKhachHangOut,
 )
 from .auth import require_roles, get_current_user
+from ..pagination import TotalMode, count_total, paginate
 
 router = APIRouter(prefix="/khach-hang", tags=["Khách hàng"])
 
@@ -28,7 +29,9 @@ router = APIRouter(prefix="/khach-hang", tags=["Khách hàng"])
 def list_customers(
     q: Optional[str] = Query(None, description="Từ khoá tên/sđt/email"),
     page: int = 1,
-    page_size: int = 20,
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    total: TotalMode = Query("estimate"),
     db: Session = Depends(get_db),
 ):
     query = db.query(KhachHang)
@@ -41,14 +44,15 @@ def list_customers(
                 KhachHang.email.ilike(like),
             )
         )
-    total = query.count()
-    rows = (
-        query.order_by(KhachHang.id.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
-    return {"total": total, "page": page, "page_size": page_size, "items": rows}
+    n = count_total(db, query, KhachHang, total, filtered=bool(q))
+    rows, next_cursor = paginate(query, KhachHang.id, page_size, cursor=cursor, page=page)
+    return {
+        "total": n,
+        "page": page,
+        "page_size": page_size,
+        "items": rows,
+        "next_cursor": next_cursor,
+    }
 
 
 @router.get(
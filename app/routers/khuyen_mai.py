@@ -5,11 +5,20 @@ import json
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field, field_validator
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, text
 
 from ..db import get_db
 from ..models import KhuyenMai, User
 from .auth import get_current_user
+from ..services import promo_backtest, promo_conditions, promo_quota
+from ..promo_utils import (
+    CompiledPromo,
+    canonical_condition,
+    evaluate_batch,
+    unknown_min_tier,
+    load_active_promos,
+    promo_cache,
+)
 
 router = APIRouter(prefix="/khuyen-mai", tags=["Khuyến mãi"])
 
@@ -76,21 +85,26 @@ def ensure_admin(user: User):
         raise HTTPException(status_code=403, detail="Chỉ ADMIN được thao tác")
 
 
-def _normalize_dieu_kien(val: Optional[Union[str, dict]]) -> Optional[str]:
+def _normalize_dieu_kien(val: Optional[Union[str, dict]]) -> Optional[dict]:
+    """Mọi alias cũ -> dạng chuẩn lưu vào cột JSON (xem promo_utils.canonical_condition)."""
     if val is None:
         return None
-    if isinstance(val, dict):
-        return json.dumps(val, ensure_ascii=False)
-    try:
-        json.loads(val)
-        return val
-    except Exception:
-        return json.dumps({"raw": val}, ensure_ascii=False)
-
-
-def _parse_dieu_kien(s: Optional[str]) -> Optional[dict]:
-    if s is None:
-        return None
+    if isinstance(val, str):
+        if not val.strip():
+            return None
+        try:
+            json.loads(val)
+        except Exception:
+            val = {"raw": val}
+    bad = unknown_min_tier(val)
+    if bad:
+        raise HTTPException(status_code=422, detail=f"min_tier không hợp lệ: {bad} (THUONG/BAC/VANG/KIMCUONG)")
+    return canonical_condition(val)
+
+
+def _parse_dieu_kien(s: Optional[Union[str, dict]]) -> Optional[dict]:
+    if s is None or isinstance(s, dict):
+        return s
     try:
         return json.loads(s)
     except Exception:
@@ -101,76 +115,37 @@ def _now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
-def _tier_rank(name: Optional[str]) -> int:
-    if not name:
-        return 0
-    n = str(name).strip().upper()
-    if n in {"STANDARD", "THUONG", "THƯỜNG"}:
-        return 1
-    return {"BAC": 2, "VANG": 3, "KIMCUONG": 4}.get(n, 0)
-
-
 def _is_open(row: KhuyenMai, now: Optional[datetime] = None) -> bool:
     now = now or _now_utc()
     return row.active == 1 and (row.thoi_gian_bd <= now <= row.thoi_gian_kt)
 
 
-def _satisfy_conditions(
-    row: KhuyenMai,
-    amount: Optional[int] = None,
-    tier: Optional[str] = None,
-) -> bool:
-    """
-    Kiểm tra điều kiện KM:
-      - min_amount
-      - member_tiers / tiers (liệt kê cụ thể)
-      - member_only
-      - min_tier (bậc tối thiểu, ví dụ: VANG => Vàng và Kim Cương)
-    """
-    dk = _parse_dieu_kien(row.dieu_kien) or {}
-
-    # --- min_amount ---
-    min_amount = dk.get("min_amount")
-    if min_amount is not None and amount is not None:
-        if amount < int(min_amount):
-            return False
-
-    norm_tier = (str(tier).upper() if tier else None)
-    if norm_tier in {"THƯỜNG", "THUONG"}:
-        norm_tier = "STANDARD"
-
-    # --- member_only ---
-    if dk.get("member_only"):
-        if norm_tier is None or norm_tier in ("STANDARD", "THUONG"):
-            return False
-
-    # --- min_tier (mới) ---
-    min_tier = dk.get("min_tier") or dk.get("tier_at_least") or dk.get("at_least")
-    if min_tier:
-        if norm_tier is None:
-            return False
-        if _tier_rank(norm_tier) < _tier_rank(min_tier):
-            return False
-        return True
-
-    # --- member_tiers / tiers (cũ) ---
-    tiers = dk.get("member_tiers") or dk.get("tiers")
-    if tiers:
-        if norm_tier is None:
-            return False
-        if norm_tier not in [str(x).upper() for x in tiers]:
-            return False
-
-    return True
-
-
-def _calc_preview(amount: int, promo: KhuyenMai) -> Tuple[float, int, int]:
-    rate = float(promo.ty_le or 0)
+def _calc_preview(amount: int, promo: CompiledPromo) -> Tuple[float, int, int]:
+    rate = float(promo.rate or 0)
     discount_amount = int(round(amount * rate / 100.0))
     final_total = amount - discount_amount
     return rate, discount_amount, final_total
 
 
+def _compile(row: KhuyenMai) -> CompiledPromo:
+    return CompiledPromo({
+        "id": row.id, "ten": row.ten, "ty_le": row.ty_le, "dieu_kien": row.dieu_kien,
+        "thoi_gian_bd": row.thoi_gian_bd, "thoi_gian_kt": row.thoi_gian_kt, "active": row.active,
+    })
+
+
+def _cond_ok(p: CompiledPromo, amount, tier, su_kien_id, event_scope, min_from, min_to) -> bool:
+    """Như promo_conditions.sql_filter + các bộ lọc cột sinh, trên KM đã biên dịch."""
+    return (
+        (event_scope not in (0, 1) or int(p.events is not None) == event_scope)
+        and (min_from is None or p.min_amount >= min_from)
+        and (min_to is None or p.min_amount <= min_to)
+        and (amount is None or float(amount) >= p.min_amount)
+        and (tier is None or p.tier_ok(tier or None))
+        and (su_kien_id is None or p.event_ok(su_kien_id))
+    )
+
+
 def _to_out(row: KhuyenMai) -> KMOut:
     return KMOut(
         id=row.id,
@@ -189,6 +164,12 @@ def list_promos(
     db: Session = Depends(get_db),
     active: Optional[int] = Query(None),
     open_only: Optional[int] = Query(None),
+    amount: Optional[float] = Query(None, ge=0, description="chỉ KM áp dụng được cho hoá đơn này"),
+    tier: Optional[str] = Query(None, description="chỉ KM áp dụng được cho bậc này"),
+    su_kien_id: Optional[int] = Query(None, description="chỉ KM áp dụng được cho sự kiện này"),
+    event_scope: Optional[int] = Query(None, description="0 = KM mọi sự kiện, 1 = KM theo sự kiện"),
+    min_amount_from: Optional[float] = Query(None, ge=0),
+    min_amount_to: Optional[float] = Query(None, ge=0),
 ):
     q = db.query(KhuyenMai)
     now = _now_utc()
@@ -202,10 +183,41 @@ def list_promos(
                 KhuyenMai.thoi_gian_kt >= now,
             )
         )
+    by_cond = (
+        event_scope in (0, 1) or min_amount_from is not None or min_amount_to is not None
+        or amount is not None or tier is not None or su_kien_id is not None
+    )
+    if not by_cond:
+        return [_to_out(r) for r in q.order_by(KhuyenMai.id.desc()).all()]
+    if not promo_conditions.ready(db):
+        # DB chưa có cột sinh (chưa migrate xong): lọc bằng CompiledPromo, cùng ngữ nghĩa
+        rows = [
+            r for r in q.order_by(KhuyenMai.id.desc()).all()
+            if _cond_ok(_compile(r), amount, tier, su_kien_id, event_scope, min_amount_from, min_amount_to)
+        ]
+        return [_to_out(r) for r in rows]
+
+    # Lọc theo điều kiện trên cột sinh có index (không nạp & parse JSON từng dòng)
+    parts, params = [], {}
+    if event_scope in (0, 1):
+        parts.append("khuyen_mai.dk_event_scope = :f_scope")
+        params["f_scope"] = event_scope
+    if min_amount_from is not None:
+        parts.append("khuyen_mai.dk_min_amount >= :f_min_from")
+        params["f_min_from"] = min_amount_from
+    if min_amount_to is not None:
+        parts.append("khuyen_mai.dk_min_amount <= :f_min_to")
+        params["f_min_to"] = min_amount_to
+    if amount is not None or tier is not None or su_kien_id is not None:
+        where, p = promo_conditions.sql_filter(amount, tier, su_kien_id, alias="khuyen_mai")
+        parts.append(where)
+        params.update(p)
+    q = q.filter(text(" AND ".join(parts))).params(**params)
     rows = q.order_by(KhuyenMai.id.desc()).all()
     return [_to_out(r) for r in rows]
 
 
+
 @router.post("", response_model=KMOut)
 def create_promo(
     body: KMCreate,
@@ -223,6 +235,7 @@ def create_promo(
     )
     db.add(row)
     db.commit()
+    promo_cache.invalidate()
     db.refresh(row)
     return _to_out(row)
 
@@ -244,6 +257,7 @@ def update_promo(
     for k, v in data.items():
         setattr(row, k, v)
     db.commit()
+    promo_cache.invalidate()
     db.refresh(row)
     return _to_out(row)
 
@@ -260,6 +274,7 @@ def delete_promo(
         raise HTTPException(404, "Khuyến mãi không tồn tại")
     db.delete(row)
     db.commit()
+    promo_cache.invalidate()
     return {"ok": True}
 
 
@@ -275,64 +290,120 @@ def toggle_promo(
         raise HTTPException(404, "Khuyến mãi không tồn tại")
     row.active = 0 if row.active == 1 else 1
     db.commit()
+    promo_cache.invalidate()
     db.refresh(row)
     return _to_out(row)
 
 
+class KMQuotaIn(BaseModel):
+    gioi_han_tong: Optional[int] = Field(default=None, ge=0)
+    gioi_han_moi_user: Optional[int] = Field(default=None, ge=1)
+    so_slot: int = Field(promo_quota.DEFAULT_SLOTS, ge=1, le=64)
+
+
+@router.get("/{km_id}/quota")
+def get_promo_quota(
+    km_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    ensure_admin(user)
+    if not db.get(KhuyenMai, km_id):
+        raise HTTPException(404, "Khuyến mãi không tồn tại")
+    return promo_quota.get_quota(db, km_id) or {
+        "khuyen_mai_id": km_id,
+        "gioi_han_tong": None,
+        "gioi_han_moi_user": None,
+    }
+
+
+@router.put("/{km_id}/quota")
+def set_promo_quota(
+    km_id: int,
+    body: KMQuotaIn,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    ensure_admin(user)
+    if not db.get(KhuyenMai, km_id):
+        raise HTTPException(404, "Khuyến mãi không tồn tại")
+    out = promo_quota.set_quota(
+        db, km_id, body.gioi_han_tong, body.gioi_han_moi_user, so_slot=body.so_slot
+    )
+    db.commit()
+    promo_cache.invalidate()
+    return out
+
+
+class KMBacktestIn(BaseModel):
+    tu_ngay: datetime
+    den_ngay: datetime
+    rules: List[dict] = Field(default_factory=list)  # KM nháp: {ten, ty_le, dieu_kien, thoi_gian_bd?, thoi_gian_kt?}
+    ids: List[int] = Field(default_factory=list)  # KM có sẵn muốn đưa vào mô phỏng
+    trang_thai: List[str] = Field(default_factory=lambda: list(promo_backtest.DEFAULT_STATUSES))
+
+
+@router.post("/backtest")
+def backtest_promos(
+    body: KMBacktestIn,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Mô phỏng bộ KM trên vé lịch sử trong [tu_ngay, den_ngay). Không ghi DB."""
+    ensure_admin(user)
+    if body.den_ngay <= body.tu_ngay:
+        raise HTTPException(422, "den_ngay phải sau tu_ngay")
+    rules = [dict(r) for r in body.rules]
+    if body.ids:
+        rows = db.query(KhuyenMai).filter(KhuyenMai.id.in_(body.ids)).all()
+        rules += [
+            {
+                "id": r.id,
+                "ten": r.ten,
+                "ty_le": r.ty_le,
+                "dieu_kien": r.dieu_kien,
+                "thoi_gian_bd": r.thoi_gian_bd,
+                "thoi_gian_kt": r.thoi_gian_kt,
+            }
+            for r in rows
+        ]
+    if not rules:
+        raise HTTPException(422, "Cần ít nhất 1 khuyến mãi để mô phỏng")
+    try:
+        return promo_backtest.run_backtest(
+            db,
+            rules,
+            body.tu_ngay.replace(tzinfo=None),
+            body.den_ngay.replace(tzinfo=None),
+            statuses=[s.strip().upper() for s in body.trang_thai if s.strip()] or promo_backtest.DEFAULT_STATUSES,
+        )
+    except RuntimeError as e:
+        raise HTTPException(503, str(e))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(422, f"Khuyến mãi nháp không hợp lệ: {e}")
+
+
 @router.get("/applicable-promos", response_model=List[KMLite])
 def applicable_promos(
     amount: int = Query(..., ge=0),
     tier: Optional[str] = Query(None),
+    su_kien_id: Optional[int] = Query(None),
     db: Session = Depends(get_db),
 ):
-    now = _now_utc()
-    rows = (
-        db.query(KhuyenMai)
-        .filter(
-            and_(
-                KhuyenMai.active == 1,
-                KhuyenMai.thoi_gian_bd <= now,
-                KhuyenMai.thoi_gian_kt >= now,
-            )
-        )
-        .order_by(KhuyenMai.id.desc())
-        .all()
-    )
-    out = []
-    for r in rows:
-        if _satisfy_conditions(r, amount=amount, tier=tier):
-            out.append(KMLite(id=r.id, ten=r.ten, ty_le=float(r.ty_le or 0)))
-    return out
+    # Cùng bộ đánh giá với /ve/applicable-promos (promo_utils.evaluate_batch)
+    appl = evaluate_batch(load_active_promos(db), [(amount, tier, su_kien_id)])[0]
+    return [KMLite(id=p.id, ten=p.ten, ty_le=p.rate) for p in appl]
 
 
 @router.get("/preview", response_model=KMPreviewOut)
 def preview_best(
     amount: int = Query(..., ge=0),
     tier: Optional[str] = Query(None),
+    su_kien_id: Optional[int] = Query(None),
     db: Session = Depends(get_db),
 ):
-    now = _now_utc()
-    rows = (
-        db.query(KhuyenMai)
-        .filter(
-            and_(
-                KhuyenMai.active == 1,
-                KhuyenMai.thoi_gian_bd <= now,
-                KhuyenMai.thoi_gian_kt >= now,
-            )
-        )
-        .all()
-    )
-
-    best = None
-    for r in rows:
-        if not _satisfy_conditions(r, amount=amount, tier=tier):
-            continue
-        rate, off, final = _calc_preview(amount, r)
-        if best is None or off > best[1]:
-            best = (rate, off, final, r)
-
-    if best is None:
+    row = promo_cache.best(db, amount, tier, su_kien_id)
+    if row is None:
         return KMPreviewOut(
             amount=amount,
             discount_rate=0,
@@ -341,11 +412,11 @@ def preview_best(
             promo=None,
         )
 
-    rate, off, final, row = best
+    rate, off, final = _calc_preview(amount, row)
     return KMPreviewOut(
         amount=amount,
         discount_rate=rate,
         discount_amount=off,
         final_total=final,
-        promo=KMLite(id=row.id, ten=row.ten, ty_le=float(row.ty_le or 0)),
+        promo=KMLite(id=row.id, ten=row.ten, ty_le=row.rate),
     )
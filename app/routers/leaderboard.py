@@ -1,13 +1,56 @@
-from fastapi import APIRouter, Depends, Query
+from datetime import date, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from ..db import get_db
+from ..services import leaderboard_buckets, points
+from ..services.leaderboard import board, tier_of
+from .auth import get_current_user
 
 router = APIRouter(prefix="/leaderboard", tags=["Leaderboard"])
 
 
-@router.get("/weekly")  # dùng đường dẫn cũ cho FE, nhưng dữ liệu là all-time
+def _present(db, top, diem_hang=None):
+    """
+    top: [(user_id, diem, so_luot_choi)] theo thứ hạng -> dạng trả về cho FE.
+    diem_hang: {user_id: điểm tích lũy} để xếp hạng thành viên (mặc định = diem của BXH).
+    """
+    names = dict(db.execute(
+        text("SELECT id, username FROM users WHERE id IN :ids"),
+        {"ids": tuple(uid for uid, _, _ in top) or (0,)},
+    ).all())
+    out = []
+    for i, (uid, diem, plays) in enumerate(top, 1):
+        code, label = tier_of(diem if diem_hang is None else diem_hang.get(uid, 0))
+        out.append(
+            {
+                "rank": i,
+                "user_id": uid,
+                "ten_hien_thi": names.get(uid) or f"user_{uid}",
+                "so_luot_choi": plays,
+                "diem": diem,
+                "tier_code": code,
+                "tier_label": label,
+            }
+        )
+    return out
+
+
+def _window(db, d_from: date, d_to: date, limit: int) -> dict:
+    """{"tu_ngay", "den_ngay", "items"}: dạng chung của /weekly, /monthly, /range."""
+    res = leaderboard_buckets.top(db, d_from, d_to, limit)
+    # Hạng thành viên theo điểm tích lũy (toàn thời gian), không theo điểm trong kỳ
+    hang = points.balances(db, [uid for uid, _, _ in res["rows"]])
+    return {
+        "tu_ngay": str(res["tu_ngay"]),
+        "den_ngay": str(res["den_ngay"]),
+        "items": _present(db, res["rows"], hang),
+    }
+
+
+@router.get("/all-time")
 def leaderboard_all_time(
     limit: int = Query(20, ge=1, le=100),
     db: Session = Depends(get_db),
@@ -18,21 +61,97 @@ def leaderboard_all_time(
     - Nếu bằng điểm, ưu tiên tổng số vé TRÒ CHƠI đã thanh toán ↓
     - Hiển thị cả người chỉ có điểm hoặc chỉ có lượt chơi
     - Kèm hạng thành viên (Bạc/Vàng/Kim cương) theo tổng điểm
+    Đọc từ BXH trong bộ nhớ (services/leaderboard.py); DB chưa migrate thì dùng truy vấn cũ.
     """
-    sql = text(
-        """
-        -- Tổng điểm của từng người (mọi thời điểm)
-        WITH points AS (
+    if not board.ready(db):
+        return _all_time_sql(db, limit)
+    return _present(db, board.top(db, limit))
+
+
+@router.get("/weekly")
+def leaderboard_weekly(
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    BXH tuần này (thứ Hai -> hôm nay, theo ngày của DB), cùng cách xếp như toàn thời gian
+    nhưng chỉ tính điểm / lượt chơi phát sinh trong tuần (leaderboard_buckets).
+    Trả về {"tu_ngay", "den_ngay", "items"} như /range.
+    Bảng gộp theo ngày chưa dựng xong thì items = BXH toàn thời gian (tu_ngay / den_ngay = null).
+    """
+    if not leaderboard_buckets.enabled(db):
+        return _all_time_window(db, limit)
+    today = leaderboard_buckets.db_today(db)
+    return _window(db, today - timedelta(days=today.weekday()), today, limit)
+
+
+@router.get("/monthly")
+def leaderboard_monthly(
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """BXH tháng này (ngày 1 -> hôm nay). Cùng dạng trả về và đường dự phòng như /weekly."""
+    if not leaderboard_buckets.enabled(db):
+        return _all_time_window(db, limit)
+    today = leaderboard_buckets.db_today(db)
+    return _window(db, leaderboard_buckets.month_start(today), today, limit)
+
+
+@router.get("/range")
+def leaderboard_range(
+    tu_ngay: date = Query(..., description="YYYY-MM-DD"),
+    den_ngay: date = Query(..., description="YYYY-MM-DD"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    BXH theo khoảng ngày tùy chọn. Phần đã gộp theo tháng được nới ra trọn tháng;
+    tu_ngay / den_ngay trong kết quả là khoảng thực tế đã tính.
+    """
+    if not leaderboard_buckets.enabled(db):
+        raise HTTPException(status_code=503, detail="Dữ liệu BXH theo ngày đang được dựng lại, thử lại sau")
+    if den_ngay < tu_ngay:
+        tu_ngay, den_ngay = den_ngay, tu_ngay
+    return _window(db, tu_ngay, den_ngay, limit)
+
+
+@router.get("/me")
+def leaderboard_me(db: Session = Depends(get_db), user=Depends(get_current_user)):
+    """Hạng hiện tại của user trên BXH toàn thời gian (rank = null nếu chưa có điểm / lượt chơi)."""
+    r = board.rank_of(db, user.id) if board.ready(db) else None
+    if r is None:
+        return {"rank": None, "diem": 0, "so_luot_choi": 0}
+    code, label = tier_of(r["diem"])
+    return {**r, "tier_code": code, "tier_label": label}
+
+
+def _all_time_window(db, limit: int) -> dict:
+    return {"tu_ngay": None, "den_ngay": None, "items": leaderboard_all_time(limit=limit, db=db)}
+
+
+def _all_time_sql(db, limit: int):
+    """
+    Truy vấn cũ (tổng hợp toàn bảng ve), chỉ dùng khi BXH trong bộ nhớ chưa sẵn sàng.
+    Điểm lấy từ points_balance nếu đã backfill, chưa thì SUM sổ cái.
+    """
+    if points.ready(db):
+        # Tổng điểm của từng người: số dư cộng dồn (points_balance), không SUM lại sổ cái
+        points_cte = "SELECT pb.user_id AS ma_nguoi_dung, pb.diem FROM points_balance pb"
+    else:
+        points_cte = """
             SELECT scd.ma_nguoi_dung, COALESCE(SUM(scd.diem_thay_doi), 0) AS diem
             FROM so_cai_diem scd
             GROUP BY scd.ma_nguoi_dung
-        ),
-        -- Tổng lượt chơi (mọi thời điểm): chỉ tính vé TRÒ CHƠI đã PAID
+        """
+    sql = text(
+        f"""
+        WITH points AS ({points_cte}),
+        -- Tổng lượt chơi (mọi thời điểm): vé TRÒ CHƠI đã thanh toán (kể cả đã check-in / dùng)
         -- Đếm theo so_luong; nếu so_luong NULL -> 1
         plays AS (
             SELECT v.user_id AS ma_nguoi_dung,
                    SUM(CASE
-                         WHEN v.tro_choi_id IS NOT NULL AND v.trang_thai = 'PAID'
+                         WHEN v.tro_choi_id IS NOT NULL AND v.trang_thai IN ({leaderboard_buckets.PLAYED})
                          THEN COALESCE(v.so_luong, 1)
                          ELSE 0
                        END) AS so_luot_choi
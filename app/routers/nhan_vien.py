@@ -1,9 +1,10 @@
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, text
 
 from ..db import get_db
 from ..models import NhanVien, User, TroChoi, SuKien, KhuyenMai, Ve
@@ -14,6 +15,10 @@ from ..schemas import (
     PageNhanVienOut,
 )
 from .auth import require_roles, get_current_user
+from ..services import auto_migrate, challenge_reward_job, leaderboard, leaderboard_buckets, outbox, points, ticket_expiry, ticket_state
+from ..pagination import TotalMode, count_total, paginate
+from ..promo_utils import promo_cache
+from ..schema_registry import schema
 
 router = APIRouter(prefix="/nhan-vien", tags=["Nhân viên"])
 
@@ -28,7 +33,9 @@ router = APIRouter(prefix="/nhan-vien", tags=["Nhân viên"])
 def list_staff(
     q: Optional[str] = Query(None, description="Tìm theo tên/sđt/email"),
     page: int = 1,
-    page_size: int = 20,
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    total: TotalMode = Query("estimate"),
     db: Session = Depends(get_db),
 ):
     query = db.query(NhanVien)
@@ -41,14 +48,15 @@ def list_staff(
                 NhanVien.email.ilike(like),
             )
         )
-    total = query.count()
-    rows = (
-        query.order_by(NhanVien.id.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
-    return {"total": total, "page": page, "page_size": page_size, "items": rows}
+    n = count_total(db, query, NhanVien, total, filtered=bool(q))
+    rows, next_cursor = paginate(query, NhanVien.id, page_size, cursor=cursor, page=page)
+    return {
+        "total": n,
+        "page": page,
+        "page_size": page_size,
+        "items": rows,
+        "next_cursor": next_cursor,
+    }
 
 
 @router.get(
@@ -153,7 +161,7 @@ def ops_set_game_status(
     if not row:
         raise HTTPException(404, "Không tìm thấy trò chơi")
     row.trang_thai = value
-    if hasattr(row, "updated_at"):
+    if schema.has(db, "tro_choi", "updated_at"):
         row.updated_at = _now()
     db.commit()
     db.refresh(row)
@@ -170,7 +178,7 @@ def ops_set_event_status(
     if not row:
         raise HTTPException(404, "Không tìm thấy sự kiện")
     row.trang_thai = value
-    if hasattr(row, "updated_at"):
+    if schema.has(db, "su_kien", "updated_at"):
         row.updated_at = _now()
     db.commit()
     db.refresh(row)
@@ -187,9 +195,10 @@ def ops_set_promo_active(
     if not row:
         raise HTTPException(404, "Không tìm thấy khuyến mãi")
     row.active = int(value)
-    if hasattr(row, "updated_at"):
+    if schema.has(db, "khuyen_mai", "updated_at"):
         row.updated_at = _now()
     db.commit()
+    promo_cache.invalidate()
     db.refresh(row)
     return {"ok": True, "id": row.id, "active": row.active}
 
@@ -199,22 +208,33 @@ def ops_list_tickets(
     status: Optional[str] = Query("PENDING", description="PENDING|UNPAID|BOOKED|PAID|CANCELLED|ALL"),
     loai: Optional[str] = Query(None, description="GAME|EVENT"),
     page: int = 1,
-    page_size: int = 20,
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    total: TotalMode = Query("estimate"),
     db: Session = Depends(get_db),
 ):
     q = db.query(Ve)
     if loai:
-        q = q.filter(Ve.loai == loai)
+        loai = loai.upper()
+        if schema.has(db, "ve", "loai"):
+            q = q.filter(text("ve.loai = :loai")).params(loai=loai)
+        elif loai == "GAME":
+            q = q.filter(Ve.tro_choi_id.isnot(None))
+        elif loai == "EVENT":
+            q = q.filter(Ve.su_kien_id.isnot(None))
     if status and status.upper() != "ALL":
         q = q.filter(Ve.trang_thai == status.upper())
-    total = q.count()
-    items = (
-        q.order_by(Ve.created_at.desc())
-         .offset((page - 1) * page_size)
-         .limit(page_size)
-         .all()
+    n = count_total(db, q, Ve, total, filtered=bool(loai) or (status or "").upper() != "ALL")
+    items, next_cursor = paginate(
+        q, Ve.id, page_size, cursor=cursor, page=page, sort_col=Ve.created_at
     )
-    return {"total": total, "page": page, "page_size": page_size, "items": items}
+    return {
+        "total": n,
+        "page": page,
+        "page_size": page_size,
+        "items": items,
+        "next_cursor": next_cursor,
+    }
 
 # ---- Vé: duyệt thanh toán ----
 @router.post("/ops/ve/{ticket_id}/approve", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
@@ -230,23 +250,31 @@ def ops_approve_ticket(ticket_id: int, db: Session = Depends(get_db)):
     if row.trang_thai not in ("BOOKED", "PENDING", "UNPAID"):
         raise HTTPException(400, f"Vé đang ở trạng thái không hợp lệ: {row.trang_thai}")
 
-    row.trang_thai = "PAID"
-    if hasattr(row, "paid_at"):
-        row.paid_at = _now()
-    if hasattr(row, "updated_at"):
-        row.updated_at = _now()
-    db.add(row)
+    # Cộng điểm / tiến độ thử thách: outbox, cùng transaction với PAID
+    res = ticket_state.transition(db, [row.id], "PAID", nguon="STAFF")
+    if not res["changed"]:
+        raise HTTPException(409, res["skipped"].get(row.id, "Vé vừa được cập nhật"))
     db.commit()
-    db.refresh(row)
+    return {"ok": True, "id": row.id, "trang_thai": "PAID"}
 
-    try:
-        if getattr(row, "loai", "") == "GAME":
-            from .gamify import update_progress_on_ticket_paid
-            update_progress_on_ticket_paid(db, row)
-    except Exception:
-        pass
+# ---- Vé: check-in tại cổng ----
+@router.post("/ops/ve/{ticket_id}/checkin", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+@router.patch("/ops/ve/{ticket_id}/checkin", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_checkin_ticket(ticket_id: int, db: Session = Depends(get_db)):
+    row = db.get(Ve, ticket_id)
+    if not row:
+        raise HTTPException(404, "Không tìm thấy vé")
+    if row.trang_thai in ("CHECKIN", "USED"):
+        return {"ok": True, "id": row.id, "trang_thai": row.trang_thai}
+    if row.trang_thai != "PAID":
+        raise HTTPException(400, "Chỉ check-in được vé đã thanh toán")
 
-    return {"ok": True, "id": row.id, "trang_thai": row.trang_thai}
+    # Tham dự sự kiện / lượt chơi trò chơi: ticket_state ghi outbox cùng transaction
+    res = ticket_state.transition(db, [row.id], "CHECKIN", nguon="STAFF")
+    if not res["changed"]:
+        raise HTTPException(409, res["skipped"].get(row.id, "Vé vừa được cập nhật"))
+    db.commit()
+    return {"ok": True, "id": row.id, "trang_thai": "CHECKIN"}
 
 # ---- Vé: hủy ----
 @router.post("/ops/ve/{ticket_id}/cancel", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
@@ -265,13 +293,133 @@ def ops_cancel_ticket(
     if row.trang_thai == "PAID":
         raise HTTPException(400, "Không thể hủy vé đã thanh toán")
 
-    row.trang_thai = "CANCELLED"
-    if hasattr(row, "updated_at"):
-        row.updated_at = _now()
-    db.add(row)
+    res = ticket_state.transition(db, [row.id], "CANCELLED")
+    if not res["changed"]:
+        raise HTTPException(400, res["skipped"].get(row.id, "Không thể hủy vé"))
     db.commit()
-    db.refresh(row)
-    return {"ok": True, "id": row.id, "trang_thai": row.trang_thai, "reason": reason or ""}
+    return {"ok": True, "id": row.id, "trang_thai": "CANCELLED", "reason": reason or ""}
+
+# ---- Vé: duyệt / check-in / hủy hàng loạt ----
+class BulkTicketIn(BaseModel):
+    ids: List[int]
+    action: Literal["approve", "checkin", "cancel"]
+
+
+_BULK_TARGET = {"approve": "PAID", "checkin": "CHECKIN", "cancel": "CANCELLED"}
+
+
+@router.post("/ops/ve/bulk", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_bulk_tickets(body: BulkTicketIn, db: Session = Depends(get_db)):
+    """
+    Duyệt (PAID) / check-in (CHECKIN) / hủy nhiều vé trong 1 transaction.
+    Vé không hợp lệ bị bỏ qua (trả về trong `skipped`), các vé còn lại vẫn được áp dụng.
+    """
+    if not body.ids:
+        raise HTTPException(422, "Danh sách vé trống")
+    if len(body.ids) > ticket_state.MAX_BULK:
+        raise HTTPException(422, f"Tối đa {ticket_state.MAX_BULK} vé mỗi lần")
+    target = _BULK_TARGET[body.action]
+    res = ticket_state.transition(db, body.ids, target, nguon="STAFF")
+    db.commit()
+    return {
+        "ok": True,
+        "trang_thai": target,
+        "changed": res["changed"],
+        "skipped": [{"id": k, "reason": v} for k, v in res["skipped"].items()],
+    }
+
+# ---- Outbox: độ sâu hàng đợi & độ trễ ----
+@router.get("/ops/outbox", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_outbox_metrics(db: Session = Depends(get_db)):
+    return outbox.metrics(db)
+
+
+@router.post("/ops/outbox/purge", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_outbox_purge(days: int = Query(outbox.RETENTION_DAYS, ge=1)):
+    purged = outbox.purge_locked(days)
+    if purged is None:
+        raise HTTPException(409, "Đang dọn outbox ở tiến trình khác, thử lại sau")
+    return {"ok": True, "purged": purged}
+
+# ---- Vé quá hạn: số liệu & chạy ngay ----
+@router.get("/ops/expiry", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_expiry_metrics():
+    return ticket_expiry.metrics()
+
+
+@router.post("/ops/expiry/run", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_expiry_run():
+    expired = ticket_expiry.sweep_locked()
+    if expired is None:
+        raise HTTPException(409, "Đang quét vé quá hạn ở tiến trình khác, thử lại sau")
+    return {"ok": True, "expired": expired}
+
+# ---- Schema registry: xem / nạp lại sau khi ALTER TABLE ----
+@router.get("/ops/schema", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_schema():
+    return schema.snapshot()
+
+
+@router.post("/ops/schema/refresh", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_schema_refresh(db: Session = Depends(get_db)):
+    return {"ok": True, **schema.refresh(db)}
+
+# ---- Thưởng thử thách: job set-based ----
+@router.get("/ops/challenge-rewards", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_challenge_reward_metrics():
+    return challenge_reward_job.metrics()
+
+
+@router.post("/ops/challenge-rewards/run", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_challenge_reward_run(full: bool = False):
+    res = challenge_reward_job.run_locked(full=full)
+    if res is None:
+        raise HTTPException(409, "Job thưởng đang chạy ở tiến trình khác, thử lại sau")
+    return {"ok": True, **res}
+
+# ---- Migration tự chạy lúc khởi động ----
+@router.get("/ops/migrations", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_migrations():
+    return auto_migrate.metrics()
+
+
+@router.post("/ops/migrations/run", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_migrations_run():
+    return auto_migrate.run_pending()
+
+# ---- BXH trong bộ nhớ ----
+@router.get("/ops/leaderboard", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_leaderboard_stats():
+    return leaderboard.board.stats()
+
+
+@router.post("/ops/leaderboard/reload", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_leaderboard_reload():
+    # Chỉ process nhận request; các worker khác tự nạp lại sau LEADERBOARD_MAX_AGE
+    leaderboard.board.invalidate()
+    return {"ok": True}
+
+
+@router.get("/ops/leaderboard-buckets", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def ops_leaderboard_bucket_metrics():
+    return leaderboard_buckets.metrics()
+
+
+@router.post("/ops/leaderboard-buckets/compact", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_leaderboard_bucket_compact():
+    out = leaderboard_buckets.compact_once()
+    if out is None:
+        raise HTTPException(409, "Đang gộp ở tiến trình khác hoặc bảng chưa dựng lại xong, thử lại sau")
+    return {"ok": True, **out}
+
+# ---- Điểm: đối chiếu points_balance với sổ cái ----
+@router.post("/ops/points/reconcile", dependencies=[Depends(require_roles("ADMIN"))])
+def ops_points_reconcile(
+    fix: int = Query(0, ge=0, le=1),
+    chunk: int = Query(1000, ge=100, le=10000),
+    db: Session = Depends(get_db),
+):
+    return points.reconcile(db, chunk=chunk, fix=bool(fix))
 
 # ---- Debug/FE check: whoami ----
 @router.get("/ops/whoami")
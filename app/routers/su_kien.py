@@ -8,6 +8,7 @@ from ..db import get_db
 from ..models import SuKien
 from ..schemas import SuKienIn, SuKienOut, SuKienUpdate
 from .auth import get_current_user
+from ..services import search_index, versions
 
 router = APIRouter(prefix="/su-kien", tags=["Sự kiện"])
 
@@ -76,6 +77,7 @@ def update_event(sk_id: int, body: SuKienUpdate, db: Session = Depends(get_db)):
     if not ev:
         raise HTTPException(status_code=404, detail="Sự kiện không tồn tại")
 
+    renamed = body.ten is not None and body.ten != ev.ten
     if body.ten is not None:
         ev.ten = body.ten
     if body.mo_ta is not None:
@@ -89,6 +91,10 @@ def update_event(sk_id: int, body: SuKienUpdate, db: Session = Depends(get_db)):
     if getattr(body, "anh_bia", None) is not None:        # ✅ cập nhật ảnh bìa
         ev.anh_bia = body.anh_bia
 
+    db.flush()
+    if renamed:
+        search_index.reindex_by_item(db, su_kien_id=ev.id)
+    versions.bump(db, [versions.CATALOG])  # tên / giá / ảnh nằm trong /ve/me
     db.commit()
     db.refresh(ev)
     return ev
@@ -6,6 +6,7 @@ from typing import Dict, Any, List, Optional
 
 from ..db import get_db
 from ..models import TroChoi, KhuVuc
+from ..services import search_index, versions
 
 router = APIRouter()
 router_us = APIRouter(prefix="/tro_choi", tags=["Trò chơi"])
@@ -84,6 +85,7 @@ def create_game(payload: Dict[str, Any], db: Session = Depends(get_db)) -> Dict[
 @router_dash.put("/{game_id}")
 def update_game(game_id: int, payload: Dict[str, Any], db: Session = Depends(get_db)) -> Dict[str, Any]:
     game = _get_game(db, game_id)
+    renamed = payload.get("ten") is not None and payload["ten"] != game.ten
 
     updatable_fields = [
         "ten", "the_loai", "tuoi_khuyen_nghi",
@@ -95,6 +97,10 @@ def update_game(game_id: int, payload: Dict[str, Any], db: Session = Depends(get
             setattr(game, field, payload[field])
 
     db.add(game)
+    db.flush()
+    if renamed:
+        search_index.reindex_by_item(db, tro_choi_id=game.id)
+    versions.bump(db, [versions.CATALOG])  # tên / giá / ảnh nằm trong /ve/me
     db.commit()
     db.refresh(game)
     return {"message": "Đã cập nhật trò chơi", "id": game.id}
@@ -1,31 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, text
+from sqlalchemy import text, select
+from sqlalchemy.exc import IntegrityError
 
 from ..db import get_db
-from ..models import Ve, SuKien, User, TroChoi
+from ..models import Ve, SuKien, User, TroChoi, VeTimKiem
 from .auth import get_current_user, require_roles
+from ..pagination import TotalMode, count_total, paginate, encode_cursor, decode_cursor
 
 # === Khuyến mãi ===
-from app.promo_utils import find_best_promo, list_applicable_promos
+from app.promo_utils import (
+    find_best_promo,
+    list_applicable_promos,
+    load_active_promos,
+    evaluate_batch,
+)
+
+# === Tác vụ sau thanh toán (cộng điểm, thử thách) chạy qua outbox ===
+from ..services import outbox
+
+# === Tồn kho vé (sức chứa) + giới hạn lượt dùng KM ===
+from ..services import inventory, promo_quota, search_index, versions
 
-# === Gamification khi duyệt vé trò chơi ===
-from .gamify import increment_active_challenges
-from ..services.gamification import reward_if_reached
+# === Chuyển trạng thái vé (kèm outbox / hoàn tồn kho / chỉ mục) ===
+from ..services import ticket_state
+from ..schema_registry import schema
 
 # === MoMo (sandbox) ===
 import os
 import time
 import uuid
-import hmac
 import hashlib
-import requests
-from datetime import datetime
+from ..services.momo_client import (
+    momo_client,
+    MomoUnavailable,
+    momo_sign_create,
+    momo_sign_ipn,
+    momo_sign_query,
+)
 
 router = APIRouter(prefix="/ve", tags=["Vé"])
 
-MOMO_CREATE_ENDPOINT = "https://test-payment.momo.vn/v2/gateway/api/create"
+ER_DUP_ENTRY = 1062  # MySQL: trùng khóa UNIQUE
 
 
 # ===================== Schemas =====================
@@ -41,10 +59,27 @@ class BookGameIn(BaseModel):
     promo_id: int | None = None
 
 
+class CartItemIn(BaseModel):
+    su_kien_id: int | None = None
+    tro_choi_id: int | None = None
+    so_luong: int = 1
+
+
+class CheckoutIn(BaseModel):
+    items: list[CartItemIn]
+    promo_id: int | None = None
+
+
 class ReviewIn(BaseModel):
     approve: bool
 
 
+class CapacityIn(BaseModel):
+    su_kien_id: int | None = None
+    tro_choi_id: int | None = None
+    suc_chua: int
+
+
 class ListOut(BaseModel):
     id: int
     so_luong: int
@@ -59,7 +94,8 @@ class ListOut(BaseModel):
 
 class PageOut(BaseModel):
     items: list[ListOut]
-    total: int
+    total: int | None = None
+    next_cursor: str | None = None
 
 
 # ===================== Helpers =====================
@@ -72,94 +108,85 @@ def _get_user_tier(user: User) -> str:
         return "THUONG"
 
 
-def momo_sign_create(payload: dict, secret_key: str) -> str:
-    """
-    Ký theo đúng thứ tự tham số create (MoMo v2):
-    accessKey&amount&extraData&ipnUrl&orderId&orderInfo&partnerCode&
-    redirectUrl&requestId&requestType
-    """
-    keys = [
-        "accessKey",
-        "amount",
-        "extraData",
-        "ipnUrl",
-        "orderId",
-        "orderInfo",
-        "partnerCode",
-        "redirectUrl",
-        "requestId",
-        "requestType",
-    ]
-    raw = "&".join(f"{k}={payload.get(k,'')}" for k in keys)
-    return hmac.new(secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()
-
-
-def momo_sign_ipn(payload: dict, secret_key: str) -> str:
-    """
-    Ký xác minh IPN/callback. Sandbox có thể thay đổi danh sách trường;
-    phần này dùng bộ tham số phổ biến, nếu thiếu trường sẽ bỏ qua kiểm tra.
-    """
-    keys = [
-        "accessKey",
-        "amount",
-        "extraData",
-        "message",
-        "orderId",
-        "orderInfo",
-        "orderType",
-        "partnerCode",
-        "payType",
-        "requestId",
-        "responseTime",
-        "resultCode",
-        "transId",
-    ]
-    raw = "&".join(f"{k}={payload.get(k,'')}" for k in keys)
-    return hmac.new(secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()
+def _etag_matches(header: str | None, etag: str) -> bool:
+    """If-None-Match: danh sách phân tách bằng dấu phẩy, chấp nhận "*" và tiền tố W/ (so sánh yếu)."""
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
 
 
 # ===================== My tickets (có ảnh + ngày đặt) =====================
 @router.get("/me")
 def my_tickets(
+    request: Request,
+    response: Response,
+    status: str | None = Query(None, description="Lọc trạng thái, ví dụ PAID hoặc BOOKED,PENDING"),
+    limit: int | None = Query(None, ge=1, le=200, description="Bỏ trống = trả hết (tương thích FE cũ)"),
+    cursor: str | None = Query(None, description="Giá trị header X-Next-Cursor của trang trước"),
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """
     Trả về danh sách vé của user, embed thông tin sự kiện/trò chơi.
     Bao gồm cả ngày đặt (created_at) để FE hiển thị.
+    - Chỉ SELECT các cột cần thiết (không hydrate ORM)
+    - Phân trang cursor theo id giảm dần (limit + cursor, trang sau ở header X-Next-Cursor)
+    - ETag từ phiên bản vé của user + phiên bản danh mục (tên, giá, ảnh sự kiện / trò chơi nằm trong
+      response), services/versions.py: poll không đổi => 304, không query danh sách
     """
-    rows = (
-        db.query(Ve)
-        .options(
-            joinedload(Ve.su_kien),
-            joinedload(Ve.tro_choi),
+    statuses = [s.strip().upper() for s in (status or "").split(",") if s.strip()]
+
+    # 1 câu tra khóa chính phien_ban, không quét / join bảng ve
+    ver = versions.get(db, [versions.tickets_key(user.id), versions.CATALOG])
+    tag_src = (
+        f"{user.id}|{ver[versions.tickets_key(user.id)]}|{ver[versions.CATALOG]}"
+        f"|{','.join(statuses)}|{limit}|{cursor}"
+    )
+    etag = '"' + hashlib.sha1(tag_src.encode()).hexdigest() + '"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    query = (
+        db.query(
+            Ve.id,
+            Ve.so_luong,
+            Ve.tong_tien,
+            Ve.trang_thai,
+            Ve.created_at,
+            SuKien.id.label("sk_id"),
+            SuKien.ten.label("sk_ten"),
+            SuKien.gia_ve.label("sk_gia_ve"),
+            SuKien.thoi_gian.label("sk_thoi_gian"),
+            TroChoi.id.label("tc_id"),
+            TroChoi.ten.label("tc_ten"),
+            TroChoi.gia_mac_dinh.label("tc_gia"),
+            TroChoi.anh_cover.label("tc_cover"),
+            TroChoi.anh_ct_1.label("tc_ct_1"),
+            TroChoi.anh_ct_2.label("tc_ct_2"),
         )
+        .outerjoin(SuKien, SuKien.id == Ve.su_kien_id)
+        .outerjoin(TroChoi, TroChoi.id == Ve.tro_choi_id)
         .filter(Ve.user_id == user.id)
-        .order_by(Ve.id.desc())
-        .all()
     )
-
-    def sk_dict(sk: SuKien | None):
-        if not sk:
-            return None
-        return {
-            "id": sk.id,
-            "ten": sk.ten,
-            "gia_ve": float(sk.gia_ve or 0),
-            "thoi_gian": sk.thoi_gian.isoformat() if sk.thoi_gian else None,
-        }
-
-    def tc_dict(tc: TroChoi | None):
-        if not tc:
-            return None
-        return {
-            "id": tc.id,
-            "ten": tc.ten,
-            "gia_mac_dinh": float(tc.gia_mac_dinh or 0),
-            "anh_cover": tc.anh_cover,
-            "anh_ct_1": tc.anh_ct_1,
-            "anh_ct_2": tc.anh_ct_2,
-        }
+    if statuses:
+        query = query.filter(Ve.trang_thai.in_(statuses))
+    if cursor:
+        _, last_id = decode_cursor(cursor)
+        query = query.filter(Ve.id < last_id)
+    query = query.order_by(Ve.id.desc())
+    if limit:
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].id, rows[-1].id)
+    else:
+        rows = query.all()
 
     out = []
     for v in rows:
@@ -169,16 +196,63 @@ def my_tickets(
                 "so_luong": v.so_luong,
                 "tong_tien": float(v.tong_tien or 0),
                 "trang_thai": v.trang_thai,
-                "created_at": v.created_at.isoformat()
-                if getattr(v, "created_at", None)
+                "created_at": v.created_at.isoformat() if v.created_at else None,
+                "su_kien": {
+                    "id": v.sk_id,
+                    "ten": v.sk_ten,
+                    "gia_ve": float(v.sk_gia_ve or 0),
+                    "thoi_gian": v.sk_thoi_gian.isoformat() if v.sk_thoi_gian else None,
+                }
+                if v.sk_id is not None
+                else None,
+                "tro_choi": {
+                    "id": v.tc_id,
+                    "ten": v.tc_ten,
+                    "gia_mac_dinh": float(v.tc_gia or 0),
+                    "anh_cover": v.tc_cover,
+                    "anh_ct_1": v.tc_ct_1,
+                    "anh_ct_2": v.tc_ct_2,
+                }
+                if v.tc_id is not None
                 else None,
-                "su_kien": sk_dict(v.su_kien),
-                "tro_choi": tc_dict(v.tro_choi),
             }
         )
     return out
 
 
+def _claim_first(db, candidates, user_id: int):
+    """KM đầu tiên trong `candidates` (theo thứ tự ưu tiên) còn lượt; giữ lượt đó."""
+    for p in candidates:
+        if promo_quota.claim(db, p, user_id):
+            return p
+    return None
+
+
+def _pick_promo(db, user_id: int, amount: float, user_tier: str, event_id: int | None, promo_id: int | None):
+    """
+    Chọn KM cho 1 lần đặt và giữ lượt nếu KM có giới hạn (services/promo_quota.py).
+    - promo_id: KM khách chọn; không hợp lệ => 422, hết lượt => 409
+    - không chọn: KM tốt nhất; nếu hết lượt thì lấy KM kế tiếp còn lượt
+    """
+    if promo_id is not None:
+        appl = evaluate_batch(load_active_promos(db), [(amount, user_tier, event_id)])[0]
+        chosen = next((p for p in appl if p.id == int(promo_id)), None)
+        if not chosen:
+            raise HTTPException(422, "Khuyến mãi không hợp lệ cho đơn này")
+        if not promo_quota.claim(db, chosen, user_id):
+            db.rollback()
+            raise HTTPException(409, "Khuyến mãi đã hết lượt sử dụng")
+        return chosen
+
+    best, _ = find_best_promo(db, amount=amount, user_tier=user_tier, event_id=event_id)
+    if best is None or not best.has_quota:
+        return best
+    if promo_quota.claim(db, best, user_id):
+        return best
+    appl = evaluate_batch(load_active_promos(db), [(amount, user_tier, event_id)])[0]
+    return _claim_first(db, (p for p in appl if p is not best), user_id)
+
+
 # ===================== Book vé SỰ KIỆN =====================
 @router.post("/book")
 def book_ticket(
@@ -199,22 +273,8 @@ def book_ticket(
 
     user_tier = _get_user_tier(user)
 
-    promo, rate = None, 0.0
-    if payload.promo_id is not None:
-        appl = list_applicable_promos(
-            db, amount=original_total, user_tier=user_tier, event_id=ev.id
-        )
-        chosen = next(
-            (p for p in appl if int(p["id"]) == int(payload.promo_id)), None
-        )
-        if not chosen:
-            raise HTTPException(422, "Khuyến mãi không hợp lệ cho đơn này")
-        promo = type("P", (), {"id": chosen["id"], "ten": chosen["ten"]})()
-        rate = float(chosen["rate"])
-    else:
-        promo, rate = find_best_promo(
-            db, amount=original_total, user_tier=user_tier, event_id=ev.id
-        )
+    promo = _pick_promo(db, user.id, original_total, user_tier, ev.id, payload.promo_id)
+    rate = promo.rate if promo else 0.0
 
     discount_amount = round(original_total * rate / 100)
     final_total = int(original_total - discount_amount)
@@ -228,6 +288,14 @@ def book_ticket(
         trang_thai="BOOKED",
     )
     db.add(ve)
+    db.flush()
+    search_index.index_tickets(db, [ve.id])
+    promo_quota.record(db, [(ve.id, promo, user.id)])
+    versions.bump_tickets(db, [user.id])
+    # Trừ tồn kho sau cùng để khóa dòng ton_kho_ve chỉ giữ tới commit
+    if not inventory.reserve(db, qty, su_kien_id=ev.id):
+        db.rollback()
+        raise HTTPException(409, "Sự kiện đã hết chỗ")
     db.commit()
     db.refresh(ve)
 
@@ -262,22 +330,8 @@ def book_game(
 
     user_tier = _get_user_tier(user)
 
-    promo, rate = None, 0.0
-    if payload.promo_id is not None:
-        appl = list_applicable_promos(
-            db, amount=original_total, user_tier=user_tier, event_id=None
-        )
-        chosen = next(
-            (p for p in appl if int(p["id"]) == int(payload.promo_id)), None
-        )
-        if not chosen:
-            raise HTTPException(422, "Khuyến mãi không hợp lệ cho đơn này")
-        promo = type("P", (), {"id": chosen["id"], "ten": chosen["ten"]})()
-        rate = float(chosen["rate"])
-    else:
-        promo, rate = find_best_promo(
-            db, amount=original_total, user_tier=user_tier, event_id=None
-        )
+    promo = _pick_promo(db, user.id, original_total, user_tier, None, payload.promo_id)
+    rate = promo.rate if promo else 0.0
 
     discount_amount = round(original_total * rate / 100)
     final_total = int(original_total - discount_amount)
@@ -291,6 +345,13 @@ def book_game(
         trang_thai="BOOKED",
     )
     db.add(ve)
+    db.flush()
+    search_index.index_tickets(db, [ve.id])
+    promo_quota.record(db, [(ve.id, promo, user.id)])
+    versions.bump_tickets(db, [user.id])
+    if not inventory.reserve(db, qty, tro_choi_id=game.id):
+        db.rollback()
+        raise HTTPException(409, "Trò chơi đã hết chỗ")
     db.commit()
     db.refresh(ve)
 
@@ -307,6 +368,199 @@ def book_game(
     }
 
 
+_autoinc_mode: int | None = None
+
+
+def _insert_tickets(db, rows: list[dict]) -> list[int]:
+    """
+    1 câu INSERT nhiều dòng (trạng thái BOOKED), trả về id theo đúng thứ tự `rows`
+    (trong 1 câu, InnoDB cấp id tăng dần theo thứ tự VALUES).
+    - innodb_autoinc_lock_mode <= 1: id liên tiếp => LAST_INSERT_ID() .. + n - 1
+    - = 2 (xen kẽ): đọc lại id >= LAST_INSERT_ID() của user bằng snapshot của transaction
+      (đã mở trước câu INSERT => dòng của transaction khác cấp xen vào không nhìn thấy)
+    """
+    global _autoinc_mode
+    if _autoinc_mode is None:
+        _autoinc_mode = int(db.execute(text("SELECT @@innodb_autoinc_lock_mode")).scalar() or 0)
+    params, values = {}, []
+    for i, r in enumerate(rows):
+        values.append(f"(:u{i}, :sk{i}, :tc{i}, :sl{i}, :tt{i}, 'BOOKED', UTC_TIMESTAMP(), UTC_TIMESTAMP())")
+        params.update({
+            f"u{i}": r["user_id"], f"sk{i}": r["su_kien_id"], f"tc{i}": r["tro_choi_id"],
+            f"sl{i}": r["so_luong"], f"tt{i}": r["tong_tien"],
+        })
+    db.execute(text(f"""
+        INSERT INTO ve (user_id, su_kien_id, tro_choi_id, so_luong, tong_tien, trang_thai, created_at, updated_at)
+        VALUES {", ".join(values)}
+    """), params)
+    first = int(db.execute(text("SELECT LAST_INSERT_ID()")).scalar())
+    if _autoinc_mode <= 1:
+        return list(range(first, first + len(rows)))
+    return [
+        int(r[0])
+        for r in db.execute(
+            text("SELECT id FROM ve WHERE user_id = :uid AND id >= :first ORDER BY id LIMIT :n"),
+            {"uid": rows[0]["user_id"], "first": first, "n": len(rows)},
+        ).all()
+    ]
+
+
+# ===================== Checkout GIỎ HÀNG (nhiều vé, 1 transaction) =====================
+@router.post("/checkout")
+def checkout(
+    payload: CheckoutIn,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Đặt nhiều vé sự kiện/trò chơi trong 1 lần:
+    - Gom số lượng theo từng sự kiện/trò chơi, load giá bằng 2 query IN (...)
+    - Load khuyến mãi đang chạy 1 lần; điều kiện min_amount xét trên TỔNG giỏ,
+      phạm vi sự kiện xét theo từng dòng; mỗi KM giữ 1 lượt cho cả lần đặt
+    - 1 câu INSERT nhiều dòng cho toàn bộ vé + trừ tồn kho 1 lần / sự kiện, trò chơi + 1 commit
+    """
+    if not payload.items:
+        raise HTTPException(400, "Giỏ hàng trống")
+
+    # Gom dòng trùng: key = ("ev", id) | ("game", id)
+    qty_by_key: dict[tuple[str, int], int] = {}
+    for it in payload.items:
+        if (it.su_kien_id is None) == (it.tro_choi_id is None):
+            raise HTTPException(422, "Mỗi dòng cần đúng một trong su_kien_id / tro_choi_id")
+        if it.so_luong <= 0:
+            raise HTTPException(400, "Số lượng không hợp lệ")
+        key = ("ev", int(it.su_kien_id)) if it.su_kien_id is not None else ("game", int(it.tro_choi_id))
+        qty_by_key[key] = qty_by_key.get(key, 0) + int(it.so_luong)
+
+    ev_ids = [i for k, i in qty_by_key if k == "ev"]
+    game_ids = [i for k, i in qty_by_key if k == "game"]
+    events = (
+        {e.id: e for e in db.query(SuKien).filter(SuKien.id.in_(ev_ids)).all()} if ev_ids else {}
+    )
+    games = (
+        {g.id: g for g in db.query(TroChoi).filter(TroChoi.id.in_(game_ids)).all()} if game_ids else {}
+    )
+
+    lines = []
+    for (kind, item_id), qty in qty_by_key.items():
+        if kind == "ev":
+            ev = events.get(item_id)
+            if not ev or ev.trang_thai != "OPEN":
+                raise HTTPException(400, f"Sự kiện #{item_id} không khả dụng")
+            price, name = float(ev.gia_ve or 0), ev.ten
+        else:
+            game = games.get(item_id)
+            if not game or game.trang_thai != "OPEN":
+                raise HTTPException(404, f"Trò chơi #{item_id} không khả dụng")
+            price, name = float(game.gia_mac_dinh or 0), game.ten
+        lines.append(
+            {
+                "kind": kind,
+                "item_id": item_id,
+                "ten": name,
+                "so_luong": qty,
+                "original_total": price * qty,
+            }
+        )
+
+    cart_total = sum(l["original_total"] for l in lines)
+    user_tier = _get_user_tier(user)
+    promo_rows = load_active_promos(db)
+
+    # Đánh giá KM 1 lượt cho mọi phạm vi sự kiện khác nhau (mọi trò chơi dùng chung None)
+    scopes = list(dict.fromkeys(l["item_id"] if l["kind"] == "ev" else None for l in lines))
+    appl_by_scope = evaluate_batch(promo_rows, [(cart_total, user_tier, sc) for sc in scopes])
+    appl_of_scope: dict[int | None, list] = {}
+    for scope, appl in zip(scopes, appl_by_scope):
+        if payload.promo_id is not None:
+            appl = [p for p in appl if p.id == int(payload.promo_id)]
+        appl_of_scope[scope] = appl
+
+    if payload.promo_id is not None and not any(appl_of_scope.values()):
+        raise HTTPException(422, "Khuyến mãi không hợp lệ cho đơn này")
+
+    # 1 lần đặt = 1 lượt / KM: mỗi KM chỉ claim 1 lần cho cả giỏ (các dòng cùng KM dùng chung lượt)
+    claimed: dict[int, bool] = {}
+    rows = []
+    for l in lines:
+        appl = appl_of_scope[l["item_id"] if l["kind"] == "ev" else None]
+        promo = None
+        for p in appl:
+            if p.id not in claimed:
+                claimed[p.id] = promo_quota.claim(db, p, user.id)
+            if claimed[p.id]:
+                promo = p
+                break
+        if payload.promo_id is not None and appl and promo is None:
+            db.rollback()
+            raise HTTPException(409, "Khuyến mãi đã hết lượt sử dụng")
+        rate = promo.rate if promo else 0.0
+        discount = round(l["original_total"] * rate / 100)
+        l["promo_obj"] = promo
+        l["discount_rate"] = rate
+        l["discount_amount"] = int(discount)
+        l["final_total"] = int(l["original_total"] - discount)
+        l["promo"] = {"id": promo.id, "ten": promo.ten} if promo else None
+        rows.append(
+            {
+                "user_id": user.id,
+                "su_kien_id": l["item_id"] if l["kind"] == "ev" else None,
+                "tro_choi_id": l["item_id"] if l["kind"] == "game" else None,
+                "so_luong": l["so_luong"],
+                "tong_tien": l["final_total"],
+            }
+        )
+
+    ids = _insert_tickets(db, rows)
+    search_index.index_tickets(db, ids)
+    # Lượt KM gắn vào vé đầu tiên dùng KM đó => hủy vé đó thì hoàn đúng 1 lượt
+    links, seen = [], set()
+    for i, l in zip(ids, lines):
+        p = l["promo_obj"]
+        if p is not None and p.id not in seen:
+            seen.add(p.id)
+            links.append((i, p, user.id))
+    promo_quota.record(db, links)
+    versions.bump_tickets(db, [user.id])
+
+    # lines đã gộp theo sự kiện / trò chơi => mỗi dòng ton_kho_ve chỉ trừ 1 lần
+    for l in lines:
+        ok = inventory.reserve(
+            db,
+            l["so_luong"],
+            su_kien_id=l["item_id"] if l["kind"] == "ev" else None,
+            tro_choi_id=l["item_id"] if l["kind"] == "game" else None,
+        )
+        if not ok:
+            db.rollback()
+            raise HTTPException(409, f"{l['ten']} đã hết chỗ")
+    db.commit()
+
+    items = []
+    for ve_id, l in zip(ids, lines):
+        items.append(
+            {
+                "id": ve_id,
+                "su_kien_id": l["item_id"] if l["kind"] == "ev" else None,
+                "tro_choi_id": l["item_id"] if l["kind"] == "game" else None,
+                "ten": l["ten"],
+                "so_luong": l["so_luong"],
+                "original_total": int(l["original_total"]),
+                "discount_rate": l["discount_rate"],
+                "discount_amount": l["discount_amount"],
+                "final_total": l["final_total"],
+                "promo": l["promo"],
+            }
+        )
+    return {
+        "ok": True,
+        "items": items,
+        "original_total": int(cart_total),
+        "discount_amount": sum(i["discount_amount"] for i in items),
+        "final_total": sum(i["final_total"] for i in items),
+    }
+
+
 # ===================== Cancel ticket =====================
 @router.post("/cancel/{ve_id}")
 def cancel_ticket(
@@ -321,11 +575,40 @@ def cancel_ticket(
     if ve.trang_thai not in ("BOOKED", "PENDING", "UNPAID"):
         raise HTTPException(400, "Không thể hủy vé ở trạng thái hiện tại")
 
-    ve.trang_thai = "CANCELLED"
+    res = ticket_state.transition(db, [ve.id], "CANCELLED")
+    if not res["changed"]:
+        raise HTTPException(409, "Vé vừa được cập nhật, vui lòng tải lại")
     db.commit()
     return {"ok": True}
 
 
+# ===================== Tồn kho (sức chứa) =====================
+@router.get("/ton-kho")
+def get_capacity(
+    su_kien_id: int | None = None,
+    tro_choi_id: int | None = None,
+    db: Session = Depends(get_db),
+):
+    if su_kien_id is None and tro_choi_id is None:
+        raise HTTPException(422, "Cần su_kien_id hoặc tro_choi_id")
+    stock = inventory.get_stock(db, su_kien_id=su_kien_id, tro_choi_id=tro_choi_id)
+    # None => không giới hạn
+    return stock or {"suc_chua": None, "con_lai": None}
+
+
+@router.put("/ton-kho", dependencies=[Depends(require_roles("ADMIN"))])
+def set_capacity(body: CapacityIn, db: Session = Depends(get_db)):
+    if body.su_kien_id is None and body.tro_choi_id is None:
+        raise HTTPException(422, "Cần su_kien_id hoặc tro_choi_id")
+    if body.suc_chua < 0:
+        raise HTTPException(422, "Sức chứa không hợp lệ")
+    out = inventory.set_capacity(
+        db, body.suc_chua, su_kien_id=body.su_kien_id, tro_choi_id=body.tro_choi_id
+    )
+    db.commit()
+    return out
+
+
 # ===================== Mark paid (user báo đã thanh toán) =====================
 @router.post("/mark-paid/{ve_id}")
 def mark_paid(
@@ -339,7 +622,9 @@ def mark_paid(
     if ve.trang_thai != "BOOKED":
         raise HTTPException(400, "Chỉ báo thanh toán khi vé đang BOOKED")
 
-    ve.trang_thai = "PENDING"
+    res = ticket_state.transition(db, [ve.id], "PENDING", allowed_from=("BOOKED",))
+    if not res["changed"]:
+        raise HTTPException(409, "Vé vừa được cập nhật, vui lòng tải lại")
     db.commit()
     return {"ok": True}
 
@@ -357,35 +642,11 @@ def review_payment(
     if ve.trang_thai != "PENDING":
         raise HTTPException(400, "Chỉ duyệt vé ở trạng thái PENDING")
 
-    if body.approve:
-        ve.trang_thai = "PAID"
-        db.flush()
-
-        so_tien = float(ve.tong_tien or 0)
-        diem_cong = int(so_tien / 5000)
-        if diem_cong > 0:
-            db.execute(
-                text(
-                    """
-                    INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
-                    VALUES (:uid, :diem, :lydo, NOW())
-                """
-                ),
-                {
-                    "uid": ve.user_id,
-                    "diem": diem_cong,
-                    "lydo": f"Cộng {diem_cong} điểm từ chi tiêu {int(so_tien):,}đ",
-                },
-            )
-
-        if ve.tro_choi_id is not None:
-            increment_active_challenges(
-                db, user_id=ve.user_id, inc=int(ve.so_luong or 1)
-            )
-            reward_if_reached(db, user_id=ve.user_id)
-    else:
-        ve.trang_thai = "BOOKED"
-
+    # PAID: cộng điểm / thử thách do outbox worker xử lý, cùng transaction
+    target = "PAID" if body.approve else "BOOKED"
+    res = ticket_state.transition(db, [ve.id], target, allowed_from=("PENDING",), nguon="STAFF")
+    if not res["changed"]:
+        raise HTTPException(409, "Vé vừa được cập nhật, vui lòng tải lại")
     db.commit()
     return {"ok": True}
 
@@ -401,34 +662,26 @@ def admin_list(
     status: str = Query(None),
     q: str = Query(""),
     page: int = 1,
-    page_size: int = 20,
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: str | None = Query(None, description="next_cursor của trang trước"),
+    total: TotalMode = Query("estimate"),
 ):
-    query = (
-        db.query(Ve)
-        .join(User, User.id == Ve.user_id)
-        .outerjoin(SuKien, SuKien.id == Ve.su_kien_id)
-        .outerjoin(TroChoi, TroChoi.id == Ve.tro_choi_id)
-        .options(
-            joinedload(Ve.user), joinedload(Ve.su_kien), joinedload(Ve.tro_choi)
-        )
+    query = db.query(Ve).options(
+        joinedload(Ve.user), joinedload(Ve.su_kien), joinedload(Ve.tro_choi)
     )
 
     if status:
         query = query.filter(Ve.trang_thai == status)
-    if q:
-        like = f"%{q.strip()}%"
-        query = query.filter(
-            or_(
-                User.username.like(like),
-                SuKien.ten.like(like),
-                TroChoi.ten.like(like),
-            )
-        )
+    if q.strip():
+        # Tìm qua chỉ mục ve_tim_kiem (FULLTEXT, bỏ dấu) thay vì LIKE qua 3 bảng
+        clause, params = search_index.match_clause(q)
+        sub = select(VeTimKiem.ve_id).where(text(clause).bindparams(**params))
+        if status:
+            sub = sub.where(VeTimKiem.trang_thai == status)
+        query = query.filter(Ve.id.in_(sub))
 
-    total = query.count()
-    rows = (
-        query.order_by(Ve.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
-    )
+    n = count_total(db, query, Ve, total, filtered=bool(status or q.strip()))
+    rows, next_cursor = paginate(query, Ve.id, page_size, cursor=cursor, page=page)
 
     items = []
     for v in rows:
@@ -464,7 +717,16 @@ def admin_list(
                 "ten_tro_choi": v.tro_choi.ten if v.tro_choi else None,
             }
         )
-    return {"items": items, "total": total}
+    return {"items": items, "total": n, "next_cursor": next_cursor}
+
+
+@router.post(
+    "/admin/search-index/rebuild",
+    dependencies=[Depends(require_roles("ADMIN"))],
+)
+def rebuild_search_index(db: Session = Depends(get_db)):
+    """Backfill chỉ mục tìm kiếm vé (chạy 1 lần sau khi triển khai / khi nghi lệch)."""
+    return {"ok": True, "indexed": search_index.rebuild(db)}
 
 
 # ===================== Preview khuyến mãi =====================
@@ -520,19 +782,71 @@ def applicable_promos(
     return out
 
 
-# ===================== MoMo: Khởi tạo thanh toán =====================
-@router.post("/pay-init/{ve_id}")
-def momo_pay_init(
-    ve_id: int,
-    user: User = Depends(get_current_user),
+class PreviewItemIn(BaseModel):
+    amount: float
+    su_kien_id: int | None = None
+
+
+# ===================== Xem trước KM cho nhiều mục (trang danh sách) =====================
+@router.post("/promo-preview/batch")
+def promo_preview_batch(
+    items: list[PreviewItemIn],
     db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
 ):
+    if len(items) > 500:
+        raise HTTPException(422, "Tối đa 500 mục mỗi lần")
+    user_tier = _get_user_tier(user)
+    best = evaluate_batch(
+        load_active_promos(db),
+        [(max(0.0, float(it.amount)), user_tier, it.su_kien_id) for it in items],
+    )
+    out = []
+    for it, appl in zip(items, best):
+        promo = appl[0] if appl else None
+        rate = promo.rate if promo else 0.0
+        disc = round(float(it.amount) * rate / 100)
+        out.append(
+            {
+                "amount": int(it.amount),
+                "su_kien_id": it.su_kien_id,
+                "discount_rate": float(rate),
+                "discount_amount": int(disc),
+                "final_total": int(float(it.amount) - disc),
+                "promo": {"id": promo.id, "ten": promo.ten} if promo else None,
+            }
+        )
+    return out
+
+
+# ===================== MoMo: Khởi tạo thanh toán =====================
+def _pay_init_amount(db: Session, ve_id: int, user_id: int) -> int:
     ve = db.get(Ve, ve_id)
-    if not ve or ve.user_id != user.id:
+    if not ve or ve.user_id != user_id:
         raise HTTPException(404, "Không tìm thấy vé")
     # Cho phép BOOKED hoặc UNPAID để phù hợp dữ liệu cũ
     if ve.trang_thai not in ("BOOKED", "UNPAID"):
         raise HTTPException(400, f"Vé phải ở trạng thái BOOKED/UNPAID. Hiện tại: {ve.trang_thai}")
+    amount = int(ve.tong_tien or 0)
+    db.rollback()  # không giữ transaction / kết nối trong lúc chờ MoMo
+    return amount
+
+
+def _save_payment_ref(db: Session, ve_id: int, ref: str) -> None:
+    # lưu để đối soát (nếu DB có cột payment_ref)
+    if schema.has(db, "ve", "payment_ref"):
+        db.execute(text("UPDATE ve SET payment_ref = :ref WHERE id = :id"), {"ref": ref, "id": ve_id})
+        db.commit()
+
+
+@router.post("/pay-init/{ve_id}")
+async def momo_pay_init(
+    ve_id: int,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Truy vấn DB (blocking) chạy trong threadpool; event loop chỉ chờ MoMo
+    amount = await run_in_threadpool(_pay_init_amount, db, ve_id, user.id)
 
     partnerCode = os.getenv("MOMO_PARTNER_CODE")
     accessKey = os.getenv("MOMO_ACCESS_KEY")
@@ -543,16 +857,15 @@ def momo_pay_init(
     if not (partnerCode and accessKey and secretKey):
         raise HTTPException(500, "Thiếu cấu hình MOMO_* trong .env")
 
-    amount = str(int(ve.tong_tien or 0))
-    orderId = f"{ve.id}-{int(time.time())}"
+    orderId = f"{ve_id}-{int(time.time())}"
     requestId = str(uuid.uuid4())
-    orderInfo = f"Thanh toan ve #{ve.id}"
+    orderInfo = f"Thanh toan ve #{ve_id}"
 
     payload = {
         "partnerCode": partnerCode,
         "accessKey": accessKey,
         "requestId": requestId,
-        "amount": amount,
+        "amount": str(amount),
         "orderId": orderId,
         "orderInfo": orderInfo,
         "redirectUrl": redirectUrl,
@@ -562,32 +875,51 @@ def momo_pay_init(
     }
     payload["signature"] = momo_sign_create(payload, secretKey)
 
+    # Hỏi trạng thái orderId trước khi tạo lại (lỗi sau khi MoMo có thể đã nhận lệnh)
+    query = {
+        "partnerCode": partnerCode,
+        "accessKey": accessKey,
+        "requestId": str(uuid.uuid4()),
+        "orderId": orderId,
+        "lang": "vi",
+    }
+    query["signature"] = momo_sign_query(query, secretKey)
+
+    # Không chặn worker: client async dùng pool keep-alive + deadline + circuit breaker
     try:
-        res = requests.post(MOMO_CREATE_ENDPOINT, json=payload, timeout=15)
-        data = res.json()
-    except Exception as e:
-        raise HTTPException(502, f"Lỗi kết nối MoMo: {e}")
+        data = await momo_client.create(payload, query=query)
+    except MomoUnavailable as e:
+        raise HTTPException(503, f"Lỗi kết nối MoMo: {e}")
 
     if data.get("resultCode") != 0:
         raise HTTPException(400, f"MoMo: {data.get('message', 'Tạo lệnh thất bại')}")
 
-    # lưu để đối soát (nếu có cột)
-    try:
-        ve.payment_ref = orderId
-        db.commit()
-    except Exception:
-        db.rollback()
-
+    await run_in_threadpool(_save_payment_ref, db, ve_id, orderId)
     return {"payUrl": data["payUrl"]}
 
 
+@router.get("/pay-gateway/status", dependencies=[Depends(require_roles("ADMIN", "STAFF"))])
+def momo_gateway_status():
+    return momo_client.stats()
+
+
 # ===================== MoMo: IPN/Callback =====================
+def _ipn_payment_sets(db) -> str:
+    """Cột đối soát tuỳ chọn của ve (tra schema_registry, không thử-rồi-bắt-lỗi); paid_at do ticket_state ghi."""
+    sets = []
+    if schema.has(db, "ve", "payment_time"):
+        sets.append("payment_time = NOW()")
+    if schema.has(db, "ve", "payment_ref"):
+        sets.append("payment_ref = COALESCE(NULLIF(:ref, ''), payment_ref)")
+    return ", ".join(sets)
+
+
 @router.post("/pay-callback")
-async def momo_ipn(request: Request, db: Session = Depends(get_db)):
+def momo_ipn(body: dict = Body(...), db: Session = Depends(get_db)):
     """
     IPN từ MoMo (sandbox): xác minh chữ ký nếu có, cập nhật vé sang PAID, cộng điểm.
+    `def` thường: FastAPI chạy trong threadpool => truy vấn DB (blocking) không chặn event loop.
     """
-    body = await request.json()
     partnerCode = os.getenv("MOMO_PARTNER_CODE")
     accessKey = os.getenv("MOMO_ACCESS_KEY")
     secretKey = os.getenv("MOMO_SECRET_KEY")
@@ -600,10 +932,6 @@ async def momo_ipn(request: Request, db: Session = Depends(get_db)):
     if not ve_id:
         return {"resultCode": 99, "message": "orderId không hợp lệ"}
 
-    ve = db.get(Ve, ve_id)
-    if not ve:
-        return {"resultCode": 99, "message": "Vé không tồn tại"}
-
     # xác minh chữ ký nếu đủ trường
     try:
         recv_sig = body.get("signature", "")
@@ -616,47 +944,75 @@ async def momo_ipn(request: Request, db: Session = Depends(get_db)):
 
     result_code = int(body.get("resultCode", 99))
     if result_code == 0:
-        if ve.trang_thai != "PAID":
-            ve.trang_thai = "PAID"
-            # lưu mã giao dịch & thời gian nếu có cột
-            try:
-                ve.payment_ref = body.get("transId") or ve.payment_ref
-                ve.payment_time = datetime.utcnow()
-            except Exception:
-                pass
-
-            try:
-                # Cộng điểm
-                so_tien = float(ve.tong_tien or 0)
-                diem_cong = int(so_tien / 5000)
-                if diem_cong > 0:
-                    db.execute(
-                        text(
-                            """
-                            INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
-                            VALUES (:uid, :diem, :lydo, NOW())
-                        """
-                        ),
-                        {
-                            "uid": ve.user_id,
-                            "diem": diem_cong,
-                            "lydo": f"Cộng {diem_cong} điểm từ chi tiêu {int(so_tien):,}đ (MoMo)",
-                        },
-                    )
-
-                # Gamification cho vé trò chơi
-                if ve.tro_choi_id is not None:
-                    increment_active_challenges(
-                        db, user_id=ve.user_id, inc=int(ve.so_luong or 1)
-                    )
-                    reward_if_reached(db, user_id=ve.user_id)
-
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                return {"resultCode": 98, "message": f"Lỗi khi cập nhật DB: {e}"}
+        # Khóa vé trước: vé không tồn tại thì trả lỗi ngay (không để FK của payment_events nuốt mất),
+        # IPN trùng gửi đồng thời xếp hàng ở khóa này.
+        ve = db.get(Ve, ve_id, with_for_update=True)
+        if not ve:
+            db.rollback()
+            return {"resultCode": 99, "message": "Vé không tồn tại"}
+
+        # Cổng idempotent: UNIQUE(order_id, trans_id). MoMo bắn lại IPN => trùng khóa
+        # => trả thành công ngay, không chạy lại cộng điểm/thử thách. Lỗi khác vẫn là lỗi.
+        try:
+            db.execute(
+                text(
+                    """
+                    INSERT INTO payment_events
+                        (order_id, trans_id, ve_id, result_code, amount, created_at)
+                    VALUES (:oid, :tid, :vid, :rc, :amt, NOW())
+                    """
+                ),
+                {
+                    "oid": str(order_id),
+                    "tid": str(body.get("transId") or ""),
+                    "vid": ve_id,
+                    "rc": result_code,
+                    "amt": int(body.get("amount") or 0),
+                },
+            )
+        except IntegrityError as e:
+            db.rollback()
+            if getattr(e.orig, "args", (None,))[0] == ER_DUP_ENTRY:
+                return {"resultCode": 0, "message": "Đã xử lý trước đó"}
+            return {"resultCode": 98, "message": f"Lỗi khi cập nhật DB: {e}"}
+
+        try:
+            # Vé đã bị hủy (vd quá hạn) mà tiền vẫn về: giữ lại lượt KM (giá vé đã giảm theo KM)
+            # và chỗ trước khi PAID. Hết lượt / hết chỗ => để nguyên CANCELLED,
+            # payment_events còn lưu để hoàn tiền.
+            revive = ve.trang_thai == "CANCELLED"
+            if revive:
+                sp = db.begin_nested()
+                if not promo_quota.reclaim_tickets(db, [ve.id]):
+                    sp.rollback()
+                    db.commit()
+                    return {"resultCode": 0, "message": "Vé đã hủy và khuyến mãi đã hết lượt, cần hoàn tiền"}
+                if not inventory.reserve(
+                    db, int(ve.so_luong or 1), su_kien_id=ve.su_kien_id, tro_choi_id=ve.tro_choi_id
+                ):
+                    sp.rollback()
+                    db.commit()
+                    return {"resultCode": 0, "message": "Vé đã hủy và hết chỗ, cần hoàn tiền"}
+                sp.commit()
+
+            # Vé đã được STAFF duyệt trước đó thì transition bỏ qua => không cộng lại
+            res = ticket_state.transition(db, [ve.id], "PAID", nguon="MoMo", revive=revive)
+            sets = _ipn_payment_sets(db)
+            if res["changed"] and sets:
+                db.execute(
+                    text(f"UPDATE ve SET {sets} WHERE id = :id"),
+                    {"id": ve.id, "ref": str(body.get("transId") or "")},
+                )
+
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            return {"resultCode": 98, "message": f"Lỗi khi cập nhật DB: {e}"}
 
         return {"resultCode": 0, "message": "Thành công"}
 
+    if not db.get(Ve, ve_id):
+        return {"resultCode": 99, "message": "Vé không tồn tại"}
+
     # thất bại / pending
     return {"resultCode": result_code, "message": "Giao dịch chưa thành công"}
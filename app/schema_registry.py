@@ -0,0 +1,75 @@
+# app/schema_registry.py
+"""
+Danh bạ cột của các bảng "lệch schema giữa các môi trường" (cột tuỳ chọn như
+thu_thach_tuan.hoat_dong, ve.payment_ref / payment_time / paid_at / loai).
+
+- Đọc information_schema 1 lần (1 câu cho mọi bảng theo dõi) lúc khởi động,
+  sau đó has() tra trong bộ nhớ => không còn truy vấn metadata trên đường thanh toán.
+- refresh(): nạp lại sau khi ALTER TABLE (endpoint ADMIN /nhan-vien/ops/schema/refresh).
+- Chưa nạp được lúc khởi động (DB chưa lên) => lần has() đầu tiên tự nạp.
+"""
+import threading
+import time
+
+from sqlalchemy import text
+
+TRACKED_TABLES = (
+    "ve",
+    "thu_thach_tuan",
+    "tien_do_thu_thach",
+    "so_cai_diem",
+    "ve_khuyen_mai",
+    "points_balance",
+    "leaderboard_buckets",
+    "tro_choi",
+    "su_kien",
+    "khuyen_mai",
+)
+
+
+class SchemaRegistry:
+    def __init__(self, tables=TRACKED_TABLES):
+        self.tables = tuple(tables)
+        self._lock = threading.Lock()
+        self._columns: dict[str, frozenset[str]] | None = None
+        self._loaded_at = None
+        self.refreshes = 0
+
+    def refresh(self, db) -> dict:
+        rows = db.execute(text("""
+            SELECT TABLE_NAME, COLUMN_NAME
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :t
+        """), {"t": self.tables}).all()
+        cols: dict[str, set[str]] = {t: set() for t in self.tables}
+        for table, column in rows:
+            cols.setdefault(str(table).lower(), set()).add(str(column).lower())
+        with self._lock:
+            self._columns = {t: frozenset(c) for t, c in cols.items()}
+            self._loaded_at = time.time()
+            self.refreshes += 1
+        return self.snapshot()
+
+    def _cols(self, db) -> dict[str, frozenset[str]]:
+        cols = self._columns
+        if cols is None:
+            self.refresh(db)
+            cols = self._columns
+        return cols
+
+    def has(self, db, table: str, column: str) -> bool:
+        return column.lower() in self._cols(db).get(table.lower(), frozenset())
+
+    def has_table(self, db, table: str) -> bool:
+        return bool(self._cols(db).get(table.lower()))
+
+    def snapshot(self) -> dict:
+        cols = self._columns
+        return {
+            "loaded_at": self._loaded_at,
+            "refreshes": self.refreshes,
+            "tables": {t: sorted(c) for t, c in (cols or {}).items()},
+        }
+
+
+schema = SchemaRegistry()
@@ -11,10 +11,11 @@ T = TypeVar("T")
 
 
 class PageOut(BaseModel, Generic[T]):
-    total: int
+    total: Optional[int] = None
     page: int
     page_size: int
     items: List[T]
+    next_cursor: Optional[str] = None
 
 # =========================================================
 # AUTH
@@ -0,0 +1,124 @@
+# app/services/auto_migrate.py
+"""
+Migration tự chạy lúc khởi động (thay cho việc phải nhớ chạy tay `python -m app.services.X --migrate`).
+
+- Mỗi bước có tên; chạy xong ghi vào schema_migrations => mỗi DB chỉ chạy 1 lần.
+- GET_LOCK (db.locked_session): nhiều worker uvicorn cùng khởi động thì chỉ 1 process chạy,
+  process khác bỏ qua ngay.
+- Chạy trong thread nền => app nhận request ngay. Chỗ đọc dữ liệu do 1 bước dựng lại
+  kiểm tra done(db, tên bước) và dùng đường cũ cho tới khi bước đó xong.
+- Bước lỗi: dừng (bước sau có thể phụ thuộc), ghi _stats["errors"]; lần khởi động sau
+  hoặc POST /nhan-vien/ops/migrations/run chạy lại.
+Các lệnh --migrate cũ vẫn dùng được (chạy lại an toàn).
+Cấu hình .env: AUTO_MIGRATE (1/0)
+"""
+import threading
+import time
+
+from sqlalchemy import text
+
+from ..db import locked_session
+
+LOCK_NAME = "trungtamgiaitri.auto_migrate"
+NEGATIVE_TTL = 5.0  # giây giữ kết quả "chưa xong" của done() trước khi hỏi lại DB
+
+_done: set[str] = set()
+_pending_checked: dict[str, float] = {}
+_stats = {"runs": 0, "applied": [], "errors": {}, "last_run_at": None, "skipped_locked": 0}
+_stats_lock = threading.Lock()
+
+
+def _steps():
+    """[(tên, fn(db) -> dict)] theo thứ tự. fn chạy lại được, tự commit."""
+    from . import (
+        challenge_progress, challenge_reward_job, challenge_rewards, inventory, leaderboard,
+        leaderboard_buckets, points, promo_conditions, promo_quota, ticket_expiry,
+    )
+    return [
+        (promo_quota.MIGRATION, promo_quota.migrate),
+        (promo_conditions.MIGRATION, promo_conditions.migrate),
+        (points.MIGRATION, points.backfill),
+        (leaderboard.MIGRATION, leaderboard.migrate),
+        (challenge_rewards.MIGRATION, challenge_rewards.migrate),
+        (challenge_progress.MIGRATION, challenge_progress.migrate),
+        (challenge_reward_job.MIGRATION, challenge_reward_job.migrate),
+        (leaderboard_buckets.MIGRATION, leaderboard_buckets.migrate),
+        (inventory.MIGRATION, inventory.migrate),
+        (ticket_expiry.MIGRATION, ticket_expiry.migrate),
+    ]
+
+
+def done(db, name: str) -> bool:
+    """Bước `name` đã chạy xong trên DB này chưa (đã xong thì nhớ luôn trong process)."""
+    if name in _done:
+        return True
+    checked = _pending_checked.get(name)
+    if checked is not None and time.monotonic() - checked < NEGATIVE_TTL:
+        return False
+    ok = db.execute(
+        text("SELECT 1 FROM schema_migrations WHERE ten = :t"), {"t": name}
+    ).first() is not None
+    if ok:
+        _done.add(name)
+    else:
+        _pending_checked[name] = time.monotonic()
+    return ok
+
+
+def run_pending() -> dict:
+    out = {"applied": {}, "error": None, "locked": False}
+    with locked_session(LOCK_NAME) as db:
+        if db is None:
+            out["locked"] = True
+            with _stats_lock:
+                _stats["skipped_locked"] += 1
+            return out
+        finished = {r[0] for r in db.execute(text("SELECT ten FROM schema_migrations")).all()}
+        db.rollback()
+        for name, fn in _steps():
+            if name in finished:
+                _done.add(name)
+                continue
+            try:
+                out["applied"][name] = fn(db)
+                db.execute(text("""
+                    INSERT INTO schema_migrations (ten, xong_luc) VALUES (:t, UTC_TIMESTAMP())
+                    ON DUPLICATE KEY UPDATE xong_luc = xong_luc
+                """), {"t": name})
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                out["error"] = {name: str(e)}
+                with _stats_lock:
+                    _stats["errors"][name] = str(e)
+                break
+            _done.add(name)
+            _pending_checked.pop(name, None)
+            with _stats_lock:
+                _stats["applied"].append(name)
+                _stats["errors"].pop(name, None)
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["last_run_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return out
+
+
+def metrics() -> dict:
+    with _stats_lock:
+        out = {**_stats, "applied": list(_stats["applied"]), "errors": dict(_stats["errors"])}
+    out["steps"] = [name for name, _ in _steps()]
+    out["done"] = sorted(_done)
+    return out
+
+
+def start_background() -> threading.Thread:
+    def _run():
+        try:
+            run_pending()
+        except Exception as e:
+            with _stats_lock:
+                _stats["errors"]["_run"] = str(e)
+
+    t = threading.Thread(target=_run, name="auto-migrate", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,109 @@
+# app/services/challenge_cache.py
+"""
+Thử thách tuần đang hiệu lực, giữ trong bộ nhớ process (cùng cách làm với PromoCache).
+
+- Nạp 1 lần mọi thử thách chưa kết thúc (kể cả sắp bắt đầu) vào IntervalIndex
+  => tập đang hiệu lực chỉ tính lại khi qua mốc ngay_bat_dau / ngay_ket_thuc, không query DB.
+- invalidate(): gọi sau mỗi lần ghi thu_thach_tuan (CRUD trong routers/gamify.py, migrate).
+- max_age: nạp lại định kỳ để các worker uvicorn khác thấy thay đổi (0 = tắt).
+- Giờ so sánh theo NOW() của DB (lệch giờ app/DB đo lúc nạp).
+
+Mỗi phần tử là dict (không sửa tại chỗ): ma_thu_thach, ten_thu_thach, muc_tieu, diem_thuong,
+loai_chi_so (None = DB chưa có cột / để trống), ngay_bat_dau, ngay_ket_thuc.
+Cấu hình .env: CHALLENGE_CACHE_MAX_AGE (giây)
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from ..interval_index import IntervalIndex
+from ..schema_registry import schema
+
+# Nếu MySQL chạy UTC nhưng bạn lưu thời gian theo VN (+07:00),
+# hãy đổi _NOW_EXPR = "CONVERT_TZ(NOW(), '+00:00', '+07:00')"
+_NOW_EXPR = "NOW()"
+
+
+class ChallengeCache:
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index: IntervalIndex | None = None
+        self._active: list[dict] = []
+        self._ids: tuple[int, ...] = ()
+        self._as_of = None
+        self._skew = timedelta(0)
+        self._loaded_at = 0.0
+        self.reloads = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._index = None
+
+    def now(self) -> datetime:
+        return datetime.now() + self._skew
+
+    def _reload(self, db) -> None:
+        metric = "tt.loai_chi_so" if schema.has(db, "thu_thach_tuan", "loai_chi_so") else "NULL"
+        active = "AND IFNULL(tt.hoat_dong,1)=1" if schema.has(db, "thu_thach_tuan", "hoat_dong") else ""
+        db_now = db.execute(text(f"SELECT {_NOW_EXPR}")).scalar()
+        rows = db.execute(text(f"""
+            SELECT tt.ma_thu_thach, tt.ten_thu_thach, tt.muc_tieu, tt.diem_thuong,
+                   {metric} AS loai_chi_so, tt.ngay_bat_dau, tt.ngay_ket_thuc
+            FROM thu_thach_tuan tt
+            WHERE tt.ngay_ket_thuc >= {_NOW_EXPR}
+            {active}
+            ORDER BY tt.ngay_bat_dau ASC, tt.ma_thu_thach ASC
+        """)).mappings().all()
+        self._skew = (db_now - datetime.now()) if db_now else timedelta(0)
+        self._index = IntervalIndex(
+            (r["ngay_bat_dau"], r["ngay_ket_thuc"], {
+                "ma_thu_thach": int(r["ma_thu_thach"]),
+                "ten_thu_thach": r["ten_thu_thach"],
+                "muc_tieu": int(r["muc_tieu"] or 0),
+                "diem_thuong": int(r["diem_thuong"] or 0),
+                "loai_chi_so": r["loai_chi_so"] or None,
+                "ngay_bat_dau": r["ngay_bat_dau"],
+                "ngay_ket_thuc": r["ngay_ket_thuc"],
+            })
+            for r in rows
+        )
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+        self._recompute(db_now or self.now())
+
+    def _recompute(self, now) -> None:
+        self._active = self._index.at(now)
+        self._ids = tuple(c["ma_thu_thach"] for c in self._active)
+        self._as_of = now
+
+    def active(self, db) -> list[dict]:
+        """Thử thách đang hiệu lực, sắp theo ngay_bat_dau, ma_thu_thach tăng dần."""
+        with self._lock:
+            if self._index is None or (
+                self.max_age and time.monotonic() - self._loaded_at > self.max_age
+            ):
+                self._reload(db)
+            else:
+                now = self.now()
+                if self._index.changed_between(self._as_of, now):
+                    self._recompute(now)
+            return self._active
+
+    def active_ids(self, db) -> tuple[int, ...]:
+        self.active(db)
+        with self._lock:
+            return self._ids
+
+    def next_boundary(self):
+        """Mốc tiếp theo mà tập thử thách đang hiệu lực đổi (giờ DB), None nếu chưa nạp / không còn mốc."""
+        with self._lock:
+            if self._index is None or self._as_of is None:
+                return None
+            return self._index.next_boundary(self._as_of)
+
+
+challenge_cache = ChallengeCache(max_age=float(os.getenv("CHALLENGE_CACHE_MAX_AGE", "60")))
@@ -0,0 +1,201 @@
+# app/services/challenge_progress.py
+"""
+Tiến độ thử thách nhiều chỉ số, cập nhật tăng dần từ sự kiện nghiệp vụ.
+
+Mỗi thử thách khai báo thu_thach_tuan.loai_chi_so (METRICS). Sự kiện -> quan sát
+(uid, chỉ số, giá trị, khóa):
+  VE_PAID        -> SPEND (+tong_tien); vé trò chơi thêm PLAY_COUNT (+so_luong), DISTINCT_GAMES
+  GAME_PLAYED    -> GAMES_PLAYED (+1), DISTINCT_GAMES       (1 dòng lich_su_choi / vé trò chơi CHECKIN)
+  EVENT_ATTENDED -> EVENTS_ATTENDED (+1)                    (vé sự kiện CHECKIN / USED)
+record() gộp cả lô quan sát, ghép với thử thách đang hiệu lực (challenge_cache, không query
+thu_thach_tuan) rồi ghi bằng upsert theo lô:
+  - chỉ số cộng dồn: executemany INSERT ... ON DUPLICATE KEY UPDATE (gộp theo thử thách + user)
+  - chỉ số đếm khác nhau: INSERT IGNORE khóa vào tien_do_thu_thach_khoa (gắn mã lô),
+    rồi cộng số khóa MỚI của lô đó => không bao giờ đếm lại từ bảng ve / lich_su_choi.
+Commit do caller kiểm soát (trừ migrate).
+
+DB cũ: auto_migrate chạy migrate() lúc khởi động (thêm cột loai_chi_so + bảng khóa).
+Chạy tay: python -m app.services.challenge_progress --migrate
+"""
+import uuid
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from ..models import ChallengeProgressKey
+from ..schema_registry import schema
+from . import auto_migrate
+from .challenge_cache import challenge_cache
+
+MIGRATION = "thu_thach_tuan.loai_chi_so"
+
+PLAY_COUNT = "PLAY_COUNT"
+SPEND = "SPEND"
+GAMES_PLAYED = "GAMES_PLAYED"
+EVENTS_ATTENDED = "EVENTS_ATTENDED"
+DISTINCT_GAMES = "DISTINCT_GAMES"
+
+METRICS = {
+    PLAY_COUNT: "Lượt chơi trò chơi đã thanh toán",
+    SPEND: "Tổng chi tiêu (đ)",
+    GAMES_PLAYED: "Lượt chơi ghi nhận tại trò chơi",
+    EVENTS_ATTENDED: "Số lần tham dự sự kiện",
+    DISTINCT_GAMES: "Số trò chơi khác nhau",
+}
+# Đơn vị hiển thị (GET /gamify/metrics)
+METRIC_UNITS = {
+    PLAY_COUNT: "lượt",
+    SPEND: "đ",
+    GAMES_PLAYED: "lượt",
+    EVENTS_ATTENDED: "sự kiện",
+    DISTINCT_GAMES: "trò chơi",
+}
+DEFAULT_METRIC = PLAY_COUNT
+DISTINCT_METRICS = {DISTINCT_GAMES}
+
+
+def has_metric_column(db) -> bool:
+    return schema.has(db, "thu_thach_tuan", "loai_chi_so") or auto_migrate.done(db, MIGRATION)
+
+
+def metric_expr(db, alias: str = "tt") -> str:
+    """Biểu thức SQL chỉ số của thử thách (DB cũ chưa có cột => mọi thử thách là PLAY_COUNT)."""
+    if has_metric_column(db):
+        return f"COALESCE({alias}.loai_chi_so, '{DEFAULT_METRIC}')"
+    return f"'{DEFAULT_METRIC}'"
+
+
+# ---------- Sự kiện -> quan sát ----------
+def ticket_paid(p: dict) -> list[tuple]:
+    uid = int(p["user_id"])
+    out = []
+    tien = int(p.get("tong_tien") or 0)
+    if tien > 0:
+        out.append((uid, SPEND, tien, None))
+    if p.get("tro_choi_id") is not None:
+        out.append((uid, PLAY_COUNT, int(p.get("so_luong") or 1), None))
+        out.append((uid, DISTINCT_GAMES, 1, int(p["tro_choi_id"])))
+    return out
+
+
+def game_played(uid: int, tro_choi_id) -> list[tuple]:
+    out = [(int(uid), GAMES_PLAYED, 1, None)]
+    if tro_choi_id is not None:
+        out.append((int(uid), DISTINCT_GAMES, 1, int(tro_choi_id)))
+    return out
+
+
+def event_attended(uid: int) -> list[tuple]:
+    return [(int(uid), EVENTS_ATTENDED, 1, None)]
+
+
+# ---------- Ghi tiến độ ----------
+def _add_sums(db, rows) -> int:
+    res = db.execute(text("""
+        INSERT INTO tien_do_thu_thach (ma_thu_thach, ma_nguoi_dung, gia_tri_hien_tai)
+        VALUES (:ma, :uid, :inc)
+        ON DUPLICATE KEY UPDATE
+          gia_tri_hien_tai = tien_do_thu_thach.gia_tri_hien_tai + VALUES(gia_tri_hien_tai)
+    """), rows)
+    return res.rowcount or 0
+
+
+def _add_distinct(db, rows) -> int:
+    lo = uuid.uuid4().hex
+    for r in rows:
+        r["lo"] = lo
+    db.execute(text("""
+        INSERT IGNORE INTO tien_do_thu_thach_khoa (ma_thu_thach, ma_nguoi_dung, khoa, lo, created_at)
+        VALUES (:ma, :uid, :khoa, :lo, NOW())
+    """), rows)
+    # rowcount của executemany không tin được với INSERT IGNORE => cộng theo các khóa mang mã lô
+    res = db.execute(text("""
+        INSERT INTO tien_do_thu_thach (ma_thu_thach, ma_nguoi_dung, gia_tri_hien_tai)
+        SELECT k.ma_thu_thach, k.ma_nguoi_dung, COUNT(*)
+        FROM tien_do_thu_thach_khoa k
+        WHERE k.lo = :lo
+        GROUP BY k.ma_thu_thach, k.ma_nguoi_dung
+        ORDER BY k.ma_thu_thach, k.ma_nguoi_dung
+        ON DUPLICATE KEY UPDATE
+          gia_tri_hien_tai = tien_do_thu_thach.gia_tri_hien_tai + VALUES(gia_tri_hien_tai)
+    """), {"lo": lo})
+    return res.rowcount or 0
+
+
+def record(db, observations) -> int:
+    """
+    observations: [(uid, chỉ số, giá trị, khóa)] (xem ticket_paid / game_played / event_attended).
+    Trả về rowcount ước lượng của các upsert. KHÔNG commit.
+    """
+    by_metric = defaultdict(list)
+    for c in challenge_cache.active(db):
+        by_metric[c["loai_chi_so"] or DEFAULT_METRIC].append(c["ma_thu_thach"])
+    if not by_metric:
+        return 0
+
+    sums, keys = defaultdict(int), set()
+    for uid, metric, value, key in observations:
+        for ma in by_metric.get(metric, ()):
+            if metric in DISTINCT_METRICS:
+                if key is not None:
+                    keys.add((ma, int(uid), int(key)))
+            elif value:
+                sums[(ma, int(uid))] += int(value)
+    n = 0
+    # Thứ tự khóa cố định => 2 lô chồng nhau không deadlock
+    if sums:
+        n += _add_sums(db, [{"ma": ma, "uid": u, "inc": v} for (ma, u), v in sorted(sums.items())])
+    if keys:
+        n += _add_distinct(db, [{"ma": ma, "uid": u, "khoa": k} for ma, u, k in sorted(keys)])
+    return n
+
+
+def normalize_metric(raw) -> str | None:
+    """'spend' / 'SPEND' -> 'SPEND'; rỗng -> None; không hợp lệ -> ValueError."""
+    if raw is None or str(raw).strip() == "":
+        return None
+    m = str(raw).strip().upper()
+    if m not in METRICS:
+        raise ValueError(f"loai_chi_so không hợp lệ: {raw} (hợp lệ: {', '.join(METRICS)})")
+    return m
+
+
+# ---------- Migration ----------
+def migrate(db) -> dict:
+    """Chạy lại được. DDL MySQL tự commit."""
+    out = {"altered": False}
+    ChallengeProgressKey.__table__.create(bind=db.get_bind(), checkfirst=True)
+    if not db.execute(text("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'thu_thach_tuan' AND COLUMN_NAME = 'loai_chi_so'
+    """)).first():
+        db.execute(text(f"""
+            ALTER TABLE thu_thach_tuan
+              ADD COLUMN loai_chi_so VARCHAR(20) NOT NULL DEFAULT '{DEFAULT_METRIC}'
+        """))
+        out["altered"] = True
+    db.commit()
+    schema.refresh(db)
+    challenge_cache.invalidate()
+    return out
+
+
+def main():
+    import argparse
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate", action="store_true")
+    args = ap.parse_args()
+    if not args.migrate:
+        ap.print_help()
+        return
+    db = SessionLocal()
+    try:
+        print(migrate(db))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# app/services/challenge_reward_job.py
+"""
+Job thưởng thử thách tuần định kỳ, set-based theo lô user.
+
+- GET_LOCK (db.locked_session): mọi worker uvicorn đều bật thread nhưng mỗi lượt chỉ 1 process
+  chạy, process khác bỏ qua lượt đó.
+- Chỉ quét user có tien_do_thu_thach.updated_at >= mốc lần chạy trước (lùi OVERLAP_S giây cho
+  transaction commit muộn). Quét toàn bộ khi: process chưa chạy lần nào, tập thử thách đang
+  hiệu lực / mục tiêu / điểm thưởng đổi, hoặc DB chưa có cột updated_at (chưa migrate).
+
+Mỗi lượt chạy đi theo khoảng id user (CHUNK user / lô), mỗi lô 1 transaction:
+  1. INSERT INTO challenge_rewards ... SELECT ... ON DUPLICATE KEY UPDATE id = id
+       thu_thach_tuan (đang hiệu lực) JOIN tien_do_thu_thach (đạt muc_tieu)
+       anti-join challenge_rewards (chưa thưởng), gắn job_batch của lô
+  2. points.add_select(): cộng points_balance + ghi sổ cái (kèm FK) cho đúng các dòng
+     mang job_batch đó, cũng bằng INSERT ... SELECT
+  => vài câu SQL / lô bất kể số user; không truy vấn theo từng user trên đường thanh toán.
+Chạy trùng với thưởng inline (challenge_rewards.claim) vẫn an toàn nhờ khóa unique.
+
+Worker đang chạy => outbox bỏ bước thưởng inline, thưởng về trong ~CHALLENGE_REWARD_INTERVAL giây.
+Cấu hình .env: CHALLENGE_REWARD_JOB (1/0), CHALLENGE_REWARD_INTERVAL (giây), CHALLENGE_REWARD_CHUNK
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from ..db import locked_session
+from ..schema_registry import schema
+from . import auto_migrate, challenge_rewards, points
+from .challenge_cache import challenge_cache
+from .gamification import _active_clause
+
+CHUNK = int(os.getenv("CHALLENGE_REWARD_CHUNK", "20000"))
+LOCK_NAME = "trungtamgiaitri.challenge_reward_job"
+MIGRATION = "tien_do_thu_thach.updated_at"
+OVERLAP_S = 60
+
+# Mốc quét của process này: chỉ tiến lên sau 1 lượt chạy trọn vẹn
+_watermark = {"since": None, "sig": None}
+
+_stats = {
+    "runs": 0,
+    "rewarded_total": 0,
+    "errors": 0,
+    "last_run_at": None,
+    "last_run_ms": 0.0,
+    "last_run_rewarded": 0,
+    "last_run_users": 0,
+    "last_run_chunks": 0,
+    "last_run_users_per_s": 0.0,
+    "last_run_full": None,
+    "skipped_locked": 0,
+}
+_stats_lock = threading.Lock()
+
+def _signature(db) -> tuple:
+    """Đổi khi tập thử thách đang hiệu lực / mục tiêu / điểm thưởng đổi => cần quét lại toàn bộ."""
+    return tuple(
+        (c["ma_thu_thach"], c["muc_tieu"], c["diem_thuong"], c["ngay_bat_dau"])
+        for c in challenge_cache.active(db)
+    )
+
+
+def _user_range(db) -> tuple[int, int, int] | None:
+    """(min, max, số user) có tiến độ ở thử thách đang hiệu lực."""
+    row = db.execute(text(f"""
+        SELECT MIN(td.ma_nguoi_dung), MAX(td.ma_nguoi_dung), COUNT(DISTINCT td.ma_nguoi_dung)
+        FROM thu_thach_tuan tt
+        JOIN tien_do_thu_thach td ON td.ma_thu_thach = tt.ma_thu_thach
+        WHERE NOW() BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
+          {_active_clause(db)}
+    """)).first()
+    if not row or row[0] is None:
+        return None
+    return int(row[0]), int(row[1]), int(row[2] or 0)
+
+
+def _changed_users(db, since) -> list[int]:
+    """User có tiến độ đổi từ `since` ở thử thách đang hiệu lực (index updated_at)."""
+    return [int(r[0]) for r in db.execute(text(f"""
+        SELECT DISTINCT td.ma_nguoi_dung
+        FROM tien_do_thu_thach td
+        JOIN thu_thach_tuan tt ON tt.ma_thu_thach = td.ma_thu_thach
+        WHERE td.updated_at >= :since
+          AND NOW() BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
+          {_active_clause(db)}
+        ORDER BY td.ma_nguoi_dung
+    """), {"since": since}).all()]
+
+
+def _ranges(db, chunk: int, since) -> tuple[list[tuple[int, int]], int]:
+    """([(lo, hi)], số user): lô theo khoảng id (quét toàn bộ) hoặc theo danh sách user đã đổi."""
+    if since is None:
+        rng = _user_range(db)
+        if not rng:
+            return [], 0
+        lo, hi, n = rng
+        return [(s, min(hi, s + chunk - 1)) for s in range(lo, hi + 1, chunk)], n
+    ids = _changed_users(db, since)
+    return [(ids[i], ids[min(i + chunk, len(ids)) - 1]) for i in range(0, len(ids), chunk)], len(ids)
+
+
+def reward_chunk(db, lo: int, hi: int, batch: str, since=None) -> int:
+    """
+    Thưởng cho user id trong [lo, hi] (since: chỉ dòng tiến độ đổi từ mốc đó).
+    KHÔNG commit. Trả về số lượt thưởng mới.
+    """
+    changed = "AND td.updated_at >= :since" if since is not None else ""
+    # Dòng trùng (thưởng inline chen giữa) giữ nguyên batch cũ nhưng vẫn được đếm trong rowcount
+    # (CLIENT_FOUND_ROWS): số lượt mới = số dòng sổ cái ghi cho batch này
+    res = db.execute(text(f"""
+        INSERT INTO challenge_rewards
+            (user_id, ma_thu_thach, tuan_bat_dau, diem, created_at, job_batch)
+        SELECT td.ma_nguoi_dung, tt.ma_thu_thach, DATE(tt.ngay_bat_dau),
+               tt.diem_thuong, NOW(), :batch
+        FROM thu_thach_tuan tt
+        JOIN tien_do_thu_thach td
+          ON td.ma_thu_thach = tt.ma_thu_thach
+         AND td.ma_nguoi_dung BETWEEN :lo AND :hi
+         {changed}
+        LEFT JOIN challenge_rewards cr
+          ON cr.user_id = td.ma_nguoi_dung
+         AND cr.ma_thu_thach = tt.ma_thu_thach
+         AND cr.tuan_bat_dau = DATE(tt.ngay_bat_dau)
+        WHERE NOW() BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
+          {_active_clause(db)}
+          AND COALESCE(td.gia_tri_hien_tai,0) >= COALESCE(tt.muc_tieu,0)
+          AND COALESCE(tt.diem_thuong,0) > 0
+          AND cr.id IS NULL
+          {challenge_rewards.legacy_clause(db, "td.ma_nguoi_dung", "tt.ma_thu_thach", "DATE(tt.ngay_bat_dau)")}
+        ON DUPLICATE KEY UPDATE id = challenge_rewards.id
+    """), {"lo": lo, "hi": hi, "batch": batch, "since": since})
+    if not res.rowcount:
+        return 0
+    return points.add_select(db, challenge_rewards.LEDGER_SELECT, {"batch": batch})
+
+
+def has_updated_at(db) -> bool:
+    """Cột tien_do_thu_thach.updated_at đã có chưa (danh bạ schema của process này có thể cũ
+    nếu process khác vừa migrate => hỏi thêm schema_migrations)."""
+    return schema.has(db, "tien_do_thu_thach", "updated_at") or auto_migrate.done(db, MIGRATION)
+
+
+def run_once(db, chunk: int = CHUNK, full: bool = False) -> dict:
+    """1 lượt thưởng trên session `db` (không tự lấy khóa; job nền / ops dùng run_locked)."""
+    t0 = time.perf_counter()
+    run_id = uuid.uuid4().hex[:12]
+    out = {"rewarded": 0, "users": 0, "chunks": 0, "full": True}
+    try:
+        # Không có thử thách đang hiệu lực (tra cache) => khỏi quét
+        sig = _signature(db)
+        started = db.execute(text("SELECT NOW()")).scalar()
+        since = _watermark["since"]
+        if full or since is None or _watermark["sig"] != sig \
+                or not has_updated_at(db):
+            since = None
+        out["full"] = since is None
+        ranges, out["users"] = _ranges(db, chunk, since) if sig else ([], 0)
+        db.rollback()
+        for lo, hi in ranges:
+            out["rewarded"] += reward_chunk(db, lo, hi, f"{run_id}-{out['chunks']}", since)
+            db.commit()
+            out["chunks"] += 1
+        _watermark.update(since=started - timedelta(seconds=OVERLAP_S), sig=sig)
+    except Exception:
+        db.rollback()
+        with _stats_lock:
+            _stats["errors"] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        out["ms"] = round(elapsed * 1000, 1)
+        out["users_per_s"] = round(out["users"] / elapsed, 1) if elapsed > 0 else 0.0
+        with _stats_lock:
+            _stats["runs"] += 1
+            _stats["rewarded_total"] += out["rewarded"]
+            _stats["last_run_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            _stats["last_run_ms"] = out["ms"]
+            _stats["last_run_rewarded"] = out["rewarded"]
+            _stats["last_run_users"] = out["users"]
+            _stats["last_run_chunks"] = out["chunks"]
+            _stats["last_run_users_per_s"] = out["users_per_s"]
+            _stats["last_run_full"] = out["full"]
+    return out
+
+
+def run_locked(chunk: int = CHUNK, full: bool = False) -> dict | None:
+    """run_once dưới GET_LOCK; process khác đang chạy => None."""
+    with locked_session(LOCK_NAME) as db:
+        if db is None:
+            with _stats_lock:
+                _stats["skipped_locked"] += 1
+            return None
+        return run_once(db, chunk, full)
+
+
+# ---------- Migration ----------
+def migrate(db) -> dict:
+    """
+    Thêm tien_do_thu_thach.updated_at (tự cập nhật khi gia_tri_hien_tai đổi) + index để
+    job chỉ quét user vừa có tiến độ. Chạy lại được; DDL MySQL tự commit.
+    """
+    out = {"altered": False}
+    cols = {r[0].lower() for r in db.execute(text("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'tien_do_thu_thach'
+    """)).all()}
+    if cols and "updated_at" not in cols:
+        db.execute(text("""
+            ALTER TABLE tien_do_thu_thach
+              ADD COLUMN updated_at DATETIME NOT NULL
+                DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              ADD INDEX ix_tdtt_updated_at (updated_at)
+        """))
+        out["altered"] = True
+    db.commit()
+    schema.refresh(db)
+    return out
+
+
+def metrics() -> dict:
+    with _stats_lock:
+        out = dict(_stats)
+    out["running"] = reward_job.running
+    out["interval"] = reward_job.interval
+    return out
+
+
+class RewardJob:
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="challenge-rewards", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                run_locked()
+            except Exception:
+                pass  # đã ghi vào _stats["errors"] (hoặc lỗi lấy khóa: thử lại lượt sau)
+            self._stop.wait(self.interval)
+
+
+reward_job = RewardJob(interval=float(os.getenv("CHALLENGE_REWARD_INTERVAL", "5")))
@@ -0,0 +1,165 @@
+# app/services/challenge_rewards.py
+"""
+Thưởng thử thách tuần có cấu trúc:
+- challenge_rewards(user_id, ma_thu_thach, tuan_bat_dau) UNIQUE => nhận thưởng =
+  INSERT ... ON DUPLICATE KEY UPDATE id = id gắn job_batch; dòng trùng không bị đổi nên
+  chỉ lượt chèn được mới mang batch đó (kể cả khi 2 worker cùng thưởng 1 lúc).
+- Dòng sổ cái trỏ về lượt thưởng qua so_cai_diem.challenge_reward_id (FK).
+- Kiểm tra "đã thưởng chưa" = tra khóa unique, không quét ly_do LIKE '%TT#..%' theo sổ cái.
+  Ngoại lệ: tới khi migrate() chuyển xong lượt thưởng cũ (ready()), legacy_clause() vẫn
+  loại các lượt đã có marker trong ly_do.
+Commit do caller kiểm soát (trừ migrate).
+
+DB cũ: auto_migrate chạy migrate() lúc khởi động (thêm cột FK + chuyển các dòng thưởng cũ
+đánh dấu TT#<id>@<tuần> / [WEEK <tuần>] <id> trong ly_do).
+Chạy tay: python -m app.services.challenge_rewards --migrate
+"""
+import uuid
+
+from sqlalchemy import text
+
+from ..models import ChallengeReward
+from ..schema_registry import schema
+from . import auto_migrate, points
+
+LEDGER_LINK = "challenge_reward_id"
+MIGRATION = "challenge_rewards.backfill"
+
+# Dòng sổ cái cho các lượt thưởng mang job_batch = :batch (dùng với points.add_select)
+LEDGER_SELECT = """
+    SELECT user_id AS uid, diem,
+           CONCAT('Thưởng thử thách tuần TT#', ma_thu_thach, '@', tuan_bat_dau) AS lydo,
+           id AS reward_id
+    FROM challenge_rewards
+    WHERE job_batch = :batch
+"""
+
+
+def ready(db) -> bool:
+    """Lượt thưởng cũ (marker trong ly_do) đã chuyển sang challenge_rewards chưa."""
+    return auto_migrate.done(db, MIGRATION)
+
+
+def legacy_clause(db, uid: str, ma: str, week: str) -> str:
+    """
+    Điều kiện SQL "chưa có marker thưởng cũ trên sổ cái" cho các biểu thức cột đã cho.
+    Rỗng khi đã migrate; trước đó thiếu điều kiện này thì user đã thưởng bị thưởng lại.
+    """
+    if ready(db):
+        return ""
+    return f"""
+          AND NOT EXISTS (
+            SELECT 1 FROM so_cai_diem s
+            WHERE s.ma_nguoi_dung = {uid}
+              AND (s.ly_do LIKE CONCAT('%TT#', {ma}, '@', {week}, '%')
+                   OR s.ly_do LIKE CONCAT('%[WEEK ', {week}, '] ', {ma}, ':%'))
+          )"""
+
+
+def claim(db, candidates) -> int:
+    """
+    candidates: [{"uid", "ma", "week", "diem"}].
+    Chèn cả lô với 1 job_batch riêng; lượt đã có (khóa unique) giữ nguyên batch cũ
+    => points.add_select() chỉ ghi sổ cái (kèm FK) cho lượt mới. Trả về số lượt thưởng mới.
+    """
+    rows = [
+        {"uid": int(c["uid"]), "ma": int(c["ma"]), "w": c["week"], "diem": int(c["diem"])}
+        for c in candidates
+    ]
+    if not rows:
+        return 0
+    batch = f"claim-{uuid.uuid4().hex}"
+    db.execute(text("""
+        INSERT INTO challenge_rewards (user_id, ma_thu_thach, tuan_bat_dau, diem, created_at, job_batch)
+        VALUES (:uid, :ma, :w, :diem, NOW(), :batch)
+        ON DUPLICATE KEY UPDATE id = id
+    """), [dict(r, batch=batch) for r in rows])
+    return points.add_select(db, LEDGER_SELECT, {"batch": batch})
+
+
+# ---------- Migration ----------
+_OLD_MARKERS = (
+    # "Thưởng thử thách tuần TT#12@2025-10-06"
+    (
+        "ly_do LIKE 'Thưởng thử thách tuần TT#%@%'",
+        "SUBSTRING_INDEX(SUBSTRING_INDEX(ly_do, 'TT#', -1), '@', 1)",
+        "LEFT(SUBSTRING_INDEX(ly_do, '@', -1), 10)",
+    ),
+    # "Thưởng thử thách tuần [WEEK 2025-10-06] 12: <tên>"
+    (
+        "ly_do LIKE 'Thưởng thử thách tuần [WEEK %] %'",
+        "SUBSTRING_INDEX(SUBSTRING_INDEX(ly_do, '] ', -1), ':', 1)",
+        "SUBSTRING(ly_do, LOCATE('[WEEK ', ly_do) + 6, 10)",
+    ),
+)
+
+
+def migrate(db) -> dict:
+    """Chạy lại được. DDL MySQL tự commit nên hàm này commit sau từng bước."""
+    out = {"altered": False, "backfilled": 0, "linked": 0}
+    ChallengeReward.__table__.create(bind=db.get_bind(), checkfirst=True)
+    if not db.execute(text("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'challenge_rewards' AND COLUMN_NAME = 'job_batch'
+    """)).first():
+        db.execute(text("""
+            ALTER TABLE challenge_rewards
+              ADD COLUMN job_batch VARCHAR(40) NULL,
+              ADD INDEX ix_challenge_rewards_batch (job_batch)
+        """))
+        out["altered"] = True
+    cols = {r[0].lower() for r in db.execute(text("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'so_cai_diem'
+    """)).all()}
+    if LEDGER_LINK not in cols:
+        db.execute(text(f"""
+            ALTER TABLE so_cai_diem
+              ADD COLUMN {LEDGER_LINK} INT NULL,
+              ADD CONSTRAINT fk_socaidiem_challenge_reward
+                FOREIGN KEY ({LEDGER_LINK}) REFERENCES challenge_rewards(id)
+        """))
+        out["altered"] = True
+        db.commit()
+
+    for where, ma_expr, week_expr in _OLD_MARKERS:
+        out["backfilled"] += db.execute(text(f"""
+            INSERT IGNORE INTO challenge_rewards (user_id, ma_thu_thach, tuan_bat_dau, diem, created_at)
+            SELECT ma_nguoi_dung, CAST({ma_expr} AS UNSIGNED), CAST({week_expr} AS DATE),
+                   diem_thay_doi, thoi_gian
+            FROM so_cai_diem
+            WHERE {where} AND {LEDGER_LINK} IS NULL
+        """)).rowcount or 0
+        out["linked"] += db.execute(text(f"""
+            UPDATE so_cai_diem s
+            JOIN challenge_rewards c
+              ON c.user_id = s.ma_nguoi_dung
+             AND c.ma_thu_thach = CAST({ma_expr.replace('ly_do', 's.ly_do')} AS UNSIGNED)
+             AND c.tuan_bat_dau = CAST({week_expr.replace('ly_do', 's.ly_do')} AS DATE)
+            SET s.{LEDGER_LINK} = c.id
+            WHERE {where.replace('ly_do', 's.ly_do', 1)} AND s.{LEDGER_LINK} IS NULL
+        """)).rowcount or 0
+        db.commit()
+    schema.refresh(db)
+    return out
+
+
+def main():
+    import argparse
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate", action="store_true")
+    args = ap.parse_args()
+    if not args.migrate:
+        ap.print_help()
+        return
+    db = SessionLocal()
+    try:
+        print(migrate(db))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,129 +1,76 @@
 # app/services/gamification.py
-from sqlalchemy import text
-
 """
 Gamification:
 - Thử thách tuần: thu_thach_tuan(ma_thu_thach, ten_thu_thach, muc_tieu, diem_thuong, ngay_bat_dau, ngay_ket_thuc)
-- Khi đạt mốc: ghi vào so_cai_diem(ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
-- Idempotent: kiểm tra đã có dòng thưởng tuần này chưa bằng khóa [WEEK yyyy-mm-dd] <ma_thu_thach> trong cột ly_do.
+- Khi đạt mốc: ghi vào so_cai_diem(ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian) qua points.add()
+- Idempotent: challenge_rewards UNIQUE(user, thử thách, tuần) (services/challenge_rewards.py);
+  chỉ dò marker ly_do trên sổ cái tới khi lượt thưởng cũ đã chuyển sang bảng đó.
+- Tiến độ (tien_do_thu_thach) cộng tăng dần từ sự kiện: services/challenge_progress.py
 """
+from sqlalchemy import text
 
-def _current_week_challenges(db):
-    # Bỏ cột trang_thai (không tồn tại trong DB của bạn)
-    sql = text("""
-        SELECT ma_thu_thach, ten_thu_thach, muc_tieu, diem_thuong,
-               DATE(ngay_bat_dau) AS d_start, DATE(ngay_ket_thuc) AS d_end
-        FROM thu_thach_tuan
-        WHERE NOW() BETWEEN ngay_bat_dau AND ngay_ket_thuc
-        ORDER BY ma_thu_thach
-    """)
-    return db.execute(sql).mappings().all()
+from ..schema_registry import schema
+from . import challenge_rewards
+from .challenge_cache import challenge_cache
 
-def _paid_game_count_in_range(db, user_id, d_start, d_end):
-    # Đếm số vé TRÒ CHƠI đã PAID trong khoảng tuần
-    sql = text("""
-        SELECT COUNT(*) AS cnt
-        FROM ve
-        WHERE user_id = :uid
-          AND tro_choi_id IS NOT NULL
-          AND trang_thai = 'PAID'
-          AND DATE(created_at) BETWEEN :d_start AND :d_end
-    """)
-    return int(db.execute(sql, {"uid": user_id, "d_start": d_start, "d_end": d_end}).scalar() or 0)
 
-def _already_rewarded(db, user_id, code, d_start):
-    # Dùng cột ly_do (không phải mo_ta)
-    key = f"[WEEK {d_start}] {code}"
-    sql = text("""
-        SELECT 1
-        FROM so_cai_diem
-        WHERE ma_nguoi_dung = :uid
-          AND ly_do LIKE :k
-        LIMIT 1
-    """)
-    return db.execute(sql, {"uid": user_id, "k": f"%{key}%"}).first() is not None
+def _active_clause(db) -> str:
+    # Cột hoat_dong không có ở mọi DB (tra schema_registry, không query information_schema)
+    return "AND IFNULL(tt.hoat_dong,1)=1" if schema.has(db, "thu_thach_tuan", "hoat_dong") else ""
 
-def _insert_reward(db, user_id, diem, code, title, d_start):
-    # Ghi vào cột ly_do, thời gian vào thoi_gian
-    ly_do = f"Thưởng thử thách tuần [WEEK {d_start}] {code}: {title}"
-    sql = text("""
-        INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
-        VALUES (:uid, :diem, :ly_do, NOW())
-    """)
-    db.execute(sql, {"uid": user_id, "diem": int(diem), "ly_do": ly_do})
 
-def update_progress_on_ticket_paid(user_id: int, so_luong: int, db):
+def reward_if_reached(db, user_id: int) -> int:
     """
-    Gọi sau khi ADMIN duyệt vé TRÒ CHƠI -> PAID.
-    Tự đếm lại số vé PAID trong tuần và cộng thưởng nếu đạt mốc.
-    Idempotent nhờ _already_rewarded().
+    Thưởng cho các thử thách tuần mà user đã đạt mục tiêu dựa theo bảng tien_do_thu_thach.
+    Chống thưởng trùng nhờ challenge_rewards (ly_do vẫn ghi marker TT#<id>@<week> để đọc).
     """
-    thachs = _current_week_challenges(db)
-    if not thachs:
-        return
-
-    for t in thachs:
-        code   = t["ma_thu_thach"]
-        title  = t["ten_thu_thach"]
-        target = int(t["muc_tieu"] or 0)
-        d_start = t["d_start"]
-        d_end   = t["d_end"]
-
-        if target <= 0:
-            continue
-
-        paid_cnt = _paid_game_count_in_range(db, user_id, d_start, d_end)
-        if paid_cnt < target:
-            continue
+    n = reward_if_reached_bulk(db, [user_id])
+    if n:
+        db.commit()
+    return n
 
-        if not _already_rewarded(db, user_id, code, d_start):
-            _insert_reward(db, user_id, int(t["diem_thuong"] or 0), code, title, d_start)
-    # Commit do caller (router) kiểm soát
-def reward_if_reached(db, user_id: int) -> int:
+def reward_if_reached_bulk(db, user_ids) -> int:
     """
-    Thưởng cho các thử thách tuần mà user đã đạt mục tiêu dựa theo bảng tien_do_thu_thach.
-    Chống thưởng trùng nhờ marker TT#<id>@<week> trong ly_do.
+    Giống reward_if_reached nhưng cho nhiều user cùng lúc (dùng bởi outbox worker):
+    1 SELECT thử thách đã đạt mà chưa có dòng challenge_rewards (tra khóa unique),
+    rồi challenge_rewards.claim() cả lô. KHÔNG commit.
     """
-    rows = db.execute(text("""
+    ids = tuple(sorted({int(u) for u in user_ids}))
+    active = challenge_cache.active_ids(db)
+    if not ids or not active:
+        return 0
+    rows = db.execute(text(f"""
         SELECT
+            td.ma_nguoi_dung,
             tt.ma_thu_thach,
             tt.diem_thuong,
             DATE(tt.ngay_bat_dau) AS week_start
         FROM thu_thach_tuan tt
         JOIN tien_do_thu_thach td
           ON td.ma_thu_thach = tt.ma_thu_thach
-         AND td.ma_nguoi_dung = :uid
-        WHERE NOW() BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
-          AND IFNULL(tt.hoat_dong,1)=1
+        LEFT JOIN challenge_rewards cr
+          ON cr.user_id = td.ma_nguoi_dung
+         AND cr.ma_thu_thach = tt.ma_thu_thach
+         AND cr.tuan_bat_dau = DATE(tt.ngay_bat_dau)
+        WHERE td.ma_nguoi_dung IN :ids
+          AND tt.ma_thu_thach IN :tt
+          AND NOW() BETWEEN tt.ngay_bat_dau AND tt.ngay_ket_thuc
+          {_active_clause(db)}
           AND COALESCE(td.gia_tri_hien_tai,0) >= COALESCE(tt.muc_tieu,0)
-    """), {"uid": user_id}).mappings().all()
-
-    count = 0
-    for r in rows:
-        ma = int(r["ma_thu_thach"])
-        diem = int(r["diem_thuong"] or 0)
-        week = str(r["week_start"])
-        marker = f"TT#{ma}@{week}"
+          AND COALESCE(tt.diem_thuong,0) > 0
+          AND cr.id IS NULL
+          {challenge_rewards.legacy_clause(db, "td.ma_nguoi_dung", "tt.ma_thu_thach", "DATE(tt.ngay_bat_dau)")}
+        ORDER BY td.ma_nguoi_dung, tt.ma_thu_thach
+    """), {"ids": ids, "tt": active}).mappings().all()
+    if not rows:
+        return 0
 
-        exist = db.execute(text("""
-            SELECT 1 FROM so_cai_diem
-            WHERE ma_nguoi_dung = :uid AND ly_do LIKE :mk LIMIT 1
-        """), {"uid": user_id, "mk": f"%{marker}%"}).first()
-
-        if exist:
-            continue
-
-        if diem > 0:
-            db.execute(text("""
-                INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
-                VALUES (:uid, :diem, :lydo, NOW())
-            """), {
-                "uid": user_id,
-                "diem": diem,
-                "lydo": f"Thưởng thử thách tuần {marker}",
-            })
-            count += 1
-
-    if count:
-        db.commit()
-    return count
\ No newline at end of file
+    return challenge_rewards.claim(db, [
+        {
+            "uid": int(r["ma_nguoi_dung"]),
+            "ma": int(r["ma_thu_thach"]),
+            "week": r["week_start"],
+            "diem": int(r["diem_thuong"] or 0),
+        }
+        for r in rows
+    ])
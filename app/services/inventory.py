@@ -0,0 +1,164 @@
+# app/services/inventory.py
+"""
+Tồn kho vé (sức chứa còn lại):
+- Mỗi sự kiện / trò chơi có tối đa 1 dòng trong ton_kho_ve(su_kien_id | tro_choi_id, suc_chua, con_lai).
+- Không có dòng => không giới hạn (giữ hành vi cũ).
+- Trò chơi không có suất / ngày: con_lai = sức chứa khu vực trừ vé đang giữ chỗ (GAME_HELD:
+  chưa hủy, chưa vào cổng). Vé trò chơi trả chỗ khi CHECKIN / USED (ticket_state) hoặc khi hủy,
+  nên trò chơi không "hết vé vĩnh viễn" sau suc_chua vé.
+  Tự seed lần đầu từ khu_vuc.suc_chua (nếu > 0) trừ vé đang giữ chỗ.
+- Trừ vé = 1 câu UPDATE có điều kiện `con_lai >= :n` trên khóa unique => chỉ khóa 1 dòng,
+  không COUNT(*) trên bảng ve, không khóa bảng.
+- Commit do caller (router) kiểm soát. Nên gọi reserve() NGAY TRƯỚC commit
+  để khóa dòng được giữ ngắn nhất có thể khi nhiều người cùng đặt 1 sự kiện.
+"""
+from sqlalchemy import text
+
+MIGRATION = "ton_kho_ve.game_held"
+
+# Trạng thái vé trò chơi còn chiếm chỗ
+GAME_HELD = ("BOOKED", "PENDING", "UNPAID", "PAID")
+
+
+def _key(su_kien_id: int | None, tro_choi_id: int | None):
+    if su_kien_id is not None:
+        return "su_kien_id", int(su_kien_id)
+    if tro_choi_id is not None:
+        return "tro_choi_id", int(tro_choi_id)
+    raise ValueError("Cần su_kien_id hoặc tro_choi_id")
+
+
+def _seed_game(db, tro_choi_id: int) -> bool:
+    # Sức chứa khu vực làm sức chứa trò chơi; con_lai trừ các vé đang giữ chỗ
+    res = db.execute(text("""
+        INSERT IGNORE INTO ton_kho_ve (tro_choi_id, suc_chua, con_lai, created_at, updated_at)
+        SELECT tc.id, kv.suc_chua,
+               GREATEST(0, kv.suc_chua - COALESCE((
+                   SELECT SUM(COALESCE(v.so_luong, 1)) FROM ve v
+                   WHERE v.tro_choi_id = tc.id AND v.trang_thai IN :held
+               ), 0)),
+               NOW(), NOW()
+        FROM tro_choi tc
+        JOIN khu_vuc kv ON kv.id = tc.khu_vuc_id
+        WHERE tc.id = :id AND COALESCE(kv.suc_chua, 0) > 0
+    """), {"id": tro_choi_id, "held": GAME_HELD})
+    return bool(res.rowcount)
+
+
+def _try_take(db, col: str, item_id: int, qty: int) -> bool:
+    res = db.execute(text(f"""
+        UPDATE ton_kho_ve
+        SET con_lai = con_lai - :n, updated_at = NOW()
+        WHERE {col} = :id AND con_lai >= :n
+    """), {"id": item_id, "n": qty})
+    return bool(res.rowcount)
+
+
+def _exists(db, col: str, item_id: int, current: bool = False) -> bool:
+    # current: đọc bản mới nhất (không theo snapshot) => thấy dòng transaction khác vừa seed
+    lock = " LOCK IN SHARE MODE" if current else ""
+    return db.execute(
+        text(f"SELECT 1 FROM ton_kho_ve WHERE {col} = :id LIMIT 1{lock}"), {"id": item_id}
+    ).first() is not None
+
+
+def reserve(db, qty: int, su_kien_id: int | None = None, tro_choi_id: int | None = None) -> bool:
+    """
+    Giữ `qty` chỗ. Trả về False nếu không đủ chỗ (caller rollback + báo lỗi).
+    Đường nhanh: đúng 1 câu UPDATE. Chỉ khi UPDATE không trúng dòng nào mới kiểm tra
+    dòng có tồn tại không (không có => không giới hạn) và seed cho trò chơi.
+    """
+    col, item_id = _key(su_kien_id, tro_choi_id)
+    qty = int(qty)
+    if _try_take(db, col, item_id, qty):
+        return True
+    if _exists(db, col, item_id):
+        return False
+    if col == "tro_choi_id":
+        seeded = _seed_game(db, item_id)
+        if _try_take(db, col, item_id, qty):
+            return True
+        # Thua race seed (INSERT IGNORE bỏ qua vì dòng vừa được tạo) => vẫn phải trừ trên dòng đó;
+        # UPDATE không trúng mà có dòng => hết chỗ. Không có dòng => không giới hạn.
+        return not (seeded or _exists(db, col, item_id, current=True))
+    return True
+
+
+def release(db, qty: int, su_kien_id: int | None = None, tro_choi_id: int | None = None) -> None:
+    """Hoàn `qty` chỗ khi vé bị hủy (vé trò chơi: cả khi vào cổng). Không vượt quá suc_chua."""
+    if su_kien_id is None and tro_choi_id is None:
+        return
+    col, item_id = _key(su_kien_id, tro_choi_id)
+    db.execute(text(f"""
+        UPDATE ton_kho_ve
+        SET con_lai = LEAST(suc_chua, con_lai + :n), updated_at = NOW()
+        WHERE {col} = :id
+    """), {"id": item_id, "n": int(qty)})
+
+
+def release_ticket(db, ve) -> None:
+    release(db, int(ve.so_luong or 1), su_kien_id=ve.su_kien_id, tro_choi_id=ve.tro_choi_id)
+
+
+def set_capacity(db, suc_chua: int, su_kien_id: int | None = None, tro_choi_id: int | None = None) -> dict:
+    """
+    ADMIN đặt sức chứa. con_lai tính lại một lần từ số vé đang giữ chỗ: sự kiện = vé chưa hủy,
+    trò chơi = GAME_HELD (thao tác quản trị hiếm, chấp nhận 1 lần SUM trên ve).
+    """
+    col, item_id = _key(su_kien_id, tro_choi_id)
+    if col == "tro_choi_id":
+        held, params = "trang_thai IN :held", {"id": item_id, "held": GAME_HELD}
+    else:
+        held, params = "trang_thai <> 'CANCELLED'", {"id": item_id}
+    sold = int(db.execute(text(f"""
+        SELECT COALESCE(SUM(so_luong), 0)
+        FROM ve
+        WHERE {col} = :id AND {held}
+    """), params).scalar() or 0)
+    suc_chua = max(0, int(suc_chua))
+    con_lai = max(0, suc_chua - sold)
+    db.execute(text(f"""
+        INSERT INTO ton_kho_ve ({col}, suc_chua, con_lai, created_at, updated_at)
+        VALUES (:id, :sc, :cl, NOW(), NOW())
+        ON DUPLICATE KEY UPDATE
+          suc_chua = VALUES(suc_chua),
+          con_lai = VALUES(con_lai),
+          updated_at = NOW()
+    """), {"id": item_id, "sc": suc_chua, "cl": con_lai})
+    return {col: item_id, "suc_chua": suc_chua, "con_lai": con_lai, "da_ban": sold}
+
+
+def get_stock(db, su_kien_id: int | None = None, tro_choi_id: int | None = None) -> dict | None:
+    col, item_id = _key(su_kien_id, tro_choi_id)
+    row = db.execute(
+        text(f"SELECT suc_chua, con_lai FROM ton_kho_ve WHERE {col} = :id"), {"id": item_id}
+    ).mappings().first()
+    if not row:
+        return None
+    return {col: item_id, "suc_chua": int(row["suc_chua"]), "con_lai": int(row["con_lai"])}
+
+
+# ---------- Migration ----------
+
+def migrate(db) -> dict:
+    """
+    Tính lại con_lai của các dòng trò chơi đã seed theo cách cũ (đếm trọn đời, không trừ vé đã bán):
+    con_lai = suc_chua - vé GAME_HELD. 1 câu UPDATE / trò chơi, chạy lại được.
+    """
+    out = {"games": 0}
+    ids = [int(r[0]) for r in db.execute(
+        text("SELECT tro_choi_id FROM ton_kho_ve WHERE tro_choi_id IS NOT NULL ORDER BY tro_choi_id")
+    ).all()]
+    db.rollback()
+    for tc_id in ids:
+        out["games"] += db.execute(text("""
+            UPDATE ton_kho_ve t
+            SET t.con_lai = GREATEST(0, t.suc_chua - COALESCE((
+                    SELECT SUM(COALESCE(v.so_luong, 1)) FROM ve v
+                    WHERE v.tro_choi_id = :id AND v.trang_thai IN :held
+                ), 0)),
+                t.updated_at = NOW()
+            WHERE t.tro_choi_id = :id
+        """), {"id": tc_id, "held": GAME_HELD}).rowcount or 0
+        db.commit()
+    return out
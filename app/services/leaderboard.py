@@ -0,0 +1,264 @@
+# app/services/leaderboard.py
+"""
+BXH toàn thời gian trong bộ nhớ process, cập nhật tăng dần.
+
+- Khóa xếp hạng (-điểm, -lượt chơi, user_id) trong RankIndex (app/rank_index.py):
+  cập nhật 1 user O(log n), top-N O(N), hạng của 1 user O(log n).
+- Nguồn: points_balance (diem + so_luot_choi), đã được cộng cùng transaction với sổ cái / outbox.
+  * Nạp toàn bộ 1 lần (và sau mỗi max_age giây để tự sửa nếu lỡ sót).
+  * Mỗi lần đọc (tối đa 1 lần / sync_interval): chỉ đọc các dòng có updated_at
+    >= lần đồng bộ trước - SYNC_OVERLAP (index ix_points_balance_updated), ghi đè giá trị tuyệt đối
+    => đọc lặp vô hại; SYNC_OVERLAP che các transaction commit chậm hơn thời điểm NOW() của chúng.
+- Mỗi worker uvicorn giữ 1 bản; không cần đồng bộ giữa các process.
+- Truy vấn DB (nạp / đồng bộ) chạy NGOÀI self._lock: nạp dựng bản mới rồi tráo vào, đồng bộ chỉ
+  giữ khóa lúc áp các dòng đã đọc. Mỗi lúc 1 thread làm mới (_refresh_lock); request khác đọc
+  bản hiện có, chỉ chờ khi chưa có bản nào.
+
+- migrate() (thêm points_balance.so_luot_choi + index updated_at, backfill lượt chơi từ bảng ve)
+  là 1 bước auto_migrate; ready() chỉ bật khi bước đó xong. Chạy được khi outbox đang rút:
+  mỗi lô khóa dòng points_balance của lô trước khi đếm vé, bỏ vé có VE_PAID còn chờ.
+  Chạy tay: python -m app.services.leaderboard --migrate
+Cấu hình .env: LEADERBOARD_SYNC_INTERVAL, LEADERBOARD_MAX_AGE, LEADERBOARD_SYNC_OVERLAP (giây)
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from ..rank_index import RankIndex
+from ..schema_registry import schema
+from . import auto_migrate, leaderboard_buckets, points
+
+MIGRATION = points.PLAYS_MIGRATION
+SYNC_OVERLAP = timedelta(seconds=float(os.getenv("LEADERBOARD_SYNC_OVERLAP", "30")))
+
+TIERS = (
+    (1000, "DIAMOND", "Kim cương"),
+    (500, "GOLD", "Vàng"),
+    (100, "SILVER", "Bạc"),
+    (0, "STANDARD", "Thường"),
+)
+
+
+def tier_of(diem: int) -> tuple[str, str]:
+    for nguong, code, label in TIERS:
+        if diem >= nguong:
+            return code, label
+    return TIERS[-1][1], TIERS[-1][2]
+
+
+def _key(uid: int, diem: int, plays: int) -> tuple:
+    return (-diem, -plays, uid)
+
+
+class Leaderboard:
+    def __init__(self, sync_interval: float = 1.0, max_age: float = 900.0):
+        self.sync_interval = sync_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()          # giữ ngắn: đọc / tráo / áp thay đổi vào index
+        self._refresh_lock = threading.Lock()  # 1 thread nạp / đồng bộ với DB tại 1 thời điểm
+        self._index: RankIndex | None = None
+        self._scores: dict[int, tuple[int, int]] = {}
+        self._synced_to = None      # giờ DB của lần đồng bộ gần nhất
+        self._synced_at = 0.0
+        self._loaded_at = 0.0
+        self._gen = 0               # tăng khi invalidate()
+        self._loaded_gen = 0
+        self.reloads = 0
+        self.syncs = 0
+        self.updates = 0
+
+    def ready(self, db) -> bool:
+        """Số dư đã backfill và lượt chơi đã dựng lại từ bảng ve chưa."""
+        return points.ready(db) and auto_migrate.done(db, MIGRATION)
+
+    def invalidate(self) -> None:
+        # Giữ bản cũ để đọc tiếp; lần đọc sau nạp lại
+        with self._lock:
+            self._gen += 1
+
+    def _set(self, uid: int, diem: int, plays: int) -> None:
+        old = self._scores.get(uid)
+        if old == (diem, plays):
+            return
+        if old is not None:
+            self._index.remove(_key(uid, *old))
+            del self._scores[uid]
+        # Giống BXH cũ: chỉ hiện ai có điểm > 0 hoặc có lượt chơi > 0
+        if diem > 0 or plays > 0:
+            self._index.add(_key(uid, diem, plays))
+            self._scores[uid] = (diem, plays)
+        self.updates += 1
+
+    def _reload(self, db) -> None:
+        with self._lock:
+            gen = self._gen
+        db_now = db.execute(text("SELECT NOW()")).scalar()
+        rows = db.execute(text("""
+            SELECT user_id, diem, so_luot_choi
+            FROM points_balance
+            WHERE diem > 0 OR so_luot_choi > 0
+        """)).all()
+        scores = {int(u): (int(d or 0), int(p or 0)) for u, d, p in rows}
+        index = RankIndex.from_sorted(sorted(_key(u, d, p) for u, (d, p) in scores.items()))
+        with self._lock:
+            self._index = index
+            self._scores = scores
+            self._synced_to = db_now
+            self._synced_at = self._loaded_at = time.monotonic()
+            self._loaded_gen = gen
+            self.reloads += 1
+
+    def _sync(self, db, since) -> None:
+        db_now = db.execute(text("SELECT NOW()")).scalar()
+        rows = db.execute(text("""
+            SELECT user_id, diem, so_luot_choi
+            FROM points_balance
+            WHERE updated_at >= :since
+        """), {"since": since - SYNC_OVERLAP}).all()
+        with self._lock:
+            for u, d, p in rows:
+                self._set(int(u), int(d or 0), int(p or 0))
+            self._synced_to = db_now
+            self._synced_at = time.monotonic()
+            self.syncs += 1
+
+    def _due(self) -> tuple[bool, bool, object]:
+        """(cần nạp lại, cần làm mới, mốc đồng bộ). Gọi khi giữ self._lock."""
+        now = time.monotonic()
+        stale = (
+            self._index is None
+            or self._loaded_gen != self._gen
+            or bool(self.max_age and now - self._loaded_at > self.max_age)
+        )
+        return stale, stale or now - self._synced_at >= self.sync_interval, self._synced_to
+
+    def _ensure(self, db) -> None:
+        with self._lock:
+            cold = self._index is None
+            _, due, _ = self._due()
+        if not due:
+            return
+        # Đang có thread khác làm mới: đọc bản hiện có (chưa có bản nào thì chờ)
+        if not self._refresh_lock.acquire(blocking=cold):
+            return
+        try:
+            with self._lock:
+                stale, due, since = self._due()
+            if stale:
+                self._reload(db)
+            elif due:
+                self._sync(db, since)
+        finally:
+            self._refresh_lock.release()
+
+    def top(self, db, n: int) -> list[tuple[int, int, int]]:
+        """[(user_id, diem, so_luot_choi)] theo thứ hạng."""
+        self._ensure(db)
+        with self._lock:
+            return [(uid, -d, -p) for d, p, uid in self._index.head(n)]
+
+    def rank_of(self, db, user_id: int) -> dict | None:
+        self._ensure(db)
+        with self._lock:
+            sc = self._scores.get(int(user_id))
+            if sc is None:
+                return None
+            return {
+                "rank": self._index.rank(_key(int(user_id), *sc)) + 1,
+                "diem": sc[0],
+                "so_luot_choi": sc[1],
+                "tong": len(self._index),
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self._index is not None,
+                "refreshing": self._refresh_lock.locked(),
+                "size": len(self._index) if self._index is not None else 0,
+                "synced_to": str(self._synced_to) if self._synced_to else None,
+                "reloads": self.reloads,
+                "syncs": self.syncs,
+                "updates": self.updates,
+            }
+
+
+board = Leaderboard(
+    sync_interval=float(os.getenv("LEADERBOARD_SYNC_INTERVAL", "1.0")),
+    max_age=float(os.getenv("LEADERBOARD_MAX_AGE", "900")),
+)
+
+
+# ---------- Migration ----------
+def migrate(db, chunk: int = 5000) -> dict:
+    """Chạy lại được (backfill ghi đè so_luot_choi bằng số đếm từ bảng ve)."""
+    out = {"altered": False, "backfilled": 0}
+    cols = {r[0].lower() for r in db.execute(text("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'points_balance'
+    """)).all()}
+    if "so_luot_choi" not in cols:
+        db.execute(text("""
+            ALTER TABLE points_balance
+              ADD COLUMN so_luot_choi INT NOT NULL DEFAULT 0,
+              ADD INDEX ix_points_balance_updated (updated_at)
+        """))
+        out["altered"] = True
+    db.commit()
+    schema.refresh(db)
+
+    hi = int(db.execute(text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar() or 0)
+    db.commit()
+    lo = 1
+    while lo <= hi:
+        p = {"lo": lo, "hi": lo + chunk - 1}
+        # Khóa trước (cả khoảng trống): outbox muốn cộng lượt cho user trong lô phải chờ commit này.
+        # Đếm sau đó bằng đọc snapshot: vé mà worker đã cộng thì đã thấy, vé còn chờ thì bỏ qua.
+        db.execute(text("""
+            SELECT user_id FROM points_balance WHERE user_id BETWEEN :lo AND :hi FOR UPDATE
+        """), p)
+        rows = db.execute(text(f"""
+            SELECT v.user_id, SUM(COALESCE(v.so_luong, 1))
+            FROM ve v
+            WHERE v.tro_choi_id IS NOT NULL
+              AND v.trang_thai IN ({leaderboard_buckets.PLAYED})
+              AND v.user_id BETWEEN :lo AND :hi
+              AND {leaderboard_buckets.NOT_QUEUED}
+            GROUP BY v.user_id
+        """), p).all()
+        if rows:
+            db.execute(text("""
+                INSERT INTO points_balance (user_id, diem, so_luot_choi, updated_at)
+                VALUES (:uid, 0, :n, NOW())
+                ON DUPLICATE KEY UPDATE so_luot_choi = VALUES(so_luot_choi), updated_at = NOW()
+            """), [{"uid": int(u), "n": int(n)} for u, n in rows])
+            out["backfilled"] += len(rows)
+        db.commit()
+        lo += chunk
+    board.invalidate()
+    return out
+
+
+def main():
+    import argparse
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate", action="store_true")
+    ap.add_argument("--chunk", type=int, default=5000)
+    args = ap.parse_args()
+    if not args.migrate:
+        ap.print_help()
+        return
+    db = SessionLocal()
+    try:
+        print(migrate(db, chunk=args.chunk))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
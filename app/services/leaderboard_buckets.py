@@ -0,0 +1,316 @@
+# app/services/leaderboard_buckets.py
+"""
+Điểm + lượt chơi gộp theo ngày (và tháng) cho BXH tuần / tháng / khoảng tùy chọn.
+
+- points.add / add_select cộng vào dòng (user, 'D', CURDATE()) cùng transaction với sổ cái
+  (lượt chơi đi kèm VE_PAID qua outbox) => không quét so_cai_diem / ve khi xem BXH.
+- BXH khoảng [từ, đến]: SUM theo user trên index (ky, ngay, ...):
+    tuần = 7 dòng 'D' / user, tháng hiện tại <= 31 dòng 'D' / user.
+- compact(): dòng 'D' trước mốc cutoff (ngày 1 của tháng chứa hôm nay - KEEP_DAYS) gộp thành 1 dòng 'M'
+  / user / tháng, cả tháng trong 1 transaction => mỗi tháng chỉ ở 1 dạng.
+  Khoảng chạm vào phần đã gộp được nới ra trọn tháng (trả về khoảng thực tế).
+  Chỉ nên TĂNG KEEP_DAYS khi đã chạy lại migrate (dựng lại từ sổ cái).
+
+- compact_once() chạy dưới GET_LOCK (mỗi worker có 1 compactor, chỉ 1 nơi gộp tại 1 thời điểm)
+  và chỉ khi bảng đã dựng lại xong.
+- Bảng mới (create_all tạo rỗng): auto_migrate chạy migrate() 1 lần lúc khởi động. Ghi vẫn cộng
+  vào bảng ngay khi có bảng, nhưng enabled() (đọc BXH tuần / tháng / khoảng) chỉ bật khi bước
+  dựng lại đã xong; trước đó router dùng đường cũ.
+  migrate() chạy được khi outbox đang rút: mỗi lô user khóa dòng của lô trước khi đọc sổ cái / vé,
+  bỏ vé có VE_PAID còn chờ (worker cộng sau) => không đếm trùng.
+Dựng lại tay: python -m app.services.leaderboard_buckets --migrate
+  (xóa + dựng lại từ so_cai_diem và vé trò chơi đã thanh toán, rồi compact).
+Cấu hình .env: LEADERBOARD_KEEP_DAYS, LEADERBOARD_COMPACT (1/0), LEADERBOARD_COMPACT_INTERVAL (giây)
+"""
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from ..db import SessionLocal, locked_session
+from ..models import LeaderboardBucket
+from ..schema_registry import schema
+from . import auto_migrate
+
+DAY = "D"
+MONTH = "M"
+KEEP_DAYS = int(os.getenv("LEADERBOARD_KEEP_DAYS", "62"))
+MIGRATION = "leaderboard_buckets.rebuild"
+COMPACT_LOCK = "trungtamgiaitri.leaderboard_compact"
+
+# Vé trò chơi tính là 1 lượt chơi (outbox cộng lúc PAID; CHECKIN / USED vẫn giữ lượt đã tính)
+PLAYED = "'PAID', 'CHECKIN', 'USED'"
+# Dựng lại từ bảng ve: bỏ vé có VE_PAID còn chờ trong outbox (worker sẽ tự cộng khi rút)
+NOT_QUEUED = """
+    NOT EXISTS (
+        SELECT 1 FROM outbox o
+        WHERE o.processed_at IS NULL AND o.loai = 'VE_PAID'
+          AND CAST(JSON_UNQUOTE(JSON_EXTRACT(o.payload, '$.ve_id')) AS UNSIGNED) = v.id
+    )
+"""
+
+_stats = {"runs": 0, "months": 0, "rows": 0, "errors": 0, "last_run_at": None, "skipped_locked": 0}
+_stats_lock = threading.Lock()
+
+
+def enabled(db) -> bool:
+    """Đọc BXH theo kỳ được chưa: bảng đã dựng lại từ sổ cái (không chỉ mới được tạo rỗng)."""
+    return auto_migrate.done(db, MIGRATION)
+
+
+def _writable(db) -> bool:
+    return schema.has_table(db, "leaderboard_buckets")
+
+
+def record(db, deltas) -> None:
+    """deltas: [(uid, điểm, lượt chơi)] đã sắp theo uid. KHÔNG commit."""
+    rows = [{"uid": int(u), "d": int(d), "p": int(p)} for u, d, p in deltas if d or p]
+    if not rows or not _writable(db):
+        return
+    db.execute(text("""
+        INSERT INTO leaderboard_buckets (user_id, ky, ngay, diem, so_luot_choi)
+        VALUES (:uid, 'D', CURDATE(), :d, :p)
+        ON DUPLICATE KEY UPDATE
+          diem = diem + VALUES(diem), so_luot_choi = so_luot_choi + VALUES(so_luot_choi)
+    """), rows)
+
+
+def record_select(db, select_sql: str, params: dict) -> None:
+    """Bản set-based: select_sql trả về (uid, diem, ...) như points.add_select. KHÔNG commit."""
+    if not _writable(db):
+        return
+    db.execute(text(f"""
+        INSERT INTO leaderboard_buckets (user_id, ky, ngay, diem, so_luot_choi)
+        SELECT x.uid, 'D', CURDATE(), SUM(x.diem), 0
+        FROM ({select_sql}) x
+        GROUP BY x.uid
+        ORDER BY x.uid
+        ON DUPLICATE KEY UPDATE diem = leaderboard_buckets.diem + VALUES(diem)
+    """), params)
+
+
+# ---------- Khoảng ngày ----------
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def month_end(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def cutoff(today: date) -> date:
+    """Ngày đầu tiên còn giữ dòng 'D'; trước đó chỉ còn dòng 'M'."""
+    return month_start(today - timedelta(days=KEEP_DAYS))
+
+
+def window(d_from: date, d_to: date, today: date) -> tuple[date, date]:
+    """Khoảng thực tế đọc được: phần rơi vào vùng đã gộp được nới ra trọn tháng."""
+    cut = cutoff(today)
+    a = d_from if d_from >= cut else month_start(d_from)
+    b = d_to if d_to >= cut else month_end(d_to)
+    return a, b
+
+
+def db_today(db) -> date:
+    return db.execute(text("SELECT CURDATE()")).scalar()
+
+
+def top(db, d_from: date, d_to: date, n: int, today: date | None = None) -> dict:
+    """{"tu_ngay", "den_ngay", "rows": [(user_id, diem, so_luot_choi)]} theo thứ hạng."""
+    a, b = window(d_from, d_to, today or db_today(db))
+    rows = db.execute(text("""
+        SELECT b.user_id, SUM(b.diem) AS diem, SUM(b.so_luot_choi) AS so_luot_choi
+        FROM leaderboard_buckets b
+        WHERE (b.ky = 'D' AND b.ngay BETWEEN :a AND :b)
+           OR (b.ky = 'M' AND b.ngay BETWEEN :ma AND :b)
+        GROUP BY b.user_id
+        HAVING SUM(b.diem) > 0 OR SUM(b.so_luot_choi) > 0
+        ORDER BY diem DESC, so_luot_choi DESC, b.user_id ASC
+        LIMIT :n
+    """), {"a": a, "b": b, "ma": month_start(a), "n": n}).all()
+    return {
+        "tu_ngay": a,
+        "den_ngay": b,
+        "rows": [(int(u), int(d or 0), int(p or 0)) for u, d, p in rows],
+    }
+
+
+# ---------- Gộp ngày -> tháng ----------
+def compact(db, today: date | None = None) -> dict:
+    """Gộp từng tháng (cũ trước), 1 commit / tháng. Chạy lại được."""
+    cut = cutoff(today or db_today(db))
+    months = [r[0] for r in db.execute(text("""
+        SELECT DISTINCT ngay - INTERVAL (DAY(ngay) - 1) DAY
+        FROM leaderboard_buckets
+        WHERE ky = 'D' AND ngay < :cut
+        ORDER BY 1
+    """), {"cut": cut}).all()]
+    db.rollback()
+    out = {"months": 0, "rows": 0}
+    for m in months:
+        p = {"m": m, "e": month_end(m)}
+        db.execute(text("""
+            INSERT INTO leaderboard_buckets (user_id, ky, ngay, diem, so_luot_choi)
+            SELECT user_id, 'M', :m, SUM(diem), SUM(so_luot_choi)
+            FROM leaderboard_buckets
+            WHERE ky = 'D' AND ngay BETWEEN :m AND :e
+            GROUP BY user_id
+            ORDER BY user_id
+            ON DUPLICATE KEY UPDATE
+              diem = leaderboard_buckets.diem + VALUES(diem),
+              so_luot_choi = leaderboard_buckets.so_luot_choi + VALUES(so_luot_choi)
+        """), p)
+        out["rows"] += db.execute(text("""
+            DELETE FROM leaderboard_buckets WHERE ky = 'D' AND ngay BETWEEN :m AND :e
+        """), p).rowcount or 0
+        db.commit()
+        out["months"] += 1
+    return out
+
+
+def compact_once() -> dict | None:
+    """compact dưới GET_LOCK; process khác đang gộp hoặc bảng chưa dựng lại xong => None."""
+    with locked_session(COMPACT_LOCK) as db:
+        if db is None:
+            with _stats_lock:
+                _stats["skipped_locked"] += 1
+            return None
+        if not enabled(db):
+            return None
+        try:
+            out = compact(db)
+        except Exception:
+            db.rollback()
+            with _stats_lock:
+                _stats["errors"] += 1
+            raise
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["months"] += out["months"]
+        _stats["rows"] += out["rows"]
+        _stats["last_run_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return out
+
+
+def metrics() -> dict:
+    with _stats_lock:
+        out = dict(_stats)
+    out["keep_days"] = KEEP_DAYS
+    out["running"] = compactor.running
+    return out
+
+
+class BucketCompactor:
+    def __init__(self, interval: float = 21600.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-compact", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                compact_once()
+            except Exception:
+                pass  # đã ghi vào _stats["errors"]
+            self._stop.wait(self.interval)
+
+
+compactor = BucketCompactor(interval=float(os.getenv("LEADERBOARD_COMPACT_INTERVAL", "21600")))
+
+
+# ---------- Dựng lại từ sổ cái ----------
+def migrate(db, chunk: int = 5000) -> dict:
+    """Tạo bảng (nếu thiếu), xóa + dựng lại dòng 'D' theo lô user, rồi compact."""
+    LeaderboardBucket.__table__.create(bind=db.get_bind(), checkfirst=True)
+    schema.refresh(db)
+    out = {"points": 0, "plays": 0}
+    db.execute(text("DELETE FROM leaderboard_buckets"))
+    db.commit()
+
+    paid_at = "COALESCE(v.paid_at, v.updated_at)" if schema.has(db, "ve", "paid_at") else "v.updated_at"
+    hi = int(db.execute(text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar() or 0)
+    db.commit()
+    lo = 1
+    while lo <= hi:
+        p = {"lo": lo, "hi": lo + chunk - 1}
+        # Khóa dòng (cả khoảng trống) của lô trước: points.add cho user trong lô chờ commit này.
+        # Đọc sổ cái / vé sau đó (snapshot, không khóa): thấy mọi lần ghi đã commit, bỏ vé còn chờ outbox.
+        db.execute(text("""
+            SELECT user_id FROM leaderboard_buckets WHERE user_id BETWEEN :lo AND :hi FOR UPDATE
+        """), p)
+        cells: dict[tuple[int, date], list[int]] = {}
+        for u, d, n in db.execute(text("""
+            SELECT s.ma_nguoi_dung, DATE(s.thoi_gian), SUM(s.diem_thay_doi)
+            FROM so_cai_diem s
+            WHERE s.ma_nguoi_dung BETWEEN :lo AND :hi
+            GROUP BY s.ma_nguoi_dung, DATE(s.thoi_gian)
+        """), p).all():
+            cells.setdefault((int(u), d), [0, 0])[0] = int(n or 0)
+        for u, d, n in db.execute(text(f"""
+            SELECT v.user_id, DATE({paid_at}), SUM(COALESCE(v.so_luong, 1))
+            FROM ve v
+            WHERE v.tro_choi_id IS NOT NULL
+              AND v.trang_thai IN ({PLAYED})
+              AND v.user_id BETWEEN :lo AND :hi
+              AND {NOT_QUEUED}
+            GROUP BY v.user_id, DATE({paid_at})
+        """), p).all():
+            cells.setdefault((int(u), d), [0, 0])[1] = int(n or 0)
+        if cells:
+            # Ghi đè (không cộng): trùng với ghi trực tiếp hôm nay vẫn ra đúng tổng
+            db.execute(text("""
+                INSERT INTO leaderboard_buckets (user_id, ky, ngay, diem, so_luot_choi)
+                VALUES (:uid, 'D', :d, :diem, :p)
+                ON DUPLICATE KEY UPDATE diem = VALUES(diem), so_luot_choi = VALUES(so_luot_choi)
+            """), [
+                {"uid": u, "d": d, "diem": diem, "p": plays}
+                for (u, d), (diem, plays) in sorted(cells.items())
+            ])
+            out["points"] += sum(1 for c in cells.values() if c[0])
+            out["plays"] += sum(1 for c in cells.values() if c[1])
+        db.commit()
+        lo += chunk
+    out["compact"] = compact(db)
+    return out
+
+
+def main():
+    import argparse
+    import json
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate", action="store_true", help="dựng lại toàn bộ từ sổ cái + vé")
+    ap.add_argument("--compact", action="store_true")
+    ap.add_argument("--chunk", type=int, default=5000)
+    args = ap.parse_args()
+    if not (args.migrate or args.compact):
+        ap.print_help()
+        return
+    db = SessionLocal()
+    try:
+        out = migrate(db, chunk=args.chunk) if args.migrate else compact(db)
+        print(json.dumps(out, ensure_ascii=False, indent=2, default=str))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# app/services/momo_client.py
+"""
+Client MoMo bất đồng bộ dùng chung cho cả process:
+- 1 httpx.AsyncClient giữ kết nối keep-alive (pool giới hạn)
+- Semaphore giới hạn số request đồng thời tới cổng thanh toán
+- Deadline tổng cho mỗi lần gọi (gồm cả retry)
+- Retry có jitter: lỗi kết nối (request chưa gửi đi) thì tạo lại ngay; lỗi sau khi đã gửi
+  (ReadTimeout, 5xx, JSON hỏng) thì hỏi trạng thái orderId trước, MoMo đã nhận => không tạo lại
+- Circuit breaker: lỗi liên tiếp vượt ngưỡng => từ chối ngay trong `cooldown` giây,
+  hết cooldown chỉ cho 1 request thử (HALF_OPEN)
+
+Cấu hình qua .env:
+  MOMO_CREATE_ENDPOINT, MOMO_QUERY_ENDPOINT (mặc định sandbox; trỏ sang stub local khi load test)
+  MOMO_MAX_CONCURRENCY, MOMO_TIMEOUT, MOMO_DEADLINE, MOMO_RETRIES,
+  MOMO_BREAKER_THRESHOLD, MOMO_BREAKER_COOLDOWN
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import time
+
+import httpx
+
+MOMO_CREATE_ENDPOINT = os.getenv(
+    "MOMO_CREATE_ENDPOINT", "https://test-payment.momo.vn/v2/gateway/api/create"
+)
+MOMO_QUERY_ENDPOINT = os.getenv(
+    "MOMO_QUERY_ENDPOINT", "https://test-payment.momo.vn/v2/gateway/api/query"
+)
+
+# resultCode của API query khi orderId chưa từng được tạo
+_ORDER_NOT_FOUND = (42,)
+
+
+def momo_sign_create(payload: dict, secret_key: str) -> str:
+    """
+    Ký theo đúng thứ tự tham số create (MoMo v2):
+    accessKey&amount&extraData&ipnUrl&orderId&orderInfo&partnerCode&
+    redirectUrl&requestId&requestType
+    """
+    keys = [
+        "accessKey",
+        "amount",
+        "extraData",
+        "ipnUrl",
+        "orderId",
+        "orderInfo",
+        "partnerCode",
+        "redirectUrl",
+        "requestId",
+        "requestType",
+    ]
+    raw = "&".join(f"{k}={payload.get(k,'')}" for k in keys)
+    return hmac.new(secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()
+
+
+def momo_sign_query(payload: dict, secret_key: str) -> str:
+    """Ký API query trạng thái: accessKey&orderId&partnerCode&requestId"""
+    keys = ["accessKey", "orderId", "partnerCode", "requestId"]
+    raw = "&".join(f"{k}={payload.get(k,'')}" for k in keys)
+    return hmac.new(secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()
+
+
+def momo_sign_ipn(payload: dict, secret_key: str) -> str:
+    """
+    Ký xác minh IPN/callback. Sandbox có thể thay đổi danh sách trường;
+    phần này dùng bộ tham số phổ biến, nếu thiếu trường sẽ bỏ qua kiểm tra.
+    """
+    keys = [
+        "accessKey",
+        "amount",
+        "extraData",
+        "message",
+        "orderId",
+        "orderInfo",
+        "orderType",
+        "partnerCode",
+        "payType",
+        "requestId",
+        "responseTime",
+        "resultCode",
+        "transId",
+    ]
+    raw = "&".join(f"{k}={payload.get(k,'')}" for k in keys)
+    return hmac.new(secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()
+
+
+class MomoUnavailable(Exception):
+    """Cổng MoMo lỗi / quá hạn / breaker đang mở."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probe_at: float | None = None   # request thử đang chạy (HALF_OPEN)
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "CLOSED"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "HALF_OPEN"
+        return "OPEN"
+
+    def allow(self) -> bool:
+        # HALF_OPEN: chỉ 1 request thử đi qua; thành công => đóng, lỗi => mở lại.
+        # Request thử bị treo / hủy quá cooldown thì cho request khác thử.
+        state = self.state
+        if state == "CLOSED":
+            return True
+        if state == "OPEN":
+            return False
+        now = time.monotonic()
+        if self._probe_at is not None and now - self._probe_at < self.cooldown:
+            return False
+        self._probe_at = now
+        return True
+
+    def release(self) -> None:
+        """Request thử kết thúc mà không có kết quả (bị hủy)."""
+        self._probe_at = None
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold or self.state == "HALF_OPEN":
+            self.opened_at = time.monotonic()
+        self._probe_at = None
+
+
+class MomoClient:
+    def __init__(
+        self,
+        endpoint: str = MOMO_CREATE_ENDPOINT,
+        query_endpoint: str = MOMO_QUERY_ENDPOINT,
+        max_concurrency: int = 20,
+        timeout: float = 5.0,
+        deadline: float = 8.0,
+        retries: int = 2,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.endpoint = endpoint
+        self.query_endpoint = query_endpoint
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self._max_concurrency = max_concurrency
+        self._sem: asyncio.Semaphore | None = None
+        self._client: httpx.AsyncClient | None = None
+
+    def _ensure(self) -> httpx.AsyncClient:
+        # Tạo lười trong event loop đang chạy (uvicorn)
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self._max_concurrency,
+                    max_keepalive_connections=self._max_concurrency,
+                    keepalive_expiry=60,
+                ),
+            )
+            self._sem = asyncio.Semaphore(self._max_concurrency)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._sem = None
+
+    async def _order_exists(self, client: httpx.AsyncClient, query: dict) -> bool:
+        """MoMo đã nhận orderId chưa. Không hỏi được => coi như đã nhận (không tạo lại)."""
+        try:
+            async with self._sem:
+                res = await client.post(self.query_endpoint, json=query)
+            return int(res.json().get("resultCode", -1)) not in _ORDER_NOT_FOUND
+        except (httpx.TransportError, ValueError, TypeError):
+            return True
+
+    async def _post_with_retry(self, payload: dict, query: dict | None) -> dict:
+        client = self._ensure()
+        last_exc: Exception | None = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # exponential backoff + full jitter
+                await asyncio.sleep(random.uniform(0, 0.2 * (2 ** attempt)))
+            try:
+                async with self._sem:
+                    res = await client.post(self.endpoint, json=payload)
+                if res.status_code < 500:
+                    return res.json()
+                last_exc = MomoUnavailable(f"HTTP {res.status_code}")
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Request chưa tới MoMo => tạo lại cùng orderId an toàn
+                last_exc = e
+                continue
+            except (httpx.TransportError, ValueError) as e:
+                last_exc = e
+            # MoMo có thể đã tạo lệnh (ReadTimeout, 5xx sau khi xử lý, ...):
+            # tạo lại cùng orderId sẽ bị từ chối trùng => hỏi trạng thái trước
+            if query is None or await self._order_exists(client, query):
+                break
+        raise MomoUnavailable(str(last_exc) if last_exc else "Lỗi không xác định")
+
+    async def create(self, payload: dict, query: dict | None = None) -> dict:
+        """
+        Gọi API create của MoMo. Trả về JSON của MoMo;
+        ném MomoUnavailable nếu breaker mở, quá deadline hoặc hết lượt retry.
+        query: payload API query (đã ký) cùng orderId, dùng để kiểm tra trước khi tạo lại;
+        không truyền => chỉ tạo lại khi request chưa gửi đi được.
+        """
+        if not self.breaker.allow():
+            raise MomoUnavailable("MoMo đang gián đoạn, vui lòng thử lại sau")
+        try:
+            data = await asyncio.wait_for(self._post_with_retry(payload, query), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise MomoUnavailable(f"Quá thời gian chờ MoMo ({self.deadline}s)")
+        except MomoUnavailable:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Request bị hủy giữa chừng: nhả lượt thử HALF_OPEN, không tính lỗi
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return data
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "breaker": self.breaker.state,
+            "failures": self.breaker.failures,
+        }
+
+
+def _env_num(name: str, default, cast=float):
+    try:
+        return cast(os.getenv(name, default))
+    except Exception:
+        return default
+
+
+momo_client = MomoClient(
+    max_concurrency=_env_num("MOMO_MAX_CONCURRENCY", 20, int),
+    timeout=_env_num("MOMO_TIMEOUT", 5.0),
+    deadline=_env_num("MOMO_DEADLINE", 8.0),
+    retries=_env_num("MOMO_RETRIES", 2, int),
+    breaker=CircuitBreaker(
+        threshold=_env_num("MOMO_BREAKER_THRESHOLD", 5, int),
+        cooldown=_env_num("MOMO_BREAKER_COOLDOWN", 30.0),
+    ),
+)
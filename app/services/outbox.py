@@ -0,0 +1,352 @@
+# app/services/outbox.py
+"""
+Transactional outbox cho tác vụ phụ sau sự kiện nghiệp vụ:
+  VE_PAID (vé chuyển PAID), GAME_PLAYED (thêm dòng lich_su_choi),
+  EVENT_ATTENDED (vé sự kiện CHECKIN / USED).
+
+- Router (review_payment / momo_ipn / ops approve) chỉ ghi 1 dòng `outbox`
+  trong CÙNG transaction với việc đổi trạng thái vé => không mất, không chạy nửa chừng.
+  lich_su_choi: listener after_insert ghi outbox trong cùng flush.
+- Worker nền rút outbox theo lô (FOR UPDATE SKIP LOCKED => chạy được nhiều process):
+    * executemany INSERT so_cai_diem cho cả lô (+ points_balance: điểm và lượt chơi, services/points.py)
+    * đổi sự kiện thành quan sát chỉ số rồi ghi tiến độ thử thách theo lô
+      (services/challenge_progress.py)
+    * thưởng thử thách cho các user trong lô (set-based) nếu job thưởng định kỳ không chạy
+    * đánh dấu processed_at, 1 commit / lô
+- Lô lỗi => xử lý lại từng dòng để cô lập dòng hỏng; dòng lỗi quá MAX_ATTEMPTS bị bỏ qua.
+- Dòng đã xử lý giữ RETENTION_DAYS ngày rồi bị xóa theo lô (purge_once, worker gọi mỗi
+  PURGE_INTERVAL giây dưới GET_LOCK => chỉ 1 process xóa); dòng hỏng (chưa processed) giữ lại.
+- metrics(): độ sâu hàng đợi, độ trễ (giây) của dòng cũ nhất, số dòng hỏng + bộ đếm của worker.
+
+Cấu hình .env: OUTBOX_WORKER (1/0), OUTBOX_BATCH, OUTBOX_INTERVAL,
+  OUTBOX_RETENTION_DAYS (0 = không xóa), OUTBOX_PURGE_INTERVAL (giây), OUTBOX_PURGE_BATCH
+"""
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import event, text
+
+from ..db import SessionLocal, locked_session
+from ..models import LichSuChoi
+from . import challenge_progress, points
+from .challenge_reward_job import reward_job
+from .gamification import reward_if_reached_bulk
+
+TICKET_PAID = "VE_PAID"
+GAME_PLAYED = "GAME_PLAYED"
+EVENT_ATTENDED = "EVENT_ATTENDED"
+MAX_ATTEMPTS = 5
+POINT_UNIT = 5000  # 1 điểm / 5.000đ chi tiêu
+RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+PURGE_BATCH = int(os.getenv("OUTBOX_PURGE_BATCH", "5000"))
+PURGE_LOCK = "trungtamgiaitri.outbox_purge"
+
+_stats = {
+    "processed": 0,
+    "batches": 0,
+    "errors": 0,
+    "last_batch_size": 0,
+    "last_batch_ms": 0.0,
+    "last_run_at": None,
+    "purged": 0,
+    "last_purge_at": None,
+}
+_stats_lock = threading.Lock()
+
+
+def enqueue(db, loai: str, payload: dict) -> None:
+    """Ghi 1 sự kiện outbox. KHÔNG commit: phải nằm chung transaction với thay đổi nghiệp vụ."""
+    db.execute(
+        text("INSERT INTO outbox (loai, payload, created_at, attempts) VALUES (:l, :p, NOW(), 0)"),
+        {"l": loai, "p": json.dumps(payload, ensure_ascii=False)},
+    )
+
+
+def _ticket_paid_payload(ve, nguon: str) -> dict:
+    return {
+        "ve_id": int(ve.id),
+        "user_id": int(ve.user_id),
+        "tong_tien": int(ve.tong_tien or 0),
+        "so_luong": int(ve.so_luong or 1),
+        "tro_choi_id": ve.tro_choi_id,
+        "nguon": nguon,
+    }
+
+
+def enqueue_ticket_paid(db, ve, nguon: str = "STAFF") -> None:
+    enqueue(db, TICKET_PAID, _ticket_paid_payload(ve, nguon))
+
+
+def enqueue_tickets_paid(db, tickets, nguon: str = "STAFF") -> None:
+    """Nhiều vé cùng lúc: 1 executemany INSERT vào outbox."""
+    params = [
+        {"l": TICKET_PAID, "p": json.dumps(_ticket_paid_payload(v, nguon), ensure_ascii=False)}
+        for v in tickets
+    ]
+    if params:
+        db.execute(
+            text("INSERT INTO outbox (loai, payload, created_at, attempts) VALUES (:l, :p, NOW(), 0)"),
+            params,
+        )
+
+
+def enqueue_events_attended(db, tickets) -> None:
+    """Vé sự kiện vừa CHECKIN / USED (đã lọc ở ticket_state): 1 executemany."""
+    params = [
+        {"l": EVENT_ATTENDED, "p": json.dumps(
+            {"ve_id": int(v.id), "user_id": int(v.user_id), "su_kien_id": v.su_kien_id},
+            ensure_ascii=False,
+        )}
+        for v in tickets
+    ]
+    if params:
+        db.execute(
+            text("INSERT INTO outbox (loai, payload, created_at, attempts) VALUES (:l, :p, NOW(), 0)"),
+            params,
+        )
+
+
+@event.listens_for(LichSuChoi, "after_insert")
+def _on_game_played(mapper, connection, target) -> None:
+    # Cùng connection / transaction với flush => lượt chơi và sự kiện outbox cùng commit hoặc cùng rollback
+    connection.execute(
+        text("INSERT INTO outbox (loai, payload, created_at, attempts) VALUES (:l, :p, NOW(), 0)"),
+        {"l": GAME_PLAYED, "p": json.dumps({
+            "lich_su_id": target.id,
+            "khach_hang_id": target.khach_hang_id,
+            "tro_choi_id": target.tro_choi_id,
+        })},
+    )
+
+
+def _owners(db, khach_hang_ids) -> dict[int, int]:
+    ids = tuple(sorted({int(i) for i in khach_hang_ids if i is not None}))
+    if not ids:
+        return {}
+    return {
+        int(kh): int(uid)
+        for kh, uid in db.execute(
+            text("SELECT id, user_id FROM khach_hang WHERE id IN :ids AND user_id IS NOT NULL"),
+            {"ids": ids},
+        ).all()
+    }
+
+
+def _ledger_reason(p: dict, diem: int) -> str:
+    so_tien = int(p.get("tong_tien") or 0)
+    src = "MoMo, " if p.get("nguon") == "MoMo" else ""
+    return f"Cộng {diem} điểm từ chi tiêu {so_tien:,}đ ({src}vé #{p.get('ve_id')})"
+
+
+def _apply(db, rows) -> None:
+    ledger, obs, plays, paid_plays = [], [], [], {}
+    for r in rows:
+        p = json.loads(r["payload"])
+        if r["loai"] == TICKET_PAID:
+            uid = int(p["user_id"])
+            diem = int(int(p.get("tong_tien") or 0) / POINT_UNIT)
+            if diem > 0:
+                ledger.append({"uid": uid, "diem": diem, "lydo": _ledger_reason(p, diem)})
+            obs.extend(challenge_progress.ticket_paid(p))
+            if p.get("tro_choi_id") is not None:
+                paid_plays[uid] = paid_plays.get(uid, 0) + int(p.get("so_luong") or 1)
+        elif r["loai"] == GAME_PLAYED:
+            plays.append(p)
+        elif r["loai"] == EVENT_ATTENDED:
+            obs.extend(challenge_progress.event_attended(p["user_id"]))
+
+    if plays:
+        owners = _owners(db, (p.get("khach_hang_id") for p in plays))
+        for p in plays:
+            uid = owners.get(int(p["khach_hang_id"])) if p.get("khach_hang_id") is not None else None
+            if uid is not None:  # khách vãng lai (không có tài khoản) => bỏ qua
+                obs.extend(challenge_progress.game_played(uid, p.get("tro_choi_id")))
+
+    if ledger or paid_plays:
+        points.add(db, ledger, plays=paid_plays)
+    if obs:
+        challenge_progress.record(db, obs)
+        # Job định kỳ đang chạy thì để nó thưởng set-based; không thì thưởng ngay trong lô
+        if not reward_job.running:
+            reward_if_reached_bulk(db, {o[0] for o in obs})
+
+    db.execute(
+        text("UPDATE outbox SET processed_at = NOW() WHERE id IN :ids"),
+        {"ids": tuple(int(r["id"]) for r in rows)},
+    )
+
+
+def _claim(db, batch_size: int, only_id: int | None = None):
+    where = "AND id = :id" if only_id is not None else ""
+    return db.execute(
+        text(f"""
+            SELECT id, loai, payload
+            FROM outbox
+            WHERE processed_at IS NULL AND attempts < :max {where}
+            ORDER BY id
+            LIMIT :n
+            FOR UPDATE SKIP LOCKED
+        """),
+        {"max": MAX_ATTEMPTS, "n": batch_size, "id": only_id},
+    ).mappings().all()
+
+
+def _mark_failed(db, ids, err: str) -> None:
+    db.execute(
+        text("UPDATE outbox SET attempts = attempts + 1, last_error = :e WHERE id IN :ids"),
+        {"ids": tuple(ids), "e": err[:2000]},
+    )
+    db.commit()
+
+
+def drain_once(db, batch_size: int = 500) -> int:
+    """Xử lý tối đa 1 lô. Trả về số dòng đã xử lý thành công."""
+    t0 = time.perf_counter()
+    rows = _claim(db, batch_size)
+    if not rows:
+        db.rollback()
+        return 0
+
+    ids = [int(r["id"]) for r in rows]
+    done = 0
+    try:
+        _apply(db, rows)
+        db.commit()
+        done = len(rows)
+    except Exception:
+        db.rollback()
+        # Cô lập dòng hỏng: thử lại từng dòng một
+        for oid in ids:
+            try:
+                one = _claim(db, 1, only_id=oid)
+                if not one:
+                    db.rollback()
+                    continue
+                _apply(db, one)
+                db.commit()
+                done += 1
+            except Exception as e:
+                db.rollback()
+                _mark_failed(db, [oid], str(e))
+                with _stats_lock:
+                    _stats["errors"] += 1
+
+    with _stats_lock:
+        _stats["processed"] += done
+        _stats["batches"] += 1
+        _stats["last_batch_size"] = done
+        _stats["last_batch_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        _stats["last_run_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return done
+
+
+def purge_once(db, days: int = RETENTION_DAYS, batch_size: int = PURGE_BATCH) -> int:
+    """Xóa dòng đã xử lý quá `days` ngày, mỗi lô 1 commit (index ix_outbox_pending). Trả về số dòng."""
+    if days <= 0:
+        return 0
+    total = 0
+    while True:
+        n = db.execute(
+            text("""
+                DELETE FROM outbox
+                WHERE processed_at IS NOT NULL AND processed_at < NOW() - INTERVAL :d DAY
+                ORDER BY processed_at
+                LIMIT :n
+            """),
+            {"d": int(days), "n": int(batch_size)},
+        ).rowcount or 0
+        db.commit()
+        total += n
+        if n < batch_size:
+            break
+    with _stats_lock:
+        _stats["purged"] += total
+        _stats["last_purge_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return total
+
+
+def purge_locked(days: int = RETENTION_DAYS, batch_size: int = PURGE_BATCH) -> int | None:
+    """purge_once dưới GET_LOCK; process khác đang xóa => None."""
+    with locked_session(PURGE_LOCK) as db:
+        if db is None:
+            return None
+        return purge_once(db, days, batch_size)
+
+
+def metrics(db) -> dict:
+    row = db.execute(
+        text("""
+            SELECT
+                SUM(CASE WHEN attempts < :max THEN 1 ELSE 0 END) AS depth,
+                SUM(CASE WHEN attempts >= :max THEN 1 ELSE 0 END) AS dead,
+                TIMESTAMPDIFF(SECOND, MIN(CASE WHEN attempts < :max THEN created_at END), NOW()) AS lag_s
+            FROM outbox
+            WHERE processed_at IS NULL
+        """),
+        {"max": MAX_ATTEMPTS},
+    ).mappings().first() or {}
+    with _stats_lock:
+        worker = dict(_stats)
+    return {
+        "depth": int(row.get("depth") or 0),
+        "dead": int(row.get("dead") or 0),
+        "lag_seconds": int(row.get("lag_s") or 0),
+        "worker": worker,
+    }
+
+
+class OutboxWorker:
+    def __init__(self, interval: float = 1.0, batch_size: int = 500, purge_interval: float = 3600.0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                n = drain_once(db, self.batch_size)
+            except Exception:
+                n = 0
+                with _stats_lock:
+                    _stats["errors"] += 1
+            finally:
+                db.close()
+            # Còn đầy lô => rút tiếp ngay; ngược lại nghỉ (và dọn dòng cũ nếu tới hạn)
+            if n < self.batch_size:
+                self._maybe_purge()
+                self._stop.wait(self.interval)
+
+    def _maybe_purge(self) -> None:
+        if not self.purge_interval or time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            purge_locked()
+        except Exception:
+            with _stats_lock:
+                _stats["errors"] += 1
+
+
+outbox_worker = OutboxWorker(
+    interval=float(os.getenv("OUTBOX_INTERVAL", "1.0")),
+    batch_size=int(os.getenv("OUTBOX_BATCH", "500")),
+    purge_interval=float(os.getenv("OUTBOX_PURGE_INTERVAL", "3600")),
+)
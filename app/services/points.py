@@ -0,0 +1,231 @@
+# app/services/points.py
+"""
+Sổ cái điểm + số dư cộng dồn:
+- Mọi dòng so_cai_diem đi qua add(): cộng points_balance TRƯỚC rồi mới INSERT sổ cái,
+  cùng transaction => số dư luôn khớp sổ cái khi commit, đọc điểm = tra theo khóa chính.
+  (Cộng số dư trước => khóa dòng points_balance của user được giữ tới commit,
+   reconcile() khóa cùng dòng đó nên không đọc sổ cái "giữa chừng".)
+- Cùng lúc cộng vào dòng theo ngày của leaderboard_buckets (BXH tuần / tháng).
+- reconcile(): đối chiếu số dư với SUM(sổ cái) theo lô user; fix=True thì sửa lệch.
+- Bảng mới (create_all tạo rỗng): auto_migrate chạy backfill() 1 lần lúc khởi động;
+  tới khi xong, balance() / balances() / ready() => đọc SUM(sổ cái) như trước.
+  Chạy tay:  python -m app.services.points --reconcile --fix
+Commit do caller kiểm soát (trừ reconcile chạy theo lô).
+"""
+from sqlalchemy import text
+
+from ..schema_registry import schema
+from . import auto_migrate, leaderboard_buckets
+
+MIGRATION = "points_balance.backfill"
+PLAYS_MIGRATION = "points_balance.so_luot_choi"  # services/leaderboard.migrate
+
+
+def ready(db) -> bool:
+    """points_balance đã backfill từ sổ cái chưa (chưa => số dư chưa đủ để đọc)."""
+    return auto_migrate.done(db, MIGRATION)
+
+
+def has_plays(db) -> bool:
+    """Có cột so_luot_choi chưa (danh bạ của process này có thể cũ nếu process khác vừa ALTER)."""
+    return schema.has(db, "points_balance", "so_luot_choi") or auto_migrate.done(db, PLAYS_MIGRATION)
+
+
+def add(db, entries, plays=None) -> int:
+    """
+    entries: [{"uid", "diem", "lydo", "reward_id"?}]. Trả về số dòng sổ cái đã ghi.
+    reward_id: challenge_rewards.id (FK so_cai_diem.challenge_reward_id, nếu DB đã có cột).
+    plays: {uid: số lượt chơi} cộng vào points_balance.so_luot_choi trong CÙNG câu upsert
+      (1 lượt khóa dòng theo thứ tự user; DB chưa có cột thì bỏ qua).
+    """
+    rows = [
+        {"uid": int(e["uid"]), "diem": int(e["diem"]), "lydo": e["lydo"], "rid": e.get("reward_id")}
+        for e in entries
+        if int(e["diem"])
+    ]
+    plays = {int(u): int(n) for u, n in (plays or {}).items() if int(n)}
+    if not rows and not plays:
+        return 0
+    delta = {}
+    for r in rows:
+        delta[r["uid"]] = delta.get(r["uid"], 0) + r["diem"]
+    # Thứ tự user cố định => 2 lô chồng nhau không deadlock
+    if plays and has_plays(db):
+        db.execute(text("""
+            INSERT INTO points_balance (user_id, diem, so_luot_choi, updated_at)
+            VALUES (:uid, :d, :p, NOW())
+            ON DUPLICATE KEY UPDATE
+              diem = diem + VALUES(diem), so_luot_choi = so_luot_choi + VALUES(so_luot_choi),
+              updated_at = NOW()
+        """), [
+            {"uid": u, "d": delta.get(u, 0), "p": plays.get(u, 0)}
+            for u in sorted(set(delta) | set(plays))
+        ])
+    elif delta:
+        db.execute(text("""
+            INSERT INTO points_balance (user_id, diem, updated_at)
+            VALUES (:uid, :d, NOW())
+            ON DUPLICATE KEY UPDATE diem = diem + VALUES(diem), updated_at = NOW()
+        """), [{"uid": u, "d": d} for u, d in sorted(delta.items())])
+    leaderboard_buckets.record(
+        db, [(u, delta.get(u, 0), plays.get(u, 0)) for u in sorted(set(delta) | set(plays))]
+    )
+    if not rows:
+        return 0
+    if schema.has(db, "so_cai_diem", "challenge_reward_id"):
+        db.execute(text("""
+            INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian, challenge_reward_id)
+            VALUES (:uid, :diem, :lydo, NOW(), :rid)
+        """), rows)
+    else:
+        db.execute(text("""
+            INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
+            VALUES (:uid, :diem, :lydo, NOW())
+        """), rows)
+    return len(rows)
+
+
+def add_select(db, select_sql: str, params: dict) -> int:
+    """
+    Bản set-based của add(): select_sql trả về các cột (uid, diem, lydo, reward_id).
+    Cùng thứ tự: cộng points_balance (gộp theo user, tăng dần) rồi INSERT ... SELECT sổ cái.
+    """
+    db.execute(text(f"""
+        INSERT INTO points_balance (user_id, diem, updated_at)
+        SELECT x.uid, SUM(x.diem), NOW()
+        FROM ({select_sql}) x
+        GROUP BY x.uid
+        ORDER BY x.uid
+        ON DUPLICATE KEY UPDATE diem = points_balance.diem + VALUES(diem), updated_at = NOW()
+    """), params)
+    leaderboard_buckets.record_select(db, select_sql, params)
+    if schema.has(db, "so_cai_diem", "challenge_reward_id"):
+        res = db.execute(text(f"""
+            INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian, challenge_reward_id)
+            SELECT x.uid, x.diem, x.lydo, NOW(), x.reward_id FROM ({select_sql}) x
+        """), params)
+    else:
+        res = db.execute(text(f"""
+            INSERT INTO so_cai_diem (ma_nguoi_dung, diem_thay_doi, ly_do, thoi_gian)
+            SELECT x.uid, x.diem, x.lydo, NOW() FROM ({select_sql}) x
+        """), params)
+    return res.rowcount or 0
+
+
+def balance(db, user_id: int) -> int:
+    if not ready(db):
+        return balances(db, [user_id])[int(user_id)]
+    return int(db.execute(
+        text("SELECT diem FROM points_balance WHERE user_id = :uid"), {"uid": user_id}
+    ).scalar() or 0)
+
+
+def balances(db, user_ids) -> dict[int, int]:
+    ids = tuple(int(i) for i in user_ids)
+    out = {i: 0 for i in ids}
+    if not ids:
+        return out
+    if ready(db):
+        sql = "SELECT user_id, diem FROM points_balance WHERE user_id IN :ids"
+    else:
+        sql = """
+            SELECT ma_nguoi_dung, SUM(diem_thay_doi) FROM so_cai_diem
+            WHERE ma_nguoi_dung IN :ids GROUP BY ma_nguoi_dung
+        """
+    for uid, diem in db.execute(text(sql), {"ids": ids}).all():
+        out[int(uid)] = int(diem or 0)
+    return out
+
+
+def _fix(db, user_ids) -> None:
+    ids = tuple(sorted(user_ids))
+    db.execute(text("""
+        INSERT INTO points_balance (user_id, diem, updated_at)
+        VALUES (:uid, 0, NOW())
+        ON DUPLICATE KEY UPDATE user_id = user_id
+    """), [{"uid": u} for u in ids])
+    db.execute(
+        text("SELECT user_id FROM points_balance WHERE user_id IN :ids FOR UPDATE"), {"ids": ids}
+    ).all()
+    # Đang giữ khóa số dư => không còn ghi sổ cái dở dang của các user này
+    db.execute(text("""
+        UPDATE points_balance b
+        LEFT JOIN (
+            SELECT ma_nguoi_dung, SUM(diem_thay_doi) AS s
+            FROM so_cai_diem
+            WHERE ma_nguoi_dung IN :ids
+            GROUP BY ma_nguoi_dung
+        ) l ON l.ma_nguoi_dung = b.user_id
+        SET b.diem = COALESCE(l.s, 0), b.updated_at = NOW()
+        WHERE b.user_id IN :ids
+    """), {"ids": ids})
+
+
+def reconcile(db, chunk: int = 1000, fix: bool = False) -> dict:
+    """
+    Đối chiếu theo lô id user (keyset). Mỗi lô 1 câu SELECT (cùng snapshot cho sổ cái
+    và số dư); lệch => ghi nhận, fix=True thì tính lại dưới khóa rồi commit lô đó.
+    """
+    out = {"checked": 0, "mismatched": 0, "fixed": 0, "samples": []}
+    last = 0
+    while True:
+        ids = [int(r[0]) for r in db.execute(
+            text("SELECT id FROM users WHERE id > :lo ORDER BY id LIMIT :n"),
+            {"lo": last, "n": chunk},
+        ).all()]
+        if not ids:
+            break
+        last = ids[-1]
+        bad = db.execute(text("""
+            SELECT u.id, COALESCE(l.s, 0) AS so_cai, COALESCE(b.diem, 0) AS so_du
+            FROM users u
+            LEFT JOIN (
+                SELECT ma_nguoi_dung, SUM(diem_thay_doi) AS s
+                FROM so_cai_diem
+                WHERE ma_nguoi_dung IN :ids
+                GROUP BY ma_nguoi_dung
+            ) l ON l.ma_nguoi_dung = u.id
+            LEFT JOIN points_balance b ON b.user_id = u.id
+            WHERE u.id IN :ids
+              AND COALESCE(l.s, 0) <> COALESCE(b.diem, 0)
+        """), {"ids": tuple(ids)}).mappings().all()
+        out["checked"] += len(ids)
+        out["mismatched"] += len(bad)
+        for r in bad[: max(0, 20 - len(out["samples"]))]:
+            out["samples"].append(
+                {"user_id": int(r["id"]), "so_cai": int(r["so_cai"]), "so_du": int(r["so_du"])}
+            )
+        if bad and fix:
+            _fix(db, [int(r["id"]) for r in bad])
+            out["fixed"] += len(bad)
+        db.commit()  # kết thúc snapshot của lô
+    return out
+
+
+def backfill(db) -> dict:
+    """Bước auto_migrate: dựng số dư từ sổ cái (chạy được khi đang có ghi điểm, xem _fix)."""
+    return reconcile(db, fix=True)
+
+
+def main():
+    import argparse
+    import json
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reconcile", action="store_true")
+    ap.add_argument("--fix", action="store_true", help="sửa số dư lệch (kể cả backfill lần đầu)")
+    ap.add_argument("--chunk", type=int, default=1000)
+    args = ap.parse_args()
+    if not args.reconcile:
+        ap.print_help()
+        return
+    db = SessionLocal()
+    try:
+        print(json.dumps(reconcile(db, chunk=args.chunk, fix=args.fix), ensure_ascii=False, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# app/services/promo_backtest.py
+"""
+Backtest khuyến mãi trên vé lịch sử: "bộ KM này tháng trước sẽ tốn bao nhiêu?"
+
+- Đọc ve (+ bậc thành viên, giá niêm yết) theo lô khoảng id, đổi thành mảng cột NumPy
+- Chạy bộ KM ứng viên qua CÙNG logic điều kiện với promo_utils
+  (CompiledPromo + _PromoMatrix.evaluate_columns), chọn KM tốt nhất cho từng vé
+  như lúc đặt vé (rate cao nhất, giá trị xét = giá niêm yết x số lượng, phạm vi = sự kiện của vé)
+- Báo cáo: chi phí giảm giá, số vé / khách bị ảnh hưởng, doanh thu thực tế vs mô phỏng, chi tiết theo KM
+
+Không ghi DB. Cần NumPy.
+
+CLI:
+  python -m app.services.promo_backtest --rules rules.json --from 2026-09-01 --to 2026-09-30
+  rules.json: [{"ten": "...", "ty_le": 10, "dieu_kien": {...}, "thoi_gian_bd": "...", "thoi_gian_kt": "..."}]
+  (thoi_gian_bd/kt tuỳ chọn: có thì chỉ áp cho vé tạo trong khoảng đó)
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from ..promo_utils import HAS_NUMPY, CompiledPromo, _PromoMatrix, np
+
+DEFAULT_STATUSES = ("PAID", "CHECKIN", "USED")
+CHUNK = 200_000
+
+
+def _compile_rules(rules) -> list[CompiledPromo]:
+    promos = []
+    for i, r in enumerate(rules):
+        row = dict(r)
+        row.setdefault("id", -(i + 1))  # KM nháp chưa có id
+        row.setdefault("ten", f"KM #{i + 1}")
+        row.setdefault("active", 1)
+        for k in ("thoi_gian_bd", "thoi_gian_kt"):
+            if isinstance(row.get(k), str):
+                row[k] = datetime.fromisoformat(row[k].replace("Z", ""))
+        p = CompiledPromo(row)
+        if p.active and p.rate > 0:
+            promos.append(p)
+    # Cùng thứ tự ưu tiên với PromoCache: rate giảm dần, giữ thứ tự nhập khi bằng nhau
+    return sorted(promos, key=lambda p: p.rate, reverse=True)
+
+
+def _id_range(db, d_from, d_to, statuses) -> tuple[int, int] | None:
+    """
+    MIN/MAX(id) vé trong cửa sổ: chỉ đọc index (trang_thai, created_at) (id có sẵn trong index phụ)
+    => phân trang theo khóa chính bắt đầu ngay ở vé đầu cửa sổ, không đi từ vé cũ nhất.
+    """
+    row = db.execute(text("""
+        SELECT MIN(id), MAX(id) FROM ve
+        WHERE trang_thai IN :st AND created_at >= :d_from AND created_at < :d_to
+    """), {"d_from": d_from, "d_to": d_to, "st": tuple(statuses)}).first()
+    if not row or row[0] is None:
+        return None
+    return int(row[0]), int(row[1])
+
+
+def _load_chunk(db, lo: int, hi: int, d_from, d_to, statuses, chunk: int):
+    return db.execute(text("""
+        SELECT v.id, v.user_id,
+               COALESCE(v.su_kien_id, -1) AS ev,
+               COALESCE(NULLIF(COALESCE(sk.gia_ve, tc.gia_mac_dinh, 0), 0) * v.so_luong, v.tong_tien, 0) AS gross,
+               COALESCE(v.tong_tien, 0) AS paid,
+               COALESCE(NULLIF(UPPER(TRIM(kh.hang_thanh_vien)), ''), 'THUONG') AS tier,
+               v.created_at
+        FROM ve v
+        LEFT JOIN su_kien sk ON sk.id = v.su_kien_id
+        LEFT JOIN tro_choi tc ON tc.id = v.tro_choi_id
+        LEFT JOIN khach_hang kh ON kh.user_id = v.user_id
+        WHERE v.id > :lo AND v.id <= :hi
+          AND v.created_at >= :d_from AND v.created_at < :d_to
+          AND v.trang_thai IN :st
+        ORDER BY v.id
+        LIMIT :n
+    """), {"lo": lo, "hi": hi, "d_from": d_from, "d_to": d_to, "st": tuple(statuses), "n": chunk}).all()
+
+
+def run_backtest(db, rules, d_from: datetime, d_to: datetime, statuses=DEFAULT_STATUSES, chunk: int = CHUNK) -> dict:
+    if not HAS_NUMPY:
+        raise RuntimeError("Backtest khuyến mãi cần NumPy (pip install numpy)")
+    t0 = time.perf_counter()
+    promos = _compile_rules(rules)
+    matrix = _PromoMatrix(promos) if promos else None
+    n_p = len(promos)
+
+    # Cửa sổ thời gian của từng KM (cùng giờ "naive" như cột DATETIME); không khai báo = luôn áp dụng
+    win_lo = np.array([p.start or datetime.min for p in promos], dtype="datetime64[s]")
+    win_hi = np.array([p.end or datetime.max for p in promos], dtype="datetime64[s]")
+    rates = np.array([p.rate for p in promos], dtype=np.float64)
+
+    tot = {"tickets": 0, "gross": 0.0, "paid": 0.0, "discount": 0.0, "affected": 0}
+    per_tickets = np.zeros(n_p, dtype=np.int64)
+    per_discount = np.zeros(n_p, dtype=np.float64)
+    per_gross = np.zeros(n_p, dtype=np.float64)
+    users_all: set[int] = set()
+    users_hit: list[set[int]] = [set() for _ in promos]
+    users_any: set[int] = set()
+
+    id_range = _id_range(db, d_from, d_to, statuses)
+    last_id, max_id = (id_range[0] - 1, id_range[1]) if id_range else (0, -1)
+    while last_id < max_id:
+        rows = _load_chunk(db, last_id, max_id, d_from, d_to, statuses, chunk)
+        if not rows:
+            break
+        last_id = int(rows[-1][0])
+        cols = list(zip(*rows))
+        uid = np.array(cols[1], dtype=np.int64)
+        ev = np.array(cols[2], dtype=np.int64)
+        gross = np.array(cols[3], dtype=np.float64)
+        paid = np.array(cols[4], dtype=np.float64)
+        tier_values, tier_codes = np.unique(np.array(cols[5], dtype=object), return_inverse=True)
+        ts = np.array(cols[6], dtype="datetime64[s]")
+
+        tot["tickets"] += len(rows)
+        tot["gross"] += float(gross.sum())
+        tot["paid"] += float(paid.sum())
+        users_all.update(np.unique(uid).tolist())
+        if matrix is None:
+            continue
+
+        ok = matrix.evaluate_columns(gross, tier_codes.astype(np.int64), list(tier_values), ev)
+        ok &= (ts[:, None] >= win_lo[None, :]) & (ts[:, None] <= win_hi[None, :])
+        hit = ok.any(axis=1)
+        best = ok.argmax(axis=1)  # cột đầu tiên True = rate cao nhất
+        disc = np.where(hit, np.round(gross * rates[best] / 100), 0.0)
+
+        tot["affected"] += int(hit.sum())
+        tot["discount"] += float(disc.sum())
+        per_tickets += np.bincount(best[hit], minlength=n_p)
+        per_discount += np.bincount(best[hit], weights=disc[hit], minlength=n_p)
+        per_gross += np.bincount(best[hit], weights=gross[hit], minlength=n_p)
+        for j in np.unique(best[hit]).tolist():
+            users_hit[j].update(np.unique(uid[hit & (best == j)]).tolist())
+        users_any.update(np.unique(uid[hit]).tolist())
+
+    simulated = tot["gross"] - tot["discount"]
+    return {
+        "tu_ngay": d_from.isoformat(),
+        "den_ngay": d_to.isoformat(),
+        "trang_thai": list(statuses),
+        "so_ve": tot["tickets"],
+        "so_khach": len(users_all),
+        "so_ve_duoc_giam": tot["affected"],
+        "so_khach_duoc_giam": len(users_any),
+        "doanh_thu_niem_yet": int(tot["gross"]),
+        "doanh_thu_thuc_te": int(tot["paid"]),
+        "chi_phi_giam_gia": int(tot["discount"]),
+        "doanh_thu_mo_phong": int(simulated),
+        "chenh_lech_so_voi_thuc_te": int(simulated - tot["paid"]),
+        "theo_khuyen_mai": [
+            {
+                "id": p.id,
+                "ten": p.ten,
+                "ty_le": p.rate,
+                "so_ve": int(per_tickets[j]),
+                "so_khach": len(users_hit[j]),
+                "doanh_thu_niem_yet": int(per_gross[j]),
+                "chi_phi_giam_gia": int(per_discount[j]),
+            }
+            for j, p in enumerate(promos)
+        ],
+        "thoi_gian_chay_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+def main():
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rules", required=True, help="file JSON: danh sách KM ứng viên")
+    ap.add_argument("--from", dest="d_from", required=True, help="YYYY-MM-DD")
+    ap.add_argument("--to", dest="d_to", required=True, help="YYYY-MM-DD (không tính)")
+    ap.add_argument("--status", default=",".join(DEFAULT_STATUSES))
+    ap.add_argument("--chunk", type=int, default=CHUNK)
+    args = ap.parse_args()
+
+    with open(args.rules, encoding="utf-8") as f:
+        rules = json.load(f)
+    db = SessionLocal()
+    try:
+        out = run_backtest(
+            db,
+            rules,
+            datetime.fromisoformat(args.d_from),
+            datetime.fromisoformat(args.d_to),
+            statuses=[s.strip().upper() for s in args.status.split(",") if s.strip()],
+            chunk=args.chunk,
+        )
+    finally:
+        db.close()
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
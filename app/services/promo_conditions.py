@@ -0,0 +1,159 @@
+# app/services/promo_conditions.py
+"""
+Điều kiện khuyến mãi dạng chuẩn trong SQL:
+- khuyen_mai.dieu_kien là cột JSON (dạng chuẩn, xem promo_utils.canonical_condition)
+- Cột sinh + index: dk_min_amount, dk_min_tier_rank, dk_event_scope
+  và multi-valued index trên dieu_kien->'$.event_ids'
+- sql_filter(): điều kiện "KM áp dụng được cho (amount, tier, event)" viết bằng SQL
+  => lọc ngay trong DB (danh sách KM cho admin) thay vì nạp hết rồi parse từng dòng.
+- migrate(): nâng DB cũ (dieu_kien TEXT, alias lộn xộn) lên dạng chuẩn. Chạy lại được.
+  Tự chạy lúc khởi động (services/auto_migrate.py); chạy tay:
+  python -m app.services.promo_conditions --migrate
+- ready(): DB đã có cột sinh chưa; chưa có thì caller lọc bằng CompiledPromo trong Python.
+"""
+import json
+
+from sqlalchemy import text
+
+from ..models import KM_GENERATED, KM_INDEXES, km_generated_ddl
+from ..promo_utils import _norm_tier, _tier_rank, canonical_condition
+from ..schema_registry import schema
+from . import auto_migrate
+
+MIGRATION = "khuyen_mai.dieu_kien_json"
+
+
+def ready(db) -> bool:
+    return schema.has(db, "khuyen_mai", "dk_event_scope") or auto_migrate.done(db, MIGRATION)
+
+
+def sql_filter(
+    amount: float | None = None,
+    tier: str | None = None,
+    event_id: int | None = None,
+    alias: str = "km",
+) -> tuple[str, dict]:
+    """
+    (mệnh đề WHERE, params) cho: KM áp dụng được với đơn (amount, tier, event_id).
+    Tham số None = không lọc theo tiêu chí đó (tier "" = khách chưa có bậc,
+    event None = mọi sự kiện như evaluate_batch).
+    Kết quả giống CompiledPromo.matches() trên dạng chuẩn.
+    """
+    parts, params = [], {}
+    if amount is not None:
+        parts.append(f"{alias}.dk_min_amount <= :dk_amount")
+        params["dk_amount"] = float(amount)
+    if tier is not None:
+        ut = _norm_tier(tier)
+        # ut None => hạng 0 => mọi KM có min_tier đều loại
+        parts.append(f"{alias}.dk_min_tier_rank <= :dk_rank")
+        params["dk_rank"] = _tier_rank(ut) if ut else 0
+        parts.append(
+            f"(JSON_LENGTH(IFNULL({alias}.dieu_kien->'$.member_tiers', JSON_ARRAY())) = 0"
+            f" OR JSON_CONTAINS({alias}.dieu_kien->'$.member_tiers', JSON_QUOTE(:dk_tier)))"
+        )
+        parts.append(
+            f"(IFNULL({alias}.dieu_kien->>'$.member_only', 'false') <> 'true'"
+            f" OR (:dk_tier <> '' AND :dk_tier <> 'THUONG'))"
+        )
+        params["dk_tier"] = ut or ""
+    if event_id is not None:
+        parts.append(
+            f"({alias}.dk_event_scope = 0 OR :dk_ev MEMBER OF ({alias}.dieu_kien->'$.event_ids'))"
+        )
+        params["dk_ev"] = int(event_id)
+    return (" AND ".join(parts) or "1=1"), params
+
+
+# ---------- Migration ----------
+def _column_type(db, column: str) -> str | None:
+    return db.execute(text("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'khuyen_mai' AND COLUMN_NAME = :c
+    """), {"c": column}).scalar()
+
+
+def _has_index(db, name: str) -> bool:
+    return bool(db.execute(text("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'khuyen_mai' AND INDEX_NAME = :n
+        LIMIT 1
+    """), {"n": name}).first())
+
+
+def canonicalize_rows(db) -> int:
+    """Ghi lại dieu_kien của mọi dòng về dạng chuẩn. Trả về số dòng đổi."""
+    rows = db.execute(text(
+        "SELECT id, dieu_kien FROM khuyen_mai WHERE dieu_kien IS NOT NULL"
+    )).all()
+    updates = []
+    for km_id, raw in rows:
+        if isinstance(raw, str) and raw.strip():
+            try:
+                json.loads(raw)
+            except Exception:
+                raw = {"raw": raw}  # ghi chú tự do (không phải JSON) giữ lại ở khoá "raw"
+        canon = json.dumps(canonical_condition(raw), ensure_ascii=False, sort_keys=True)
+        old = raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False, sort_keys=True)
+        try:
+            same = json.loads(old) == json.loads(canon)
+        except Exception:
+            same = False
+        if not same:
+            updates.append({"id": km_id, "dk": canon})
+    if updates:
+        db.execute(text("UPDATE khuyen_mai SET dieu_kien = :dk WHERE id = :id"), updates)
+    return len(updates)
+
+
+def migrate(db) -> dict:
+    """
+    TEXT -> JSON + cột sinh + index. DDL của MySQL tự commit nên hàm này commit
+    sau từng bước (khác các service khác); chạy lại trên DB đã nâng cấp chỉ chuẩn hoá lại dữ liệu.
+    """
+    out = {"canonicalized": 0, "altered": [], "indexes": []}
+    # Dữ liệu hợp lệ JSON trước rồi mới đổi kiểu cột (MODIFY ... JSON lỗi nếu còn chuỗi lạ)
+    out["canonicalized"] = canonicalize_rows(db)
+    db.commit()
+
+    if (_column_type(db, "dieu_kien") or "").lower() != "json":
+        db.execute(text("ALTER TABLE khuyen_mai MODIFY dieu_kien JSON NULL"))
+        out["altered"].append("dieu_kien JSON")
+    for col in KM_GENERATED:
+        if _column_type(db, col) is None:
+            db.execute(text(km_generated_ddl(col)))
+            out["altered"].append(col)
+    for name, ddl in KM_INDEXES.items():
+        if not _has_index(db, name):
+            db.execute(text(ddl))
+            out["indexes"].append(name)
+    db.commit()
+    schema.refresh(db)
+    return out
+
+
+def main():
+    import argparse
+    from ..db import SessionLocal
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate", action="store_true", help="nâng cấp bảng khuyen_mai")
+    ap.add_argument("--canonicalize", action="store_true", help="chỉ chuẩn hoá lại dieu_kien")
+    args = ap.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.migrate:
+            print(migrate(db))
+        elif args.canonicalize:
+            n = canonicalize_rows(db)
+            db.commit()
+            print({"canonicalized": n})
+        else:
+            ap.print_help()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
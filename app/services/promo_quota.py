@@ -0,0 +1,259 @@
+# app/services/promo_quota.py
+"""
+Giới hạn lượt dùng khuyến mãi (tổng / mỗi khách) bằng bộ đếm nguyên tử, không COUNT trên ve.
+
+- Tổng: số lượt còn lại chia vào `so_slot` dòng khuyen_mai_quota_slot.
+  claim() trừ 1 ở 1 slot chọn ngẫu nhiên bằng UPDATE có điều kiện con_lai > 0
+  (theo khóa chính => chỉ khóa đúng 1 dòng tới commit); slot đó hết thì lấy slot còn lượt bất kỳ.
+  => lượt đặt đồng thời rải trên nhiều dòng thay vì xếp hàng chờ 1 dòng đếm.
+- Mỗi khách: khuyen_mai_su_dung(khuyen_mai_id, user_id, so_lan), UPDATE ... WHERE so_lan < :cap.
+- ve_khuyen_mai ghi vé nào đã giữ lượt => release_tickets() hoàn đúng lượt khi hủy
+  (đánh dấu da_hoan nên không hoàn 2 lần); vé đã hủy được hồi sinh (IPN về muộn)
+  thì reclaim_tickets() giữ lại đúng lượt đó hoặc báo hết lượt.
+Không commit: claim nằm chung transaction với INSERT vé; rollback là tự trả lượt.
+Quan trọng: KM không có giới hạn => claim() không chạm DB.
+"""
+import random
+
+from sqlalchemy import text
+
+from ..schema_registry import schema
+from . import auto_migrate
+
+DEFAULT_SLOTS = 8
+MIGRATION = "ve_khuyen_mai.da_hoan"
+
+
+def _has_flag(db) -> bool:
+    """Cột ve_khuyen_mai.da_hoan đã có chưa (DB cũ: auto_migrate thêm lúc khởi động)."""
+    return schema.has(db, "ve_khuyen_mai", "da_hoan") or auto_migrate.done(db, MIGRATION)
+
+
+def _live(db, alias: str = "") -> str:
+    """Điều kiện lọc dòng liên kết còn giữ lượt."""
+    return f" AND {alias}da_hoan = 0" if _has_flag(db) else ""
+
+
+def _take_slot(db, km_id: int, slots: int) -> bool:
+    start = random.randrange(max(1, slots))
+    if db.execute(text("""
+        UPDATE khuyen_mai_quota_slot SET con_lai = con_lai - 1
+        WHERE khuyen_mai_id = :km AND slot = :s AND con_lai > 0
+    """), {"km": km_id, "s": start}).rowcount:
+        return True
+    # Slot ngẫu nhiên đã cạn (thường chỉ xảy ra khi KM sắp hết lượt)
+    return bool(db.execute(text("""
+        UPDATE khuyen_mai_quota_slot SET con_lai = con_lai - 1
+        WHERE khuyen_mai_id = :km AND con_lai > 0
+        ORDER BY slot
+        LIMIT 1
+    """), {"km": km_id}).rowcount)
+
+
+def _take_user(db, km_id: int, user_id: int, cap: int) -> bool:
+    db.execute(text("""
+        INSERT IGNORE INTO khuyen_mai_su_dung (khuyen_mai_id, user_id, so_lan)
+        VALUES (:km, :uid, 0)
+    """), {"km": km_id, "uid": user_id})
+    return bool(db.execute(text("""
+        UPDATE khuyen_mai_su_dung SET so_lan = so_lan + 1
+        WHERE khuyen_mai_id = :km AND user_id = :uid AND so_lan < :cap
+    """), {"km": km_id, "uid": user_id, "cap": int(cap)}).rowcount)
+
+
+def claim(db, promo, user_id: int) -> bool:
+    """
+    Giữ 1 lượt (1 lần đặt) của KM `promo` (CompiledPromo) cho user. False => hết lượt,
+    không để lại thay đổi nào (savepoint) => caller có thể thử KM khác trong cùng transaction.
+    """
+    if not promo.has_quota:
+        return True
+    sp = db.begin_nested()
+    ok = (
+        (promo.limit_per_user is None or _take_user(db, promo.id, user_id, promo.limit_per_user))
+        and (promo.limit_total is None or _take_slot(db, promo.id, promo.slots))
+    )
+    if ok:
+        sp.commit()
+    else:
+        sp.rollback()
+    return ok
+
+
+def record(db, links) -> None:
+    """links: [(ve_id, promo, user_id)] cho các vé vừa tạo với KM có giới hạn."""
+    rows = [
+        {
+            "ve": int(ve_id),
+            "km": int(p.id),
+            "uid": int(uid),
+            "tu": 1 if p.limit_per_user is not None else 0,
+        }
+        for ve_id, p, uid in links
+        if p is not None and p.has_quota
+    ]
+    if rows:
+        db.execute(text("""
+            INSERT INTO ve_khuyen_mai (ve_id, khuyen_mai_id, user_id, tinh_theo_user)
+            VALUES (:ve, :km, :uid, :tu)
+        """), rows)
+
+
+def release_tickets(db, ve_ids) -> int:
+    """Hoàn lượt của các vé bị hủy. Trả về số vé được hoàn."""
+    ids = tuple(int(i) for i in ve_ids)
+    if not ids:
+        return 0
+    links = db.execute(text(f"""
+        SELECT l.ve_id, l.khuyen_mai_id, l.user_id, l.tinh_theo_user,
+               IFNULL(q.so_slot, 1) AS so_slot, q.gioi_han_tong
+        FROM ve_khuyen_mai l
+        LEFT JOIN khuyen_mai_quota q ON q.khuyen_mai_id = l.khuyen_mai_id
+        WHERE l.ve_id IN :ids{_live(db, "l.")}
+        FOR UPDATE
+    """), {"ids": ids}).mappings().all()
+    if not links:
+        return 0
+
+    by_promo, by_user = {}, {}
+    for l in links:
+        km = int(l["khuyen_mai_id"])
+        if l["gioi_han_tong"] is not None:
+            by_promo[km] = (by_promo.get(km, (0, int(l["so_slot"])))[0] + 1, int(l["so_slot"]))
+        if int(l["tinh_theo_user"] or 0):
+            key = (km, int(l["user_id"]))
+            by_user[key] = by_user.get(key, 0) + 1
+
+    for km, (n, slots) in by_promo.items():
+        db.execute(text("""
+            UPDATE khuyen_mai_quota_slot SET con_lai = con_lai + :n
+            WHERE khuyen_mai_id = :km AND slot = :s
+        """), {"km": km, "n": n, "s": random.randrange(max(1, slots))})
+    if by_user:
+        db.execute(text("""
+            UPDATE khuyen_mai_su_dung SET so_lan = GREATEST(so_lan - :n, 0)
+            WHERE khuyen_mai_id = :km AND user_id = :uid
+        """), [{"km": km, "uid": uid, "n": n} for (km, uid), n in by_user.items()])
+    if _has_flag(db):
+        db.execute(text("UPDATE ve_khuyen_mai SET da_hoan = 1 WHERE ve_id IN :ids"), {"ids": ids})
+    else:
+        db.execute(text("DELETE FROM ve_khuyen_mai WHERE ve_id IN :ids"), {"ids": ids})
+    return len(links)
+
+
+def reclaim_tickets(db, ve_ids) -> bool:
+    """
+    Vé đã hủy (lượt đã hoàn) được hồi sinh: giữ lại đúng các lượt KM vé đó từng giữ.
+    False => có KM đã hết lượt, không để lại thay đổi nào (savepoint). Vé không dùng KM
+    có giới hạn => True.
+    """
+    ids = tuple(int(i) for i in ve_ids)
+    if not ids or not _has_flag(db):
+        return True
+    links = db.execute(text("""
+        SELECT l.ve_id, l.khuyen_mai_id, l.user_id, l.tinh_theo_user,
+               q.gioi_han_tong, q.gioi_han_moi_user, IFNULL(q.so_slot, 1) AS so_slot
+        FROM ve_khuyen_mai l
+        LEFT JOIN khuyen_mai_quota q ON q.khuyen_mai_id = l.khuyen_mai_id
+        WHERE l.ve_id IN :ids AND l.da_hoan = 1
+        FOR UPDATE
+    """), {"ids": ids}).mappings().all()
+    if not links:
+        return True
+
+    sp = db.begin_nested()
+    ok = True
+    for l in links:
+        km, uid = int(l["khuyen_mai_id"]), int(l["user_id"])
+        if int(l["tinh_theo_user"] or 0):
+            # release đã trừ so_lan => cộng lại; giới hạn / khách đã bỏ thì cộng không chặn
+            cap = l["gioi_han_moi_user"]
+            ok = _take_user(db, km, uid, int(cap) if cap is not None else 2**31 - 1)
+        if ok and l["gioi_han_tong"] is not None:
+            ok = _take_slot(db, km, int(l["so_slot"]))
+        if not ok:
+            break
+    if not ok:
+        sp.rollback()
+        return False
+    db.execute(text("UPDATE ve_khuyen_mai SET da_hoan = 0 WHERE ve_id IN :ids"), {"ids": ids})
+    sp.commit()
+    return True
+
+
+def set_quota(
+    db,
+    km_id: int,
+    gioi_han_tong: int | None,
+    gioi_han_moi_user: int | None,
+    so_slot: int = DEFAULT_SLOTS,
+) -> dict:
+    """
+    ADMIN đặt giới hạn. Số lượt còn lại tính lại 1 lần từ ve_khuyen_mai
+    rồi chia đều vào các slot (thao tác quản trị hiếm).
+    """
+    so_slot = max(1, int(so_slot))
+    db.execute(text("""
+        INSERT INTO khuyen_mai_quota (khuyen_mai_id, gioi_han_tong, gioi_han_moi_user, so_slot, updated_at)
+        VALUES (:km, :tong, :mu, :ns, NOW())
+        ON DUPLICATE KEY UPDATE
+          gioi_han_tong = VALUES(gioi_han_tong),
+          gioi_han_moi_user = VALUES(gioi_han_moi_user),
+          so_slot = VALUES(so_slot),
+          updated_at = NOW()
+    """), {"km": km_id, "tong": gioi_han_tong, "mu": gioi_han_moi_user, "ns": so_slot})
+
+    # Khóa các slot cũ trong lúc chia lại
+    db.execute(
+        text("SELECT slot FROM khuyen_mai_quota_slot WHERE khuyen_mai_id = :km FOR UPDATE"),
+        {"km": km_id},
+    ).all()
+    used = int(db.execute(
+        text(f"SELECT COUNT(*) FROM ve_khuyen_mai WHERE khuyen_mai_id = :km{_live(db)}"), {"km": km_id}
+    ).scalar() or 0)
+    db.execute(text("DELETE FROM khuyen_mai_quota_slot WHERE khuyen_mai_id = :km"), {"km": km_id})
+    if gioi_han_tong is not None:
+        remain = max(0, int(gioi_han_tong) - used)
+        base, extra = divmod(remain, so_slot)
+        db.execute(text("""
+            INSERT INTO khuyen_mai_quota_slot (khuyen_mai_id, slot, con_lai)
+            VALUES (:km, :s, :n)
+        """), [{"km": km_id, "s": i, "n": base + (1 if i < extra else 0)} for i in range(so_slot)])
+    return get_quota(db, km_id)
+
+
+def get_quota(db, km_id: int) -> dict | None:
+    row = db.execute(text(f"""
+        SELECT q.gioi_han_tong, q.gioi_han_moi_user, q.so_slot,
+               (SELECT COALESCE(SUM(con_lai), 0) FROM khuyen_mai_quota_slot s
+                WHERE s.khuyen_mai_id = q.khuyen_mai_id) AS con_lai,
+               (SELECT COUNT(*) FROM ve_khuyen_mai l
+                WHERE l.khuyen_mai_id = q.khuyen_mai_id{_live(db, "l.")}) AS da_dung
+        FROM khuyen_mai_quota q
+        WHERE q.khuyen_mai_id = :km
+    """), {"km": km_id}).mappings().first()
+    if not row:
+        return None
+    return {
+        "khuyen_mai_id": km_id,
+        "gioi_han_tong": row["gioi_han_tong"],
+        "gioi_han_moi_user": row["gioi_han_moi_user"],
+        "so_slot": int(row["so_slot"]),
+        "con_lai": int(row["con_lai"]) if row["gioi_han_tong"] is not None else None,
+        "da_dung": int(row["da_dung"]),
+    }
+
+
+def migrate(db) -> dict:
+    """Thêm ve_khuyen_mai.da_hoan cho DB tạo bảng trước khi có cột (chạy lại được)."""
+    out = {"altered": False}
+    has = db.execute(text("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 've_khuyen_mai' AND COLUMN_NAME = 'da_hoan'
+    """)).first()
+    if not has:
+        db.execute(text("ALTER TABLE ve_khuyen_mai ADD COLUMN da_hoan TINYINT NOT NULL DEFAULT 0"))
+        out["altered"] = True
+    db.commit()
+    schema.refresh(db)
+    return out
@@ -0,0 +1,104 @@
+# app/services/search_index.py
+"""
+Chỉ mục tìm kiếm vé cho staff (/ve/admin/list?q=...):
+- Mỗi vé 1 dòng ve_tim_kiem(ve_id, trang_thai, noi_dung)
+- noi_dung = "#id username tên sự kiện tên trò chơi" đã bỏ dấu tiếng Việt + lowercase
+- FULLTEXT (parser ngram) trên noi_dung => MATCH ... AGAINST thay cho LIKE '%q%' qua 3 bảng join
+- Đồng bộ: index_tickets() khi đặt vé, set_status() khi đổi trạng thái,
+  reindex_by_item() khi đổi tên sự kiện/trò chơi, rebuild() để backfill.
+Commit do caller kiểm soát (trừ rebuild chạy theo lô).
+"""
+from sqlalchemy import text
+import unicodedata
+
+NGRAM_MIN = 2  # ngram_token_size mặc định của MySQL
+
+
+def fold(s: str | None) -> str:
+    """Bỏ dấu tiếng Việt: 'Đua Xe Mô Tô' -> 'dua xe mo to'."""
+    s = unicodedata.normalize("NFD", s or "")
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    return s.replace("đ", "d").replace("Đ", "D").lower().strip()
+
+
+def _doc(r) -> str:
+    parts = [f"#{r['id']}", r["username"], r["ten_su_kien"], r["ten_tro_choi"]]
+    return fold(" ".join(p for p in parts if p))
+
+
+def _index_where(db, where: str, params: dict) -> int:
+    rows = db.execute(text(f"""
+        SELECT v.id, v.trang_thai, u.username,
+               sk.ten AS ten_su_kien, tc.ten AS ten_tro_choi
+        FROM ve v
+        JOIN users u ON u.id = v.user_id
+        LEFT JOIN su_kien sk ON sk.id = v.su_kien_id
+        LEFT JOIN tro_choi tc ON tc.id = v.tro_choi_id
+        WHERE {where}
+    """), params).mappings().all()
+    if not rows:
+        return 0
+    db.execute(text("""
+        INSERT INTO ve_tim_kiem (ve_id, trang_thai, noi_dung, updated_at)
+        VALUES (:id, :st, :doc, NOW())
+        ON DUPLICATE KEY UPDATE
+          trang_thai = VALUES(trang_thai),
+          noi_dung = VALUES(noi_dung),
+          updated_at = NOW()
+    """), [{"id": r["id"], "st": r["trang_thai"], "doc": _doc(r)} for r in rows])
+    return len(rows)
+
+
+def index_tickets(db, ve_ids) -> int:
+    ids = tuple(int(i) for i in ve_ids)
+    if not ids:
+        return 0
+    return _index_where(db, "v.id IN :ids", {"ids": ids})
+
+
+def reindex_by_item(db, su_kien_id: int | None = None, tro_choi_id: int | None = None) -> int:
+    if su_kien_id is not None:
+        return _index_where(db, "v.su_kien_id = :id", {"id": int(su_kien_id)})
+    if tro_choi_id is not None:
+        return _index_where(db, "v.tro_choi_id = :id", {"id": int(tro_choi_id)})
+    return 0
+
+
+def set_status(db, ve_ids, trang_thai: str) -> None:
+    ids = tuple(int(i) for i in ve_ids)
+    if not ids:
+        return
+    db.execute(
+        text("UPDATE ve_tim_kiem SET trang_thai = :st, updated_at = NOW() WHERE ve_id IN :ids"),
+        {"st": trang_thai, "ids": ids},
+    )
+
+
+def rebuild(db, chunk: int = 5000) -> int:
+    """Backfill toàn bộ theo khoảng id, commit mỗi lô để không giữ khóa lâu."""
+    last_id, total = 0, 0
+    while True:
+        hi = db.execute(
+            text("SELECT MAX(id) FROM (SELECT id FROM ve WHERE id > :lo ORDER BY id LIMIT :n) t"),
+            {"lo": last_id, "n": chunk},
+        ).scalar()
+        if hi is None:
+            break
+        total += _index_where(db, "v.id > :lo AND v.id <= :hi", {"lo": last_id, "hi": int(hi)})
+        db.commit()
+        last_id = int(hi)
+    return total
+
+
+def match_clause(q: str) -> tuple[str, dict]:
+    """
+    Điều kiện SQL trên bảng ve_tim_kiem cho từ khoá q.
+    - Mỗi từ >= 2 ký tự: MATCH ... AGAINST ('+"tu"' IN BOOLEAN MODE) (dùng FULLTEXT ngram)
+    - Từ khoá quá ngắn: LIKE trên bảng ve_tim_kiem (nhỏ hơn nhiều so với join 3 bảng)
+    """
+    folded = fold(q)
+    words = [w.replace('"', "") for w in folded.split() if w.replace('"', "")]
+    if words and all(len(w) >= NGRAM_MIN for w in words):
+        expr = " ".join(f'+"{w}"' for w in words)
+        return "MATCH(ve_tim_kiem.noi_dung) AGAINST (:fts IN BOOLEAN MODE)", {"fts": expr}
+    return "ve_tim_kiem.noi_dung LIKE :like", {"like": f"%{folded}%"}
@@ -0,0 +1,165 @@
+# app/services/ticket_expiry.py
+"""
+Quét vé BOOKED / PENDING quá hạn => CANCELLED (hoàn tồn kho, cập nhật chỉ mục).
+
+- Chọn ứng viên qua index (trang_thai, created_at): ORDER BY created_at LIMIT :n,
+  không khóa gì ở bước này.
+- Mỗi lô đi qua ticket_state.transition (khóa đúng các id trong lô, UPDATE có điều kiện
+  trang_thai) rồi commit ngay => không giữ khóa lâu trên bảng ve.
+- Mỗi lần chạy tối đa MAX_BATCHES lô; phần còn lại để lần sau.
+- Mỗi worker uvicorn có 1 sweeper nhưng chỉ 1 nơi quét tại 1 thời điểm (sweep_locked: GET_LOCK);
+  nơi khác bỏ lượt đó.
+- Index (trang_thai, created_at) trên DB cũ: migrate() là 1 bước auto_migrate.
+- metrics(): số dòng xử lý lần chạy gần nhất + cộng dồn.
+
+Cấu hình .env:
+  TICKET_SWEEPER (1/0), TICKET_SWEEP_INTERVAL (giây), TICKET_SWEEP_BATCH, TICKET_SWEEP_MAX_BATCHES,
+  TICKET_BOOKED_TTL_MIN (mặc định 30 phút), TICKET_PENDING_TTL_MIN (mặc định 1440 phút)
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+from ..db import locked_session
+from . import ticket_state
+
+LOCK_NAME = "trungtamgiaitri.ticket_expiry"
+MIGRATION = "ve.ix_ve_trangthai_created"
+
+TTL_MINUTES = {
+    "BOOKED": int(os.getenv("TICKET_BOOKED_TTL_MIN", "30")),
+    # PENDING = khách đã báo chuyển khoản, chờ staff duyệt => cho lâu hơn
+    "PENDING": int(os.getenv("TICKET_PENDING_TTL_MIN", "1440")),
+}
+BATCH_SIZE = int(os.getenv("TICKET_SWEEP_BATCH", "200"))
+MAX_BATCHES = int(os.getenv("TICKET_SWEEP_MAX_BATCHES", "50"))
+
+_stats = {
+    "runs": 0,
+    "expired_total": 0,
+    "errors": 0,
+    "last_run_at": None,
+    "last_run_ms": 0.0,
+    "last_run_expired": {},
+    "last_run_batches": 0,
+    "skipped_locked": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _candidates(db, trang_thai: str, ttl_min: int, limit: int) -> list[int]:
+    # created_at do ORM ghi bằng utcnow => so với UTC_TIMESTAMP(), không phải NOW()
+    return [
+        int(r[0])
+        for r in db.execute(
+            text("""
+                SELECT id FROM ve
+                WHERE trang_thai = :st
+                  AND created_at < UTC_TIMESTAMP() - INTERVAL :ttl MINUTE
+                ORDER BY created_at
+                LIMIT :n
+            """),
+            {"st": trang_thai, "ttl": int(ttl_min), "n": int(limit)},
+        ).all()
+    ]
+
+
+def sweep_once(db, batch_size: int = BATCH_SIZE, max_batches: int = MAX_BATCHES) -> dict:
+    """Chạy 1 lượt. Trả về {trạng thái: số vé đã hủy}."""
+    t0 = time.perf_counter()
+    expired = {st: 0 for st in TTL_MINUTES}
+    batches = 0
+    try:
+        for st, ttl in TTL_MINUTES.items():
+            if ttl <= 0:
+                continue
+            while batches < max_batches:
+                ids = _candidates(db, st, ttl, batch_size)
+                if not ids:
+                    db.rollback()
+                    break
+                res = ticket_state.transition(db, ids, "CANCELLED", allowed_from=(st,))
+                db.commit()
+                batches += 1
+                expired[st] += len(res["changed"])
+                if len(ids) < batch_size:
+                    break
+    except Exception:
+        db.rollback()
+        with _stats_lock:
+            _stats["errors"] += 1
+        raise
+    finally:
+        with _stats_lock:
+            _stats["runs"] += 1
+            _stats["expired_total"] += sum(expired.values())
+            _stats["last_run_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            _stats["last_run_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            _stats["last_run_expired"] = dict(expired)
+            _stats["last_run_batches"] = batches
+    return expired
+
+
+def sweep_locked(batch_size: int = BATCH_SIZE, max_batches: int = MAX_BATCHES) -> dict | None:
+    """sweep_once dưới GET_LOCK; process khác đang quét => None."""
+    with locked_session(LOCK_NAME) as db:
+        if db is None:
+            with _stats_lock:
+                _stats["skipped_locked"] += 1
+            return None
+        return sweep_once(db, batch_size, max_batches)
+
+
+# ---------- Migration ----------
+def migrate(db) -> dict:
+    """Thêm index (trang_thai, created_at) cho bảng ve nếu thiếu. Chạy lại được; DDL MySQL tự commit."""
+    out = {"altered": False}
+    exists = db.execute(text("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 've' AND INDEX_NAME = 'ix_ve_trangthai_created'
+        LIMIT 1
+    """)).first()
+    if not exists:
+        db.execute(text("ALTER TABLE ve ADD INDEX ix_ve_trangthai_created (trang_thai, created_at)"))
+        out["altered"] = True
+    db.commit()
+    return out
+
+
+def metrics() -> dict:
+    with _stats_lock:
+        out = dict(_stats)
+    out["ttl_minutes"] = dict(TTL_MINUTES)
+    return out
+
+
+class ExpirySweeper:
+    def __init__(self, interval: float = 60.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ticket-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                sweep_locked()
+            except Exception:
+                pass  # đã ghi vào _stats["errors"]
+            self._stop.wait(self.interval)
+
+
+expiry_sweeper = ExpirySweeper(interval=float(os.getenv("TICKET_SWEEP_INTERVAL", "60")))
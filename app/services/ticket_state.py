@@ -0,0 +1,145 @@
+# app/services/ticket_state.py
+"""
+Máy trạng thái vé (một chỗ duy nhất quy định chuyển trạng thái hợp lệ + tác vụ kèm theo).
+
+    BOOKED/UNPAID --mark-paid--> PENDING --review--> PAID --> CHECKIN --> USED
+          \\________ approve (STAFF) ___________/^
+    BOOKED/PENDING/UNPAID --> CANCELLED          PENDING --reject--> BOOKED
+
+Tác vụ kèm theo khi vào trạng thái:
+- PAID: ghi outbox VE_PAID (cộng điểm / thử thách do worker xử lý theo lô)
+- CHECKIN (hoặc PAID -> USED thẳng) với vé sự kiện: ghi outbox EVENT_ATTENDED (tiến độ thử thách)
+- CHECKIN (hoặc PAID -> USED thẳng) với vé trò chơi: thêm dòng lich_su_choi => listener ghi
+  outbox GAME_PLAYED (chỉ số GAMES_PLAYED / DISTINCT_GAMES, gợi ý trò chơi) + trả chỗ tồn kho
+  (trò chơi không có suất: chỗ chỉ bị giữ tới lúc vào cổng)
+- CANCELLED: hoàn tồn kho (gộp theo sự kiện / trò chơi) + hoàn lượt khuyến mãi
+- mọi trạng thái: cập nhật ve_tim_kiem.trang_thai + tăng phiên bản vé của user (ETag /ve/me)
+
+transition() dùng cho cả 1 vé lẫn N vé: 1 SELECT ... FOR UPDATE, 1 UPDATE ... WHERE id IN (...)
+AND trang_thai IN (...), tác vụ kèm theo đều theo lô. KHÔNG commit.
+"""
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from . import inventory, outbox, promo_quota, search_index, versions
+from ..models import LichSuChoi
+from ..schema_registry import schema
+
+ALLOWED_FROM = {
+    "PENDING": ("BOOKED", "UNPAID"),
+    "PAID": ("BOOKED", "PENDING", "UNPAID"),
+    "BOOKED": ("PENDING",),
+    "CANCELLED": ("BOOKED", "PENDING", "UNPAID"),
+    "CHECKIN": ("PAID",),
+    "USED": ("PAID", "CHECKIN"),
+}
+
+MAX_BULK = 500
+
+
+def can_transition(src: str | None, dst: str) -> bool:
+    return (src or "") in ALLOWED_FROM.get(dst, ())
+
+
+def _release(db, rows) -> None:
+    """Hoàn tồn kho gộp theo sự kiện / trò chơi."""
+    qty = defaultdict(int)
+    for r in rows:
+        qty[(r.su_kien_id, r.tro_choi_id)] += int(r.so_luong or 1)
+    for (sk_id, tc_id), n in sorted(qty.items(), key=lambda kv: (kv[0][0] or 0, kv[0][1] or 0)):
+        inventory.release(db, n, su_kien_id=sk_id, tro_choi_id=tc_id)
+
+
+def _record_plays(db, rows) -> None:
+    """1 dòng lich_su_choi / vé trò chơi vào cổng (khách có hồ sơ khach_hang)."""
+    uids = tuple(sorted({int(r.user_id) for r in rows if r.user_id is not None}))
+    if not uids:
+        return
+    owners = dict(db.execute(
+        text("SELECT user_id, MIN(id) FROM khach_hang WHERE user_id IN :ids GROUP BY user_id"),
+        {"ids": uids},
+    ).all())
+    plays = [
+        LichSuChoi(khach_hang_id=owners[r.user_id], tro_choi_id=r.tro_choi_id)
+        for r in rows
+        if r.user_id in owners
+    ]
+    if plays:
+        db.add_all(plays)
+        db.flush()
+
+
+def transition(db, ve_ids, target: str, allowed_from=None, nguon: str = "STAFF", revive: bool = False) -> dict:
+    """
+    Chuyển các vé `ve_ids` sang `target`.
+    allowed_from: thu hẹp thêm trạng thái nguồn (vd review chỉ nhận PENDING).
+    revive: PAID nhận thêm vé CANCELLED (tiền MoMo về sau khi hủy; caller đã giữ lại lượt KM + chỗ).
+    Trả về {"changed": [ids], "skipped": {id: lý do}}.
+    """
+    if target not in ALLOWED_FROM:
+        raise ValueError(f"Trạng thái đích không hợp lệ: {target}")
+    ids = sorted({int(i) for i in ve_ids})
+    if not ids:
+        return {"changed": [], "skipped": {}}
+
+    sources = ALLOWED_FROM[target]
+    if revive and target == "PAID":
+        sources = sources + ("CANCELLED",)
+    if allowed_from is not None:
+        sources = tuple(s for s in sources if s in allowed_from)
+
+    rows = db.execute(
+        text("""
+            SELECT id, user_id, trang_thai, tong_tien, so_luong, su_kien_id, tro_choi_id
+            FROM ve
+            WHERE id IN :ids
+            FOR UPDATE
+        """),
+        {"ids": tuple(ids)},
+    ).all()
+
+    found = {r.id: r for r in rows}
+    skipped = {}
+    ok = []
+    for i in ids:
+        r = found.get(i)
+        if r is None:
+            skipped[i] = "Vé không tồn tại"
+        elif r.trang_thai == target:
+            skipped[i] = f"Vé đã ở trạng thái {target}"
+        elif r.trang_thai not in sources:
+            skipped[i] = f"Không thể chuyển {r.trang_thai} -> {target}"
+        else:
+            ok.append(r)
+
+    if not ok:
+        return {"changed": [], "skipped": skipped}
+
+    ok_ids = tuple(r.id for r in ok)
+    paid_at = ", paid_at = NOW()" if target == "PAID" and schema.has(db, "ve", "paid_at") else ""
+    # updated_at cùng đồng hồ với TimeStampMixin (utcnow) => ETag /ve/me không bị lùi
+    db.execute(
+        text(f"""
+            UPDATE ve SET trang_thai = :dst, updated_at = UTC_TIMESTAMP(){paid_at}
+            WHERE id IN :ids AND trang_thai IN :src
+        """),
+        {"dst": target, "ids": ok_ids, "src": tuple(sources)},
+    )
+
+    if target == "PAID":
+        outbox.enqueue_tickets_paid(db, ok, nguon=nguon)
+    elif target in ("CHECKIN", "USED"):
+        # CHECKIN -> USED không tính thêm lần tham dự / lượt chơi
+        first = [r for r in ok if r.trang_thai == "PAID"]
+        outbox.enqueue_events_attended(db, [r for r in first if r.su_kien_id is not None])
+        games = [r for r in first if r.tro_choi_id is not None]
+        _record_plays(db, games)
+        _release(db, games)
+    elif target == "CANCELLED":
+        _release(db, ok)
+        promo_quota.release_tickets(db, ok_ids)
+    search_index.set_status(db, ok_ids, target)
+    versions.bump_tickets(db, (r.user_id for r in ok))
+
+    return {"changed": list(ok_ids), "skipped": skipped}
@@ -0,0 +1,45 @@
+# app/services/versions.py
+"""
+Bộ đếm phiên bản cho ETag (bảng phien_ban, tra theo khóa chính).
+
+- bump(): +1 trong CÙNG transaction với thay đổi dữ liệu (KHÔNG commit) => 2 lần ghi trong
+  cùng 1 giây vẫn ra 2 phiên bản khác nhau (MAX(updated_at) độ phân giải giây thì không).
+- Khóa: tickets_key(user_id) = danh sách vé của user (mọi chỗ ghi bảng ve),
+  CATALOG = tên / giá / ảnh sự kiện, trò chơi (được nhúng trong danh sách vé).
+- Khóa sắp xếp trước khi ghi => 2 transaction cùng bump nhiều khóa không deadlock.
+"""
+from sqlalchemy import text
+
+CATALOG = "danh_muc"
+
+
+def tickets_key(user_id: int) -> str:
+    return f"ve:{int(user_id)}"
+
+
+def bump(db, keys) -> None:
+    keys = sorted({str(k) for k in keys})
+    if not keys:
+        return
+    db.execute(
+        text("""
+            INSERT INTO phien_ban (khoa, phien) VALUES (:k, 1)
+            ON DUPLICATE KEY UPDATE phien = phien + 1
+        """),
+        [{"k": k} for k in keys],
+    )
+
+
+def bump_tickets(db, user_ids) -> None:
+    bump(db, (tickets_key(u) for u in user_ids if u is not None))
+
+
+def get(db, keys) -> dict[str, int]:
+    keys = tuple(sorted({str(k) for k in keys}))
+    if not keys:
+        return {}
+    rows = db.execute(
+        text("SELECT khoa, phien FROM phien_ban WHERE khoa IN :k"), {"k": keys}
+    ).all()
+    found = {k: int(v) for k, v in rows}
+    return {k: found.get(k, 0) for k in keys}
@@ -0,0 +1,78 @@
+// src/components/CursorPager.jsx
+import { useCallback, useRef, useState } from "react";
+import { Space, Button, Select } from "antd";
+
+/**
+ * Phân trang keyset cho bảng admin: nhớ next_cursor của từng trang đã đi qua
+ * (trang 1 = không cursor) => Trước / Sau không dùng OFFSET.
+ * Chỉ trang 1 xin tổng ước lượng (total=estimate); trang sau total=none => không COUNT(*) lại.
+ *
+ * fetchPage({ cursor, page_size, total }) -> { items, next_cursor, total }
+ */
+export function useCursorPager(fetchPage, { pageSize: initialSize = 20, onError } = {}) {
+  const cursors = useRef([null]); // cursors.current[i] = cursor để tải trang i + 1
+  const [page, setPage] = useState(1);
+  const [pageSize, setPageSize] = useState(initialSize);
+  const [rows, setRows] = useState([]);
+  const [total, setTotal] = useState(null);
+  const [hasNext, setHasNext] = useState(false);
+  const [loading, setLoading] = useState(false);
+
+  // load ổn định (dùng được trong useMemo / useCallback) nhưng luôn đọc bộ lọc + trang mới nhất
+  const latest = useRef({});
+  latest.current = { fetchPage, onError, page, pageSize };
+
+  // load(1) khi đổi bộ lọc; load() tải lại trang hiện tại (sau khi thao tác)
+  const load = useCallback(async (p, ps) => {
+    const cur = latest.current;
+    p = p ?? cur.page;
+    ps = ps ?? cur.pageSize;
+    if (p === 1 || ps !== cur.pageSize) {
+      cursors.current = [null];
+      p = 1;
+    }
+    setLoading(true);
+    try {
+      const data = await cur.fetchPage({
+        cursor: cursors.current[p - 1] || undefined,
+        page_size: ps,
+        total: p === 1 ? "estimate" : "none",
+      });
+      setRows(Array.isArray(data?.items) ? data.items : []);
+      cursors.current[p] = data?.next_cursor || null;
+      setHasNext(Boolean(data?.next_cursor));
+      if (p === 1) setTotal(data?.total ?? null);
+      setPage(p);
+      setPageSize(ps);
+    } catch (e) {
+      cur.onError?.(e);
+    } finally {
+      setLoading(false);
+    }
+  }, []);
+
+  return { rows, page, pageSize, total, hasNext, loading, load };
+}
+
+export default function CursorPager({ pager, sizes = [10, 20, 50, 100] }) {
+  const { page, pageSize, total, hasNext, loading, load } = pager;
+  return (
+    <Space style={{ marginTop: 12, width: "100%", justifyContent: "flex-end" }} wrap>
+      {total != null && <span style={{ color: "#888" }}>Khoảng {Number(total).toLocaleString("vi-VN")} dòng</span>}
+      <Button size="small" disabled={loading || page <= 1} onClick={() => load(page - 1)}>
+        ‹ Trước
+      </Button>
+      <span>Trang {page}</span>
+      <Button size="small" disabled={loading || !hasNext} onClick={() => load(page + 1)}>
+        Sau ›
+      </Button>
+      <Select
+        size="small"
+        value={pageSize}
+        onChange={(ps) => load(1, ps)}
+        options={sizes.map((n) => ({ value: n, label: `${n} / trang` }))}
+        style={{ width: 110 }}
+      />
+    </Space>
+  );
+}
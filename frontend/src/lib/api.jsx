@@ -171,6 +171,10 @@ export function apiBookTicket(payload) {
 export function apiBookGameTicket(payload) {
   return apiFetch(`/ve/book-game`, { method: "POST", body: payload });
 }
+export function apiCheckout(payload) {
+  // payload: { items: [{ su_kien_id | tro_choi_id, so_luong }], promo_id? }
+  return apiFetch(`/ve/checkout`, { method: "POST", body: payload });
+}
 export function apiCancelTicket(id) {
   return apiFetch(`/ve/cancel/${id}`, { method: "POST" });
 }
@@ -181,11 +185,17 @@ export function apiReviewTicket(id, approve) {
   return apiFetch(`/ve/review/${id}`, { method: "POST", body: { approve } });
 }
 export const apiAdminReviewTicket = apiReviewTicket;
-export function apiAdminListTickets({ status, q = "", page = 1, page_size = 20 } = {}) {
+export function apiBulkTickets(ids, action) {
+  // action: "approve" | "checkin" | "cancel" => { changed: [id], skipped: [{ id, reason }] }
+  return apiFetch(`/nhan-vien/ops/ve/bulk`, { method: "POST", body: { ids, action } });
+}
+// Danh sách admin: phân trang bằng cursor (next_cursor của trang trước), total = estimate | none | exact
+export function apiAdminListTickets({ status, q = "", cursor, page_size = 20, total } = {}) {
   const qs = new URLSearchParams();
   if (status) qs.set("status", status);
   if (q) qs.set("q", q);
-  qs.set("page", page);
+  if (cursor) qs.set("cursor", cursor);
+  if (total) qs.set("total", total);
   qs.set("page_size", page_size);
   return apiFetch(`/ve/admin/list?${qs.toString()}`);
 }
@@ -290,9 +300,11 @@ export function apiDeleteStaff(id) {
 }
 
 /* ========================== ADMIN USERS ============================== */
-export function apiAdminListUsers({ q = "", role, page = 1, page_size = 20 } = {}) {
-  const qs = new URLSearchParams({ q, page, page_size });
+export function apiAdminListUsers({ q = "", role, cursor, page_size = 20, total } = {}) {
+  const qs = new URLSearchParams({ q, page_size });
   if (role) qs.set("role", role);
+  if (cursor) qs.set("cursor", cursor);
+  if (total) qs.set("total", total);
   return apiFetch(`/admin/users?${qs.toString()}`);
 }
 export function apiAdminSetRole(id, role) {
@@ -2,6 +2,7 @@
 import { useEffect, useState } from "react";
 import { Table, Tag, Space, Select, Button, Input, message } from "antd";
 import { apiAdminListTickets, apiAdminReviewTicket, apiFetch } from "../lib/api";
+import CursorPager, { useCursorPager } from "../components/CursorPager";
 
 const statusOptions = [
   { value: "PENDING", label: "PENDING" },
@@ -20,30 +21,16 @@ function StatusTag({ s }) {
 }
 
 export default function AdminTicketsPage() {
-  const [loading, setLoading] = useState(false);
-  const [rows, setRows] = useState([]);
-  const [total, setTotal] = useState(0);
-  const [page, setPage] = useState(1);
-  const [pageSize, setPageSize] = useState(20);
   const [q, setQ] = useState("");
   const [status, setStatus] = useState("PENDING");
 
-  const load = async (p = page, ps = pageSize) => {
-    setLoading(true);
-    try {
-      const data = await apiAdminListTickets({ status, q, page: p, page_size: ps });
-      setRows(data.items || []);
-      setTotal(data.total || 0);
-      setPage(p);
-      setPageSize(ps);
-    } catch (e) {
-      message.error(e.message || "Lỗi tải vé");
-    } finally {
-      setLoading(false);
-    }
-  };
+  const pager = useCursorPager(
+    (opts) => apiAdminListTickets({ status, q, ...opts }),
+    { onError: (e) => message.error(e.message || "Lỗi tải vé") }
+  );
+  const load = pager.load;
 
-  useEffect(() => { load(1, pageSize); /* eslint-disable-line */ }, [q, status]);
+  useEffect(() => { pager.load(1); /* eslint-disable-line */ }, [q, status]);
 
   // ---- Actions ----
   const doApprove = async (rec) => {
@@ -148,22 +135,17 @@ export default function AdminTicketsPage() {
           style={{ width: 180 }}
           options={statusOptions}
         />
-        <Button onClick={() => load(1, pageSize)}>Làm mới</Button>
+        <Button onClick={() => pager.load(1)}>Làm mới</Button>
       </Space>
 
       <Table
         rowKey="id"
-        loading={loading}
+        loading={pager.loading}
         columns={columns}
-        dataSource={rows}
-        pagination={{
-          current: page,
-          pageSize,
-          total,
-          showSizeChanger: true,
-          onChange: (p, ps) => load(p, ps),
-        }}
+        dataSource={pager.rows}
+        pagination={false}
       />
+      <CursorPager pager={pager} />
     </div>
   );
 }
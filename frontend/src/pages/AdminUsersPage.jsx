@@ -22,6 +22,7 @@ import {
 } from "../lib/api";
 import { useAuth } from "../auth/AuthContext";
 import SupportChatDrawer from "../components/SupportChatDrawer"; // ✅ Drawer chat 1-1
+import CursorPager, { useCursorPager } from "../components/CursorPager";
 
 const roleOptions = [
   { value: "ADMIN", label: "ADMIN" },
@@ -44,11 +45,6 @@ const TIER_COLOR = {
 
 export default function AdminUsersPage() {
   const { user } = useAuth();
-  const [loading, setLoading] = useState(false);
-  const [rows, setRows] = useState([]);
-  const [total, setTotal] = useState(0);
-  const [page, setPage] = useState(1);
-  const [pageSize, setPageSize] = useState(20);
   const [q, setQ] = useState("");
   const [roleFilter, setRoleFilter] = useState();
 
@@ -60,29 +56,15 @@ export default function AdminUsersPage() {
   const [chatOpen, setChatOpen] = useState(false);
   const [chatUid, setChatUid] = useState(null);
 
-  // ===== Load danh sách người dùng =====
-  const load = async (p = page, ps = pageSize) => {
-    setLoading(true);
-    try {
-      const data = await apiAdminListUsers({
-        q,
-        role: roleFilter,
-        page: p,
-        page_size: ps,
-      });
-      setRows(data.items || []);
-      setTotal(data.total || 0);
-      setPage(p);
-      setPageSize(ps);
-    } catch (e) {
-      message.error(e.message || "Lỗi tải danh sách người dùng");
-    } finally {
-      setLoading(false);
-    }
-  };
+  // ===== Load danh sách người dùng (cursor) =====
+  const pager = useCursorPager(
+    (opts) => apiAdminListUsers({ q, role: roleFilter, ...opts }),
+    { onError: (e) => message.error(e.message || "Lỗi tải danh sách người dùng") }
+  );
+  const load = pager.load;
 
   useEffect(() => {
-    load(1, pageSize);
+    pager.load(1);
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [q, roleFilter]);
 
@@ -234,7 +216,7 @@ export default function AdminUsersPage() {
         />
         <Button
           icon={<ReloadOutlined />}
-          onClick={() => load(1, pageSize)}
+          onClick={() => pager.load(1)}
         >
           Làm mới
         </Button>
@@ -243,18 +225,13 @@ export default function AdminUsersPage() {
       {/* Bảng danh sách */}
       <Table
         rowKey="id"
-        loading={loading}
+        loading={pager.loading}
         columns={columns}
-        dataSource={rows}
-        pagination={{
-          current: page,
-          pageSize,
-          total,
-          showSizeChanger: true,
-          onChange: (p, ps) => load(p, ps),
-        }}
+        dataSource={pager.rows}
+        pagination={false}
         scroll={{ x: 850 }}
       />
+      <CursorPager pager={pager} />
 
       {/* Modal đặt lại mật khẩu */}
       <Modal
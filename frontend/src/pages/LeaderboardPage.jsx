@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useState } from "react";
-import { Card, Table, Typography, Tag, Spin } from "antd";
+import { Card, Table, Typography, Tag, Spin, Segmented } from "antd";
 import { CrownFilled } from "@ant-design/icons";
 import { apiFetch } from "../lib/api";
 import "./leaderboard.css";
@@ -15,6 +15,12 @@ const tierColor = (code) => {
   }
 };
 
+const PERIODS = [
+  { value: "weekly", label: "Tuần này", title: "tuần này" },
+  { value: "monthly", label: "Tháng này", title: "tháng này" },
+  { value: "all-time", label: "Toàn thời gian", title: "toàn thời gian" },
+];
+
 function AvatarCircle({ name, rank }) {
   const initials = (name || "?")
     .trim()
@@ -31,34 +37,50 @@ function AvatarCircle({ name, rank }) {
 
 export default function LeaderboardPage() {
   const [rows, setRows] = useState([]);
+  const [range, setRange] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [period, setPeriod] = useState("weekly");
 
   useEffect(() => {
-    apiFetch("/leaderboard/weekly")
-      .then(setRows)
+    setLoading(true);
+    // /all-time trả mảng; /weekly, /monthly trả { tu_ngay, den_ngay, items }
+    apiFetch(`/leaderboard/${period}`)
+      .then((res) => {
+        setRows(Array.isArray(res) ? res : res?.items || []);
+        setRange(res?.tu_ngay && res?.den_ngay ? [res.tu_ngay, res.den_ngay] : null);
+      })
       .finally(() => setLoading(false));
-  }, []);
+  }, [period]);
 
   const top3 = useMemo(() => rows.slice(0, 3), [rows]);
   const others = useMemo(() => rows.slice(3), [rows]);
 
-  if (loading) {
-    return (
-      <div style={{ textAlign: "center", padding: 60 }}>
-        <Spin />
-      </div>
-    );
-  }
+  const periodTitle = PERIODS.find((p) => p.value === period)?.title;
 
   return (
     <div className="lb-wrap">
       <Title level={3} style={{ marginBottom: 4 }}>
-        🏆 Bảng xếp hạng (toàn thời gian)
+        🏆 Bảng xếp hạng ({periodTitle})
       </Title>
+      {range && (
+        <Text type="secondary" style={{ display: "block" }}>
+          {range[0]} → {range[1]}
+        </Text>
+      )}
       <Text type="secondary">
-        Ưu tiên <b>điểm cao</b>; nếu bằng điểm thì xếp theo <b>tổng số vé TRÒ CHƠI đã thanh toán</b>.<br />
-        Hạng thành viên: <b>Bạc (≥100)</b> • <b>Vàng (≥500)</b> • <b>Kim cương (≥1000)</b>.
+        Ưu tiên <b>điểm cao</b>; nếu bằng điểm thì xếp theo <b>tổng số vé TRÒ CHƠI đã thanh toán</b> trong kỳ.<br />
+        Hạng thành viên (theo tổng điểm tích lũy): <b>Bạc (≥100)</b> • <b>Vàng (≥500)</b> • <b>Kim cương (≥1000)</b>.
       </Text>
+      <div style={{ margin: "12px 0" }}>
+        <Segmented options={PERIODS} value={period} onChange={setPeriod} />
+      </div>
+
+      {loading ? (
+        <div style={{ textAlign: "center", padding: 60 }}>
+          <Spin />
+        </div>
+      ) : (
+      <>
 
       {/* ==== PODIUM ==== */}
       {top3.length > 0 && (
@@ -133,7 +155,7 @@ export default function LeaderboardPage() {
               render: (_, r) => <Tag color={tierColor(r.tier_code)}>{r.tier_label}</Tag>,
             },
             {
-              title: "Lượt chơi (tổng)",
+              title: "Lượt chơi",
               dataIndex: "so_luot_choi",
               align: "right",
               width: 160,
@@ -143,6 +165,8 @@ export default function LeaderboardPage() {
           pagination={false}
         />
       </Card>
+      </>
+      )}
     </div>
   );
 }
@@ -12,6 +12,7 @@ import {
   Form,
   Input,
   InputNumber,
+  Select,
   DatePicker,
   Popconfirm,
 } from "antd";
@@ -22,6 +23,15 @@ const { Title, Text } = Typography;
 const { RangePicker } = DatePicker;
 
 export default function MyGamify() {
+  // --- Chỉ số thử thách (GET /gamify/metrics) ---
+  const [metrics, setMetrics] = useState({ default: "PLAY_COUNT", items: [] });
+  const metricMap = useMemo(
+    () => Object.fromEntries(metrics.items.map((m) => [m.code, m])),
+    [metrics]
+  );
+  const metricOf = (code) =>
+    metricMap[code || metrics.default] || { label: code || metrics.default, unit: "" };
+
   // --- ME ---
   const [loading, setLoading] = useState(false);
   const [score, setScore] = useState(0);
@@ -75,9 +85,21 @@ export default function MyGamify() {
     }
   };
 
+  const loadMetrics = async () => {
+    try {
+      const data = await apiFetch("/gamify/metrics");
+      if (Array.isArray(data?.items)) {
+        setMetrics({ default: data.default || "PLAY_COUNT", items: data.items });
+      }
+    } catch {
+      // giữ nhãn = mã chỉ số
+    }
+  };
+
   useEffect(() => {
     detectAdmin();
     loadMe();
+    loadMetrics();
   }, []);
 
   useEffect(() => {
@@ -89,6 +111,7 @@ export default function MyGamify() {
   const onCreate = () => {
     setEditing(null);
     form.resetFields();
+    form.setFieldsValue({ loai_chi_so: metrics.default });
     setOpen(true);
   };
 
@@ -98,6 +121,7 @@ export default function MyGamify() {
       ten_thu_thach: r.ten_thu_thach,
       muc_tieu: r.muc_tieu,
       diem_thuong: r.diem_thuong,
+      loai_chi_so: r.loai_chi_so || metrics.default,
       range: [dayjs(r.ngay_bat_dau), dayjs(r.ngay_ket_thuc)],
     });
     setOpen(true);
@@ -125,6 +149,7 @@ export default function MyGamify() {
         ten_thu_thach: v.ten_thu_thach,
         muc_tieu: Number(v.muc_tieu || 0),
         diem_thuong: Number(v.diem_thuong || 0),
+        loai_chi_so: v.loai_chi_so || "PLAY_COUNT",
         ngay_bat_dau: start ? start.format("YYYY-MM-DD HH:mm:ss") : undefined,
         ngay_ket_thuc: end ? end.format("YYYY-MM-DD HH:mm:ss") : undefined,
       };
@@ -156,6 +181,12 @@ export default function MyGamify() {
     () => [
       { title: "Mã", dataIndex: "ma_thu_thach", width: 120 },
       { title: "Tên thử thách", dataIndex: "ten_thu_thach" },
+      {
+        title: "Chỉ số",
+        dataIndex: "loai_chi_so",
+        width: 200,
+        render: (v) => metricOf(v).label,
+      },
       { title: "Mục tiêu", dataIndex: "muc_tieu", width: 100, align: "right" },
       {
         title: "Điểm thưởng",
@@ -192,7 +223,8 @@ export default function MyGamify() {
         ),
       },
     ],
-    []
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+    [metrics]
   );
 
   return (
@@ -223,6 +255,7 @@ export default function MyGamify() {
             const pct = goal > 0 ? Math.min(100, Math.round((got / goal) * 100)) : 0;
             const dStart = t.tuan_bat_dau ? String(t.tuan_bat_dau) : "";
             const dEnd = t.tuan_ket_thuc ? String(t.tuan_ket_thuc) : "";
+            const metric = metricOf(t.loai_chi_so);
 
             return (
               <Card
@@ -237,13 +270,13 @@ export default function MyGamify() {
               >
                 <Space direction="vertical" style={{ width: "100%" }} size={6}>
                   <Text>
-                    Mục tiêu: <b>{goal}</b> • Điểm thưởng:{" "}
+                    {metric.label}: <b>{goal.toLocaleString("vi-VN")}</b> • Điểm thưởng:{" "}
                     <b>{Number(t.diem_thuong || 0).toLocaleString("vi-VN")}</b> •{" "}
                     {dStart && dEnd ? `${dStart} → ${dEnd}` : ""}
                   </Text>
                   <Progress percent={pct} />
                   <Text type="secondary">
-                    {got}/{goal} lượt
+                    {got.toLocaleString("vi-VN")}/{goal.toLocaleString("vi-VN")} {metric.unit}
                   </Text>
                 </Space>
               </Card>
@@ -291,6 +324,11 @@ export default function MyGamify() {
           >
             <Input maxLength={255} />
           </Form.Item>
+          <Form.Item name="loai_chi_so" label="Chỉ số" rules={[{ required: true }]}>
+            <Select
+              options={metrics.items.map((m) => ({ value: m.code, label: m.label }))}
+            />
+          </Form.Item>
           <Form.Item name="muc_tieu" label="Mục tiêu" rules={[{ required: true }]}>
             <InputNumber min={1} style={{ width: "100%" }} />
           </Form.Item>
@@ -170,6 +170,7 @@ const TIER_OPTIONS = [
 ];
 
 function tryParseJSON(s) {
+  if (s && typeof s === "object") return s;
   if (!s || typeof s !== "string") return null;
   try {
     const o = JSON.parse(s);
@@ -187,13 +188,18 @@ function prettyCondition(cond, eventsDict) {
   const parts = [];
   if (cond.min_amount) parts.push(`Áp dụng hóa đơn từ ${Number(cond.min_amount).toLocaleString("vi-VN")} đ`);
   if (cond.member_only) parts.push("Chỉ áp dụng cho thành viên");
+  if (cond.min_tier_rank) parts.push(`Từ bậc ${TIER_OPTIONS[cond.min_tier_rank - 1]?.label || cond.min_tier_rank}`);
   if (Array.isArray(cond.member_tiers) && cond.member_tiers.length) {
     const names = cond.member_tiers
-      .map((v) => TIER_OPTIONS.find((o) => o.value === String(v).toUpperCase())?.label || String(v))
+      .map((v) => String(v).toUpperCase())
+      .map((v) => TIER_OPTIONS.find((o) => o.value === (v === "THUONG" ? "STANDARD" : v))?.label || v)
       .join(", ");
     parts.push(`Bậc: ${names}`);
   }
-  if (cond.event_id) parts.push(`Cho sự kiện: ${eventsDict?.[cond.event_id] || `#${cond.event_id}`}`);
+  const evIds = Array.isArray(cond.event_ids) ? cond.event_ids : cond.event_id ? [cond.event_id] : [];
+  if (evIds.length)
+    parts.push(`Cho sự kiện: ${evIds.map((id) => eventsDict?.[id] || `#${id}`).join(", ")}`);
+  if (cond.raw) parts.push(String(cond.raw));
   return parts.join(" · ");
 }
 
@@ -249,9 +255,10 @@ export default function PromotionPage() {
       thoi_gian_kt: p.thoi_gian_kt ? dayjs(p.thoi_gian_kt) : undefined,
       cond_min_amount: parsed?.min_amount ?? null,
       cond_member_only: !!parsed?.member_only,
-      cond_member_tiers: parsed?.member_tiers?.map((x) => String(x).toUpperCase()) || [],
-      cond_event_id: parsed?.event_id ?? undefined,
-      dieu_kien_text: parsed ? "" : (p.dieu_kien || ""),
+      cond_member_tiers:
+        parsed?.member_tiers?.map((x) => (String(x).toUpperCase() === "THUONG" ? "STANDARD" : String(x).toUpperCase())) || [],
+      cond_event_id: parsed?.event_ids?.[0] ?? parsed?.event_id ?? undefined,
+      dieu_kien_text: parsed ? (parsed.raw || "") : (p.dieu_kien || ""),
       active: Number(p.active ?? 1),
     });
     setOpen(true);
@@ -1,21 +1,18 @@
 import { useEffect, useMemo, useState } from "react";
 import { Table, Tag, Space, Button, Input, Select, message } from "antd";
-import { apiFetch } from "../lib/api";
+import { apiAdminListTickets, apiFetch } from "../lib/api";
 import SupportChatDrawer from "../components/SupportChatDrawer";
+import CursorPager, { useCursorPager } from "../components/CursorPager";
 
 const STATUS_OPTS = [
   { value: "PENDING", label: "PENDING" },
   { value: "BOOKED",  label: "BOOKED"  },
   { value: "PAID",    label: "PAID"    },
+  { value: "CHECKIN", label: "CHECKIN" },
   { value: "CANCELLED", label: "CANCELLED" },
 ];
 
 export default function StaffTickets() {
-  const [rows, setRows] = useState([]);
-  const [total, setTotal] = useState(0);
-  const [page, setPage] = useState(1);
-  const [pageSize, setPageSize] = useState(20);
-  const [loading, setLoading] = useState(false);
   const [status, setStatus] = useState("PENDING");
   const [q, setQ] = useState("");
 
@@ -23,29 +20,14 @@ export default function StaffTickets() {
   const [chatOpen, setChatOpen] = useState(false);
   const [chatUid, setChatUid] = useState(null);
 
-  const load = async () => {
-    setLoading(true);
-    try {
-      const qs = new URLSearchParams({
-        page: String(page),
-        page_size: String(pageSize),
-      });
-      if (status) qs.set("status", status);
-      if (q.trim()) qs.set("q", q.trim());
-
-      // dùng endpoint đã mở quyền ADMIN+STAFF
-      const res = await apiFetch(`/ve/admin/list?${qs.toString()}`);
-      const items = Array.isArray(res?.items) ? res.items : (res || []);
-      setRows(items);
-      setTotal(Number(res?.total ?? items.length));
-    } catch (e) {
-      message.error(e?.message || "Không tải được danh sách vé");
-    } finally {
-      setLoading(false);
-    }
-  };
+  // dùng endpoint đã mở quyền ADMIN+STAFF; phân trang bằng cursor
+  const pager = useCursorPager(
+    (opts) => apiAdminListTickets({ status, q: q.trim(), ...opts }),
+    { onError: (e) => message.error(e?.message || "Không tải được danh sách vé") }
+  );
+  const load = pager.load;
 
-  useEffect(() => { load(); /* eslint-disable-next-line */ }, [page, pageSize, status]);
+  useEffect(() => { load(1); /* eslint-disable-next-line */ }, [status]);
 
   const approve = async (r) => {
     try {
@@ -57,6 +39,16 @@ export default function StaffTickets() {
     }
   };
 
+  const checkin = async (r) => {
+    try {
+      await apiFetch(`/nhan-vien/ops/ve/${r.id}/checkin`, { method: "POST" });
+      message.success("Đã check-in");
+      load();
+    } catch (e) {
+      message.error(e?.message || "Không check-in được vé");
+    }
+  };
+
   const cancel = async (r) => {
     try {
       await apiFetch(`/nhan-vien/ops/ve/${r.id}/cancel`, { method: "POST" });
@@ -88,7 +80,7 @@ export default function StaffTickets() {
       title: "Trạng thái",
       dataIndex: "trang_thai",
       width: 140,
-      render: (s) => <Tag color={s==="PAID"?"green":s==="PENDING"?"orange":s==="BOOKED"?"blue":"red"}>{s}</Tag>
+      render: (s) => <Tag color={s==="PAID"?"green":s==="CHECKIN"||s==="USED"?"cyan":s==="PENDING"?"orange":s==="BOOKED"?"blue":"red"}>{s}</Tag>
     },
     {
       title: "Thao tác",
@@ -97,8 +89,9 @@ export default function StaffTickets() {
         const s = r.trang_thai;
         const canApprove = s === "PENDING" || s === "BOOKED" || s === "UNPAID";
         const canCancel  = s === "PENDING" || s === "BOOKED" || s === "UNPAID";
-        if (!canApprove && !canCancel) {
-          // PAID / CANCELLED => không hiện nút nào
+        const canCheckin = s === "PAID";
+        if (!canApprove && !canCancel && !canCheckin) {
+          // CHECKIN / USED / CANCELLED => không hiện nút nào
           return null;
         }
         return (
@@ -106,6 +99,9 @@ export default function StaffTickets() {
             {canApprove && (
               <Button type="primary" onClick={() => approve(r)}>Duyệt</Button>
             )}
+            {canCheckin && (
+              <Button type="primary" onClick={() => checkin(r)}>Check-in</Button>
+            )}
             {canCancel && (
               <Button danger onClick={() => cancel(r)}>Hủy</Button>
             )}
@@ -128,32 +124,26 @@ export default function StaffTickets() {
           placeholder="Tìm theo username / tên sự kiện"
           value={q}
           onChange={(e) => setQ(e.target.value)}
-          onPressEnter={() => { setPage(1); load(); }}
+          onPressEnter={() => load(1)}
           style={{ width: 320 }}
         />
         <Select
           value={status}
-          onChange={(v) => { setStatus(v); setPage(1); }}
+          onChange={setStatus}
           options={STATUS_OPTS}
           style={{ width: 160 }}
         />
-        <Button onClick={() => { setPage(1); load(); }}>Làm mới</Button>
+        <Button onClick={() => load(1)}>Làm mới</Button>
       </Space>
 
       <Table
         rowKey="id"
-        loading={loading}
-        dataSource={rows}
+        loading={pager.loading}
+        dataSource={pager.rows}
         columns={cols}
-        pagination={{
-          current: page,
-          pageSize,
-          total,
-          showSizeChanger: true,
-          onChange: (p, ps) => { setPage(p); setPageSize(ps); },
-          locale: { items_per_page: "/ trang" }
-        }}
+        pagination={false}
       />
+      <CursorPager pager={pager} />
 
       <SupportChatDrawer
         open={chatOpen}